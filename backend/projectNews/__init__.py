@@ -0,0 +1,4 @@
+# 確保 Django 啟動時載入 Celery app，shared_task 才會綁定到它
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
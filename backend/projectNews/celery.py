@@ -23,6 +23,6 @@ app.conf.beat_schedule = {
     },
     'cleanup-old-files': {
         'task': 'storyboard.tasks.cleanup_old_files',
-        'schedule': crontab(hour=0, minute=0),  # 每天午夜執行
+        'schedule': crontab(minute='*/30'),  # 每30分鐘檢查一次容量上限
     },
 } 
\ No newline at end of file
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -186,6 +187,60 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# 人偶段落分段平行渲染使用的行程數 (1 = 不分段)
+AVATAR_RENDER_WORKERS = int(os.environ.get('AVATAR_RENDER_WORKERS', min(os.cpu_count() or 1, 8)))
+# 人偶去背模式：reference (原始算法) 或 fast (LUT + 低解析度模糊，遮罩邊緣與原始算法略有差異)
+AVATAR_KEYER_MODE = os.environ.get('AVATAR_KEYER_MODE', 'reference')
+# 畫面亮度平均變化低於此值時沿用上一幀的遮罩 (None = 關閉)
+AVATAR_KEYER_TEMPORAL_TOLERANCE = None
+# 圖層與人偶的合成精度：float (float32) 或 fixed (uint8 定點運算，記憶體約 1/4)
+COMPOSITE_PRECISION = os.environ.get('COMPOSITE_PRECISION', 'float')
+# fixed 模式與 float 結果比較的 PSNR 下限 (dB)，低於此值的工作 / 人偶影片改用 float
+COMPOSITE_MIN_PSNR = float(os.environ.get('COMPOSITE_MIN_PSNR', 40.0))
+# 渲染模式：segments (逐段輸出後串接) 或 timeline (整份分鏡一次編碼)
+RENDER_MODE = os.environ.get('RENDER_MODE', 'segments')
+# 旁白字幕：off、burn (燒進畫面)、soft (mov_text 字幕軌) 或 both
+CAPTION_MODE = os.environ.get('CAPTION_MODE', 'off')
+CAPTION_FONT_PATH = os.path.join(BASE_DIR, 'font', 'NotoSansTC-Bold.ttf')
+# 以內容雜湊快取段落影片、TTS 音檔、人偶影片與下載的圖片，重送時只重做有變動的部分
+RENDER_CACHE_ENABLED = os.environ.get('RENDER_CACHE_ENABLED', '1') == '1'
+RENDER_CACHE_DIR = os.environ.get('RENDER_CACHE_DIR', os.path.join(BASE_DIR, 'render_cache'))
+# 各版面預先變換好的底圖 (.npy)，渲染行程以唯讀記憶體映射共用 (空值 = 關閉)
+PLATE_STORE_DIR = os.environ.get('PLATE_STORE_DIR', os.path.join(RENDER_CACHE_DIR, 'plates'))
+# 同時渲染的段落數 (1 = 依序渲染)
+PARAGRAPH_RENDER_WORKERS = int(os.environ.get('PARAGRAPH_RENDER_WORKERS', min(os.cpu_count() or 1, 4)))
+# 段落平行渲染的記憶體上限，用來限制同時存在的 full-HD 浮點緩衝區數量
+RENDER_MEMORY_BUDGET_MB = int(os.environ.get('RENDER_MEMORY_BUDGET_MB', 2048))
+# 其他主機 (共用 generated/ volume) 取得的工作目錄租約，超過此秒數未釋放視為失效
+JOB_LEASE_TTL_SECONDS = int(os.environ.get('JOB_LEASE_TTL_SECONDS', 6 * 3600))
+# generated/ 與渲染快取的容量上限，由 cleanup_old_files 排程工作依最近使用時間清理
+GENERATED_QUOTA_MB = int(os.environ.get('GENERATED_QUOTA_MB', 20480))
+RENDER_CACHE_QUOTA_MB = int(os.environ.get('RENDER_CACHE_QUOTA_MB', 10240))
+# 影片下載：django (Django 串流，支援 Range)、x-accel (nginx X-Accel-Redirect) 或 x-sendfile (Apache / lighttpd)
+VIDEO_DELIVERY_MODE = os.environ.get('VIDEO_DELIVERY_MODE', 'django')
+# x-accel 模式下對應 generated/ 的 nginx internal location
+VIDEO_ACCEL_REDIRECT_PREFIX = os.environ.get('VIDEO_ACCEL_REDIRECT_PREFIX', '/protected/generated/')
+# x-accel / x-sendfile 由 web server 在請求結束後才開啟成品：最近這段時間內讀取過的工作目錄不會被整個移除
+VIDEO_SERVE_GRACE_SECONDS = int(os.environ.get('VIDEO_SERVE_GRACE_SECONDS', 3600))
+# Celery：影片生成在背景 worker 執行，API 立即回傳工作 ID
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', CELERY_BROKER_URL)
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_SERIALIZER = 'json'
+CELERY_TASK_TRACK_STARTED = True
+# 渲染工作很長：每個 worker 一次只取一個工作，完成後才確認
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ACKS_LATE = True
+# 開發環境沒有 broker 時可改為在請求中直接執行
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', '0') == '1'
+# 渲染可用的核心數，由節點上同時執行的工作平分 (跨 worker 行程；ffmpeg 執行緒、OpenCV、渲染行程數、媒體下載)
+RENDER_CPU_CORES = int(os.environ.get('RENDER_CPU_CORES', os.cpu_count() or 1))
+# 平行度由渲染行程控制，numpy / BLAS 在每個行程內只用單執行緒
+# (只對之後才載入 numpy 的行程有效；已建立的 BLAS 執行緒池不會因此縮小)
+for _blas_var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(_blas_var, '1')
 '''
 DATABASES = {
     'default': {
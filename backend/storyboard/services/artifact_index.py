@@ -0,0 +1,82 @@
+import json
+import os
+import tempfile
+
+from .render_cache import file_digest
+
+
+# 每個工作目錄中記錄最終成品的索引檔
+ARTIFACT_INDEX_FILE = 'final_artifact.json'
+
+
+def write_artifact_index(video_path, content_type='video/mp4'):
+    """
+    Records the final video of a job in its workspace (ARTIFACT_INDEX_FILE) once the render
+    is complete: file name, size, mtime and a content hash used as ETag, so delivery
+    never has to scan the directory or read the file to answer a request.
+
+    :param video_path: Final video inside the job workspace
+    :param content_type: MIME type of the video
+    :return: The index entry
+    """
+    job_dir = os.path.dirname(os.path.abspath(video_path))
+    stat = os.stat(video_path)
+    entry = {
+        'file': os.path.basename(video_path),
+        'content_type': content_type,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'etag': file_digest(video_path)[:32],
+    }
+    subtitles = os.path.splitext(video_path)[0] + '.vtt'
+    if os.path.exists(subtitles):
+        entry['subtitles'] = os.path.basename(subtitles)
+
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', suffix='.json', dir=job_dir)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(job_dir, ARTIFACT_INDEX_FILE))
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return entry
+
+
+def _find_final_video(job_dir):
+    for filename in sorted(os.listdir(job_dir)):
+        if 'final_video' in filename and filename.endswith('.mp4'):
+            return os.path.join(job_dir, filename)
+    return None
+
+
+def read_artifact_index(job_dir):
+    """
+    Final artifact of a job: its index entry plus the absolute 'path'.
+    Jobs rendered before the index existed are indexed on their first request, and an entry
+    whose file has changed since it was written is refreshed.
+
+    :param job_dir: Job workspace
+    :return: Index entry, or None when the job has no finished video
+    """
+    try:
+        with open(os.path.join(job_dir, ARTIFACT_INDEX_FILE), encoding='utf-8') as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        video_path = _find_final_video(job_dir) if os.path.isdir(job_dir) else None
+        entry = write_artifact_index(video_path) if video_path else None
+    except ValueError:
+        entry = None
+    if entry is None:
+        return None
+
+    path = os.path.join(job_dir, entry['file'])
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if stat.st_size != entry['size'] or stat.st_mtime_ns != entry['mtime_ns']:
+        entry = write_artifact_index(path, entry.get('content_type', 'video/mp4'))
+    entry['path'] = path
+    return entry
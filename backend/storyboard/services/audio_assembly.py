@@ -0,0 +1,92 @@
+import subprocess
+import tempfile
+
+import numpy as np
+
+from .ffmpeg_writer import SEGMENT_AUDIO_ARGS, SEGMENT_AUDIO_CHANNELS, SEGMENT_AUDIO_RATE, get_ffmpeg_exe
+
+
+def decode_pcm(path, sample_rate=SEGMENT_AUDIO_RATE, channels=SEGMENT_AUDIO_CHANNELS):
+    """
+    Decodes the first audio stream of a media file to interleaved 16-bit PCM.
+
+    :param path: Path to the media file
+    :param sample_rate: Output sample rate
+    :param channels: Output channel count
+    :return: int16 array of shape (samples, channels); empty when the file has no audio
+    """
+    result = subprocess.run(
+        [get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-nostdin', '-i', path,
+         '-map', '0:a:0?', '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+         '-ar', str(sample_rate), '-ac', str(channels), '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        log = result.stderr.decode('utf-8', 'replace')
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}) decoding {path}: {log[-2000:]}")
+    return np.frombuffer(result.stdout, dtype=np.int16).reshape(-1, channels)
+
+
+def fit_samples(pcm, sample_count, fade_samples=0):
+    """
+    Trims or pads (with silence) a PCM block to exactly sample_count samples.
+    A short fade at both ends keeps the joins between paragraphs click-free.
+
+    :param pcm: int16 array of shape (samples, channels)
+    :param sample_count: Required length in samples
+    :param fade_samples: Length of the fade-in / fade-out
+    """
+    block = np.zeros((sample_count, pcm.shape[1]), dtype=np.int16)
+    used = min(sample_count, len(pcm))
+    block[:used] = pcm[:used]
+    fade = min(fade_samples, used // 2)
+    if fade:
+        ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)[:, np.newaxis]
+        block[:fade] = (block[:fade] * ramp).astype(np.int16)
+        block[used - fade:used] = (block[used - fade:used] * ramp[::-1]).astype(np.int16)
+    return block
+
+
+def assemble_audio(parts, output_path, sample_rate=SEGMENT_AUDIO_RATE, channels=SEGMENT_AUDIO_CHANNELS,
+                   fade_ms=5):
+    """
+    Builds the audio track of the whole video: every part is decoded to PCM, cut to its exact
+    sample span, and streamed into one AAC encoder, so the audio is encoded exactly once.
+
+    :param parts: List of (media_path or None for silence, sample_count)
+    :param output_path: Path of the audio file to write (.m4a)
+    :param sample_rate: Sample rate of the track
+    :param channels: Channel count of the track
+    :param fade_ms: Fade at each paragraph boundary, in milliseconds
+    """
+    fade_samples = int(sample_rate * fade_ms / 1000)
+    cmd = [get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-y',
+           '-f', 's16le', '-ar', str(sample_rate), '-ac', str(channels), '-i', '-',
+           ] + SEGMENT_AUDIO_ARGS + [output_path]
+    log = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=log)
+    try:
+        for media_path, sample_count in parts:
+            if sample_count <= 0:
+                continue
+            pcm = decode_pcm(media_path, sample_rate, channels) if media_path else np.zeros((0, channels), np.int16)
+            proc.stdin.write(fit_samples(pcm, sample_count, fade_samples).tobytes())
+        proc.stdin.close()
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        log.close()
+        raise
+    returncode = proc.wait()
+    log.seek(0)
+    message = log.read().decode('utf-8', 'replace')
+    log.close()
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({returncode}) writing {output_path}: {message[-2000:]}")
+    return output_path
+
+
+def samples_for_frames(frame_count, fps, sample_rate=SEGMENT_AUDIO_RATE):
+    """
+    Number of audio samples spanned by frame_count video frames.
+    """
+    return int(round(frame_count * sample_rate / fps))
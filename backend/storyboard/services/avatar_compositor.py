@@ -0,0 +1,195 @@
+import copy
+
+import cv2
+import numpy as np
+
+from .avatar_keyer import AvatarKeyer
+from .ffmpeg_reader import FFmpegPipeReader
+from .layer_compositor import PRECISIONS, axis_aligned_rect, psnr, quad_roi
+
+
+class AvatarFrameCompositor:
+    """
+    Keys an avatar clip and places it on a composed background, frame by frame.
+
+    Everything that is constant for the whole clip (placement homography, destination ROI,
+    background plate in the working dtype, scratch buffers) is prepared once in __init__,
+    so compose() only touches the avatar ROI of each frame.
+    When the placement is an axis-aligned rectangle inside the canvas, the avatar is scaled
+    straight to the ROI size and blended without any per-frame warp.
+    Frames are handled in BGR, the bgr24 layout FFmpegPipeReader decodes and FFmpegPipeWriter encodes.
+    """
+
+    def __init__(self, composed_background, crop_coords, placement_coords, threshold, blur_ksize=21, keyer=None,
+                 precision='float'):
+        """
+        :param composed_background: Composed background image (RGB uint8, from compose_background_with_scenes)
+        :param crop_coords: Coordinates for cropping the input video (x, y, w, h)
+        :param placement_coords: Avatar quad on the background (tl, tr, br, bl)
+        :param threshold: Threshold for background removal
+        :param blur_ksize: Gaussian kernel size used to soften the mask edge
+        :param keyer: AvatarKeyer producing the alpha mask (default: reference keyer)
+        :param precision: Alpha blending math, 'float' (float32) or 'fixed' (uint8 fixed point)
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown compositing precision: {precision}")
+        self.crop_coords = crop_coords
+        self.keyer = keyer or AvatarKeyer(threshold, blur_ksize=blur_ksize)
+        self.fixed_point = precision == 'fixed'
+
+        bg_height, bg_width = composed_background.shape[:2]
+        self.canvas_size = (bg_width, bg_height)
+        tl, tr, br, bl = placement_coords
+
+        self.placed_width = int(max(tr[0], br[0]) - min(tl[0], bl[0]))
+        self.placed_height = int(max(bl[1], br[1]) - min(tl[1], tr[1]))
+
+        # 人偶只會出現在四邊形的外接矩形內
+        dst_pts = np.array([tl, tr, bl, br], dtype=np.float32)
+        self.roi = quad_roi(dst_pts, self.canvas_size)
+        if self.roi is None:
+            raise ValueError(f"Avatar placement {placement_coords} is outside the canvas {self.canvas_size}")
+        x0, y0, x1, y1 = self.roi
+        self.roi_size = (x1 - x0, y1 - y0)
+
+        rect = axis_aligned_rect([tl, tr, br, bl])
+        self.axis_aligned = rect is not None and rect == self.roi
+        if self.axis_aligned:
+            # 矩形且完全在畫布內：人偶直接縮放成 ROI 大小，不需要透視變換
+            self.placed_width, self.placed_height = self.roi_size
+            self.M = None
+        else:
+            # 透視變換矩陣整段影片只算一次（已平移到 ROI 座標）
+            src_pts = np.array([[0, 0],
+                                [self.placed_width - 1, 0],
+                                [0, self.placed_height - 1],
+                                [self.placed_width - 1, self.placed_height - 1]], dtype=np.float32)
+            self.M = cv2.getPerspectiveTransform(src_pts, dst_pts - np.array([x0, y0], dtype=np.float32))
+
+        # 輸出畫面：背景只寫一次，之後每幀只覆寫 ROI
+        self.output = cv2.cvtColor(composed_background, cv2.COLOR_RGB2BGR)
+        self.output_roi = self.output[y0:y1, x0:x1]
+
+        placed_shape = (self.placed_height, self.placed_width)
+        roi_shape = (self.roi_size[1], self.roi_size[0])
+        self._placed = np.empty(placed_shape + (3,), dtype=np.uint8)
+        if self.fixed_point:
+            self.background_roi = self.output_roi.copy()
+            self._mask3 = np.empty(placed_shape + (3,), dtype=np.uint8)
+            self._foreground = np.empty(placed_shape + (3,), dtype=np.uint8)
+            if self.M is not None:
+                self._warped_foreground = np.empty(roi_shape + (3,), dtype=np.uint8)
+                self._warped_alpha = np.empty(roi_shape + (3,), dtype=np.uint8)
+            self._blended = np.empty(roi_shape + (3,), dtype=np.uint8)
+        else:
+            self.background_roi = self.output_roi.astype(np.float32)
+            self._alpha = np.empty(placed_shape, dtype=np.float32)
+            self._foreground = np.empty(placed_shape + (3,), dtype=np.float32)
+            if self.M is not None:
+                self._warped_foreground = np.empty(roi_shape + (3,), dtype=np.float32)
+                self._warped_alpha = np.empty(roi_shape, dtype=np.float32)
+            self._blended = np.empty(roi_shape + (3,), dtype=np.float32)
+
+    def compose(self, frame):
+        """
+        Composites one decoded avatar frame onto the background.
+
+        :param frame: Full-resolution BGR frame from the avatar video
+        :return: BGR canvas; the buffer is reused by the next call
+        """
+        x, y, w, h = self.crop_coords
+        cv2.resize(frame[y:y+h, x:x+w], (self.placed_width, self.placed_height), dst=self._placed)
+        return self.compose_placed(self._placed)
+
+    def compose_placed(self, placed):
+        """
+        Composites an avatar frame that is already cropped and scaled to the placed size,
+        e.g. straight from an FFmpegPipeReader whose filter graph did the crop and scale.
+
+        :param placed: BGR uint8 frame of shape (placed_height, placed_width, 3)
+        :return: BGR canvas; the buffer is reused by the next call
+        """
+        # 去背遮罩：門檻值 + 高斯模糊柔化邊緣
+        mask = self.keyer.key(placed)
+        if self.fixed_point:
+            self._blend_fixed_point(placed, mask)
+        else:
+            self._blend_float(placed, mask)
+        return self.output
+
+    def _blend_float(self, placed, mask):
+        np.multiply(mask, np.float32(1.0 / 255.0), out=self._alpha)
+        np.multiply(placed, self._alpha[:, :, np.newaxis], out=self._foreground)
+
+        foreground, alpha = self._foreground, self._alpha
+        if self.M is not None:
+            cv2.warpPerspective(foreground, self.M, self.roi_size, dst=self._warped_foreground)
+            cv2.warpPerspective(alpha, self.M, self.roi_size, dst=self._warped_alpha)
+            foreground, alpha = self._warped_foreground, self._warped_alpha
+
+        # blended = background * (1 - alpha) + foreground，只在 ROI 內計算
+        np.subtract(1.0, alpha, out=alpha)
+        np.multiply(self.background_roi, alpha[:, :, np.newaxis], out=self._blended)
+        self._blended += foreground
+        np.copyto(self.output_roi, self._blended, casting='unsafe')
+
+    def _blend_fixed_point(self, placed, mask):
+        # 同樣的公式改用 uint8 定點運算 (x * a / 255 由 OpenCV 四捨五入)
+        cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR, dst=self._mask3)
+        cv2.multiply(placed, self._mask3, dst=self._foreground, scale=1.0 / 255.0)
+
+        foreground, alpha = self._foreground, self._mask3
+        if self.M is not None:
+            cv2.warpPerspective(foreground, self.M, self.roi_size, dst=self._warped_foreground)
+            cv2.warpPerspective(alpha, self.M, self.roi_size, dst=self._warped_alpha)
+            foreground, alpha = self._warped_foreground, self._warped_alpha
+
+        cv2.bitwise_not(alpha, dst=alpha)
+        cv2.multiply(self.background_roi, alpha, dst=self._blended, scale=1.0 / 255.0)
+        cv2.add(self._blended, foreground, dst=self._blended)
+        self.output_roi[...] = self._blended
+
+
+def validate_avatar_precision(input_video, composed_background, crop_coords, placement_coords, threshold, keyer=None,
+                              min_psnr=40.0):
+    """
+    Composites the first frame of an avatar clip with the float and the fixed-point blend
+    and compares them.
+
+    :param input_video: Path to the avatar clip
+    :param composed_background: Composed background image (RGB uint8)
+    :param crop_coords: Coordinates for cropping the input video (x, y, w, h)
+    :param placement_coords: Avatar quad on the background (tl, tr, br, bl)
+    :param threshold: Threshold for background removal
+    :param keyer: AvatarKeyer used for the clip (copied, its state is left alone)
+    :param min_psnr: PSNR (dB) the fixed-point result must reach
+    :return: (passed, psnr_db)
+    """
+    compositors = [AvatarFrameCompositor(composed_background, crop_coords, placement_coords, threshold,
+                                         keyer=copy.deepcopy(keyer), precision=precision)
+                   for precision in ('float', 'fixed')]
+    reference, candidate = compositors
+    with FFmpegPipeReader(input_video, (reference.placed_width, reference.placed_height), crop=crop_coords,
+                          frame_count=1) as reader:
+        placed = reader.read()
+        if placed is None:
+            return True, float('inf')
+        value = psnr(reference.compose_placed(placed), candidate.compose_placed(placed))
+    return value >= min_psnr, value
+
+
+def checked_avatar_precision(precision, input_video, composed_background, crop_coords, placement_coords, threshold,
+                             keyer=None, min_psnr=40.0):
+    """
+    Returns the blend precision to use for an avatar clip: `precision`, unless it is 'fixed'
+    and the fixed-point blend of the clip's first frame falls below min_psnr against the float blend.
+    """
+    if precision != 'fixed':
+        return precision
+    passed, value = validate_avatar_precision(input_video, composed_background, crop_coords, placement_coords,
+                                              threshold, keyer, min_psnr)
+    print(f"Fixed-point avatar blend PSNR: {value:.2f} dB")
+    if not passed:
+        print(f"Fixed-point avatar blend below {min_psnr} dB, using float")
+        return 'float'
+    return precision
@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+
+
+class AvatarKeyer:
+    """
+    Builds the soft alpha mask that separates the avatar from its dark studio background.
+
+    Modes:
+        reference: the original path, threshold + 21x21 Gaussian blur at full resolution
+        fast:      256-entry LUT threshold, Gaussian blur computed at 1/downscale resolution
+                   and upsampled
+    With temporal_tolerance set, the previous mask is reused while the mean absolute
+    difference of the (downscaled) luma stays below the tolerance.
+    """
+
+    MODES = ('reference', 'fast')
+
+    def __init__(self, threshold, mode='reference', blur_ksize=21, downscale=2, temporal_tolerance=None):
+        """
+        :param threshold: Luma below this value is treated as background
+        :param mode: One of MODES
+        :param blur_ksize: Gaussian kernel size of the reference blur
+        :param downscale: Resolution divisor of the fast blur
+        :param temporal_tolerance: Mean luma delta (0-255) under which the previous mask is reused
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown keyer mode: {mode}")
+        self.threshold = threshold
+        self.mode = mode
+        self.blur_ksize = blur_ksize
+        self.downscale = downscale if mode == 'fast' else 1
+        self.temporal_tolerance = temporal_tolerance
+
+        self._lut = np.where(np.arange(256) < threshold, 0, 255).astype(np.uint8)
+        # 與 cv2.GaussianBlur(ksize, 0) 相同的 sigma，縮小後等比例縮小
+        self._sigma = (0.3 * ((blur_ksize - 1) * 0.5 - 1) + 0.8) / self.downscale
+        self._shape = None
+        self.reused_frames = 0
+
+    def _allocate(self, shape):
+        height, width = shape
+        self._shape = shape
+        self._small_size = (max(width // self.downscale, 1), max(height // self.downscale, 1))
+        self._gray = np.empty(shape, dtype=np.uint8)
+        self._binary = np.empty(shape, dtype=np.uint8)
+        self._mask = np.empty(shape, dtype=np.uint8)
+        self._small = np.empty((self._small_size[1], self._small_size[0]), dtype=np.uint8)
+        self._small_blurred = np.empty_like(self._small)
+        self._probe = np.empty((max(height // 8, 1), max(width // 8, 1)), dtype=np.uint8)
+        self._previous_probe = None
+
+    def key(self, frame):
+        """
+        Returns the uint8 alpha mask (0 = background, 255 = avatar) of a BGR frame.
+        The returned array is reused by the next call.
+
+        :param frame: BGR uint8 frame, already cropped and resized to the placed size
+        """
+        if self._shape != frame.shape[:2]:
+            self._allocate(frame.shape[:2])
+
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray)
+
+        if self.temporal_tolerance is not None:
+            cv2.resize(self._gray, (self._probe.shape[1], self._probe.shape[0]), dst=self._probe,
+                       interpolation=cv2.INTER_AREA)
+            if (self._previous_probe is not None
+                    and cv2.norm(self._probe, self._previous_probe, cv2.NORM_L1) / self._probe.size
+                    < self.temporal_tolerance):
+                self.reused_frames += 1
+                return self._mask
+            self._previous_probe = self._probe.copy()
+
+        if self.mode == 'reference':
+            cv2.threshold(self._gray, self.threshold - 1, 255, cv2.THRESH_BINARY, dst=self._binary)
+            cv2.GaussianBlur(self._binary, (self.blur_ksize, self.blur_ksize), 0, dst=self._mask)
+        else:
+            cv2.LUT(self._gray, self._lut, dst=self._binary)
+            # 在低解析度做模糊再放大，遮罩邊緣本來就是柔化的，差異肉眼看不出來
+            cv2.resize(self._binary, self._small_size, dst=self._small, interpolation=cv2.INTER_AREA)
+            cv2.GaussianBlur(self._small, (0, 0), self._sigma, dst=self._small_blurred)
+            cv2.resize(self._small_blurred, (self._shape[1], self._shape[0]), dst=self._mask,
+                       interpolation=cv2.INTER_LINEAR)
+        return self._mask
@@ -0,0 +1,132 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from .avatar_compositor import AvatarFrameCompositor
+from .captions import CaptionOverlay
+from .cpu_budget import apply_thread_limits, split_threads, thread_limit
+from .encoder_profiles import get_encoder_profile
+from .ffmpeg_reader import FFmpegPipeReader
+from .media_probe import probe_video_timing
+from .ffmpeg_writer import SEGMENT_FPS, FFmpegPipeWriter, concat_copy, get_ffmpeg_exe, segment_audio_args
+
+
+def probe_keyframe_times(input_video):
+    """
+    Returns the presentation times (seconds) of the keyframes of the first video stream.
+    Only keyframes are decoded, so this is cheap even for long clips.
+
+    :param input_video: Path to the video file
+    """
+    result = subprocess.run(
+        [get_ffmpeg_exe(), '-hide_banner', '-skip_frame', 'nokey', '-i', input_video,
+         '-map', '0:v:0', '-vf', 'showinfo', '-f', 'null', '-'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    log = result.stderr.decode('utf-8', 'replace')
+    return [float(t) for t in re.findall(r'pts_time:\s*([-\d.]+)', log)]
+
+
+def plan_shards(frame_count, fps, keyframe_times, workers):
+    """
+    Splits [0, frame_count) into at most `workers` contiguous frame ranges
+    whose boundaries sit on keyframes, so every shard can seek straight to its start.
+
+    :param frame_count: Number of frames in the clip
+    :param fps: Frames per second of the clip
+    :param keyframe_times: Keyframe times in seconds (see probe_keyframe_times)
+    :param workers: Desired number of shards
+    :return: List of (start_frame, end_frame) tuples
+    """
+    keyframes = sorted({int(round(t * fps)) for t in keyframe_times if 0 < t * fps < frame_count})
+    boundaries = [0]
+    for i in range(1, workers):
+        target = frame_count * i / workers
+        if not keyframes:
+            break
+        # 對齊到最接近的 keyframe
+        nearest = min(keyframes, key=lambda k: abs(k - target))
+        if nearest > boundaries[-1]:
+            boundaries.append(nearest)
+    boundaries.append(frame_count)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+
+def _render_shard(input_video, shard_path, start_frame, end_frame, fps,
+                  threshold, composed_background, crop_coords, placement_coords, keyer=None, encoder_profile=None,
+                  caption_cues=None, precision='float'):
+    """
+    Worker: composites frames [start_frame, end_frame) of the avatar clip into a silent shard.
+    """
+    compositor = AvatarFrameCompositor(composed_background, crop_coords, placement_coords, threshold, keyer=keyer,
+                                       precision=precision)
+    captions = None
+    if caption_cues:
+        captions = CaptionOverlay(caption_cues, compositor.canvas_size)
+        captions.attach(compositor.output, dynamic_rect=compositor.roi)
+    bg_height, bg_width = composed_background.shape[:2]
+    profile = get_encoder_profile(encoder_profile)
+    # 由 ffmpeg 跳到 shard 起點，並在解碼端完成裁切與縮放
+    with FFmpegPipeReader(input_video, (compositor.placed_width, compositor.placed_height), crop=crop_coords,
+                          start_time=start_frame / fps, frame_count=end_frame - start_frame) as reader, \
+            FFmpegPipeWriter(shard_path, (bg_width, bg_height), fps, output_fps=SEGMENT_FPS,
+                             preset=profile.preset, crf=profile.crf) as writer:
+        for frame_index, placed in enumerate(reader, start=start_frame):
+            frame = compositor.compose_placed(placed)
+            if captions is not None:
+                captions.update(frame_index)
+            writer.write(frame)
+    return shard_path
+
+
+def render_avatar_sharded(input_video, output_video, threshold, composed_background,
+                          crop_coords, placement_coords, workers, keyer=None, encoder_profile=None, with_audio=True,
+                          caption_cues=None, precision='float'):
+    """
+    Time-sharded version of avatar_2_background.
+    The clip is split on keyframe boundaries, each range is composited and encoded in its
+    own worker process, and the shards are joined with a stream-copy concat that also
+    copies the original audio track (unless with_audio is False).
+
+    :param input_video: Path to the input video file
+    :param output_video: Path to save the output video file
+    :param threshold: Threshold for background removal
+    :param composed_background: Composed background image
+    :param crop_coords: Coordinates for cropping the input video
+    :param placement_coords: Coordinates for placing the video on the background
+    :param workers: Number of worker processes
+    :param keyer: AvatarKeyer configuration, copied into every worker
+    :param encoder_profile: EncoderProfile giving the x264 preset and CRF of the shards
+    :param with_audio: Copy the clip's audio track into the output
+    :param caption_cues: CaptionCue list (in frames of the input clip) burned into the output
+    :param precision: Alpha blending of the compositor, 'float' or 'fixed'
+    """
+    fps, frame_count = probe_video_timing(input_video)
+
+    shards = plan_shards(frame_count, fps, probe_keyframe_times(input_video), workers)
+    print(f"Rendering {os.path.basename(input_video)} in {len(shards)} shards: {shards}")
+
+    shard_dir = tempfile.mkdtemp(prefix='shards_', dir=os.path.dirname(os.path.abspath(output_video)))
+    try:
+        # 本行程分到的執行緒平均分給各 shard
+        threads = split_threads(thread_limit() or len(shards), len(shards))
+        with ProcessPoolExecutor(max_workers=len(shards), initializer=apply_thread_limits,
+                                 initargs=(threads,)) as executor:
+            futures = [
+                executor.submit(_render_shard, input_video,
+                                os.path.join(shard_dir, f'shard_{i:03d}.mp4'),
+                                start, end, fps, threshold, composed_background,
+                                crop_coords, placement_coords, keyer, encoder_profile, caption_cues, precision)
+                for i, (start, end) in enumerate(shards)
+            ]
+            shard_paths = [future.result() for future in futures]
+
+        if with_audio:
+            concat_copy(shard_paths, output_video, audio_source=input_video, duration=frame_count / fps,
+                        audio_args=segment_audio_args(input_video))
+        else:
+            concat_copy(shard_paths, output_video, duration=frame_count / fps)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
@@ -0,0 +1,313 @@
+import os
+import re
+from bisect import bisect_right
+from collections import namedtuple
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from django.conf import settings
+from PIL import Image, ImageDraw, ImageFont
+
+from .ffmpeg_writer import run_ffmpeg
+
+
+# off: 不加字幕；burn: 燒進畫面；soft: 只封裝 mov_text 字幕軌；both: 兩者皆做
+CAPTION_MODES = ('off', 'burn', 'soft', 'both')
+
+# 斷行優先落在標點之後
+_CAPTION_BREAK = re.compile(r'(?<=[，。！？；：、,.!?;:])|\n')
+
+# 字幕相對於畫布高度的字級、下緣留白與最大寬度
+CAPTION_FONT_RATIO = 0.044
+CAPTION_MARGIN_RATIO = 0.02
+CAPTION_WIDTH_RATIO = 0.8
+
+
+class CaptionCue(namedtuple('CaptionCue', ['start_frame', 'end_frame', 'text'])):
+    """
+    One caption line shown on frames [start_frame, end_frame).
+    """
+    __slots__ = ()
+
+
+@lru_cache(maxsize=16)
+def load_font(font_path, font_size):
+    """
+    ImageFont.truetype, loaded once per (font, size) in each process.
+    """
+    if not os.path.exists(font_path):
+        raise FileNotFoundError(f"Font file not found: {font_path}")
+    return ImageFont.truetype(font_path, font_size)
+
+
+def default_caption_font(canvas_size):
+    """
+    NotoSansTC-Bold (CAPTION_FONT_PATH setting) at a size proportional to the canvas height.
+    """
+    font_path = getattr(settings, 'CAPTION_FONT_PATH', os.path.join(settings.BASE_DIR, 'font', 'NotoSansTC-Bold.ttf'))
+    return load_font(font_path, max(12, int(round(canvas_size[1] * CAPTION_FONT_RATIO))))
+
+
+def render_text(text, font, padding=0, bg_color=(255, 255, 255, 0), text_color=(255, 255, 255, 255)):
+    """
+    Rasterizes one line of text into an RGBA image just large enough to hold it.
+
+    :param text: Text to draw
+    :param font: PIL font
+    :param padding: Padding around the text in pixels
+    :param bg_color: RGBA background color
+    :param text_color: RGBA text color
+    :return: PIL RGBA image
+    """
+    bbox = font.getbbox(text)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+    image = Image.new('RGBA', (text_width + 2 * padding, text_height + 2 * padding), bg_color)
+    # 依字框上緣調整位置，文字貼齊內邊距
+    ImageDraw.Draw(image).text((padding - bbox[0], padding - bbox[1]), text, font=font, fill=text_color)
+    return image
+
+
+def wrap_caption(text, font, max_width):
+    """
+    Breaks a voiceover into caption lines no wider than max_width pixels,
+    preferring breaks after punctuation.
+    """
+    lines = []
+    for phrase in _CAPTION_BREAK.split(text or ''):
+        phrase = phrase.strip()
+        line = ''
+        for char in phrase:
+            if line and font.getlength(line + char) > max_width:
+                lines.append(line.strip())
+                line = ''
+            line += char
+        if line.strip():
+            lines.append(line.strip())
+    return lines
+
+
+def build_caption_cues(lines, frame_count):
+    """
+    Spreads caption lines over a paragraph's frames in proportion to their length,
+    the same pace at which the voiceover reads them.
+
+    :param lines: Caption lines (see wrap_caption)
+    :param frame_count: Frames of the paragraph
+    :return: List of CaptionCue
+    """
+    weights = [len(line.replace(' ', '')) or 1 for line in lines]
+    total = sum(weights)
+    cues = []
+    elapsed = 0
+    start_frame = 0
+    for line, weight in zip(lines, weights):
+        elapsed += weight
+        end_frame = int(round(frame_count * elapsed / total))
+        if end_frame > start_frame:
+            cues.append(CaptionCue(start_frame, end_frame, line))
+            start_frame = end_frame
+    return cues
+
+
+def paragraph_caption_cues(paragraph, frame_count, canvas_size, font=None):
+    """
+    Caption cues of one paragraph's voiceover, in frames relative to the paragraph start.
+    """
+    font = font or default_caption_font(canvas_size)
+    lines = wrap_caption(paragraph.get('voiceover', ''), font, canvas_size[0] * CAPTION_WIDTH_RATIO)
+    return build_caption_cues(lines, frame_count)
+
+
+class CaptionSprite(namedtuple('CaptionSprite', ['x', 'y', 'foreground', 'alpha'])):
+    """
+    A pre-rasterized caption line: premultiplied BGR pixels and a 3-channel alpha, both uint8,
+    to be blended at (x, y) on the canvas.
+    """
+    __slots__ = ()
+
+    @property
+    def rect(self):
+        height, width = self.alpha.shape[:2]
+        return self.x, self.y, self.x + width, self.y + height
+
+
+def rasterize_caption(text, font, canvas_size):
+    """
+    Rasterizes one caption line (white text on a translucent box) centred near the bottom of the canvas.
+    """
+    image = np.asarray(render_text(text, font, padding=max(4, font.size // 4),
+                                   bg_color=(0, 0, 0, 160)))
+    canvas_width, canvas_height = canvas_size
+    height, width = image.shape[:2]
+    # 過寬的字幕只保留畫布內的部分
+    width = min(width, canvas_width)
+    height = min(height, canvas_height)
+    image = image[:height, :width]
+    alpha = cv2.cvtColor(image[:, :, 3], cv2.COLOR_GRAY2BGR)
+    foreground = cv2.multiply(np.ascontiguousarray(image[:, :, 2::-1]), alpha, scale=1.0 / 255.0)
+    x = (canvas_width - width) // 2
+    y = max(0, canvas_height - int(round(canvas_height * CAPTION_MARGIN_RATIO)) - height)
+    return CaptionSprite(x, y, foreground, alpha)
+
+
+class CaptionOverlay:
+    """
+    Burns caption cues into a frame buffer that is reused from frame to frame.
+
+    Every distinct line is rasterized once up front. The caption area of the frame is only
+    restored and re-blended on the frames where the cue changes; the exception is the part of it
+    that the caller rewrites on every frame (dynamic_rect, e.g. the avatar ROI), which needs
+    the sprite blended again each time.
+    """
+
+    def __init__(self, cues, canvas_size, font=None):
+        """
+        :param cues: List of CaptionCue (frames relative to the first frame passed to update)
+        :param canvas_size: Size of the canvas (width, height)
+        :param font: PIL font (default: default_caption_font)
+        """
+        font = font or default_caption_font(canvas_size)
+        self.cues = list(cues)
+        self._starts = [cue.start_frame for cue in self.cues]
+        sprites = {}
+        for cue in self.cues:
+            if cue.text not in sprites:
+                sprites[cue.text] = rasterize_caption(cue.text, font, canvas_size)
+        self.sprites = [sprites[cue.text] for cue in self.cues]
+        if self.sprites:
+            rects = np.array([sprite.rect for sprite in self.sprites])
+            self.rect = (int(rects[:, 0].min()), int(rects[:, 1].min()), int(rects[:, 2].max()), int(rects[:, 3].max()))
+        else:
+            self.rect = None
+        self._region = None
+
+    def cue_at(self, frame_index):
+        """
+        Index of the cue shown on a frame, or None between cues.
+        """
+        i = bisect_right(self._starts, frame_index) - 1
+        if i >= 0 and frame_index < self.cues[i].end_frame:
+            return i
+        return None
+
+    def attach(self, frame, dynamic_rect=None):
+        """
+        Binds the overlay to the frame buffer it draws into. The caption area of `frame`
+        must not hold a caption yet.
+
+        :param frame: BGR uint8 canvas reused for every frame
+        :param dynamic_rect: (x0, y0, x1, y1) area the caller rewrites on every frame
+        """
+        self._shown = None
+        if self.rect is None:
+            return
+        x0, y0, x1, y1 = self.rect
+        self._region = frame[y0:y1, x0:x1]
+        self._clean = self._region.copy()
+        self._keep = None
+        if dynamic_rect is not None:
+            dx0, dy0, dx1, dy1 = dynamic_rect
+            fresh = np.zeros(self._region.shape[:2], dtype=bool)
+            fresh[max(dy0 - y0, 0):max(dy1 - y0, 0), max(dx0 - x0, 0):max(dx1 - x0, 0)] = True
+            if fresh.any():
+                # 每幀被重寫的區域已經是乾淨的，只需還原其餘部分
+                self._keep = ~fresh[:, :, np.newaxis]
+
+    def update(self, frame_index):
+        """
+        Brings the caption in the attached frame up to date for frame_index.
+
+        :return: True when the frame buffer was touched
+        """
+        if self._region is None:
+            return False
+        i = self.cue_at(frame_index)
+        if i == self._shown and self._keep is None:
+            return False
+        if self._keep is None:
+            self._region[...] = self._clean
+        else:
+            np.copyto(self._region, self._clean, where=self._keep)
+        if i is not None:
+            sprite = self.sprites[i]
+            x0, y0, x1, y1 = sprite.rect
+            ox, oy = self.rect[:2]
+            target = self._region[y0 - oy:y1 - oy, x0 - ox:x1 - ox]
+            # target = target * (1 - alpha) + foreground
+            inverse_alpha = cv2.bitwise_not(sprite.alpha)
+            cv2.multiply(target, inverse_alpha, dst=target, scale=1.0 / 255.0)
+            cv2.add(target, sprite.foreground, dst=target)
+        self._shown = i
+        return True
+
+    def stills(self, frame, frame_count):
+        """
+        Splits a still paragraph into (image, frame_count) runs, one per caption state,
+        for encode_still_sequence.
+
+        :param frame: BGR uint8 background of the paragraph
+        :param frame_count: Frames of the paragraph
+        """
+        buffer = frame.copy()
+        self.attach(buffer)
+        boundaries = sorted({0, frame_count} | {min(max(cue.start_frame, 0), frame_count) for cue in self.cues}
+                            | {min(max(cue.end_frame, 0), frame_count) for cue in self.cues})
+        runs = []
+        for start, end in zip(boundaries, boundaries[1:]):
+            if end > start:
+                self.update(start)
+                runs.append((buffer.copy(), end - start))
+        return runs
+
+
+def _vtt_time(seconds):
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f'{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}'
+
+
+def write_webvtt(cues, path, fps):
+    """
+    Writes caption cues (frames on the output timeline) as a WebVTT file.
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('WEBVTT\n\n')
+        for cue in cues:
+            f.write(f'{_vtt_time(cue.start_frame / fps)} --> {_vtt_time(cue.end_frame / fps)}\n{cue.text}\n\n')
+    return path
+
+
+def mux_soft_subtitles(video_path, subtitle_path, language='chi'):
+    """
+    Adds a subtitle file to an mp4 as a mov_text track. Audio and video are stream-copied,
+    so the video encode is not touched.
+    """
+    root, ext = os.path.splitext(video_path)
+    tmp_path = root + '.subs' + ext
+    try:
+        run_ffmpeg(['-loglevel', 'error', '-i', video_path, '-i', subtitle_path,
+                    '-map', '0:v', '-map', '0:a?', '-map', '1:0', '-c', 'copy', '-c:s', 'mov_text',
+                    '-metadata:s:s:0', f'language={language}', '-movflags', '+faststart', tmp_path])
+        os.replace(tmp_path, video_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return video_path
+
+
+def storyboard_caption_cues(spans, canvas_size, font=None):
+    """
+    Caption cues of the whole video on the output timeline.
+
+    :param spans: List of (paragraph, start_frame, frame_count) in output order
+    :param canvas_size: Size of the canvas (width, height)
+    """
+    cues = []
+    for paragraph, start_frame, frame_count in spans:
+        for cue in paragraph_caption_cues(paragraph, frame_count, canvas_size, font):
+            cues.append(CaptionCue(cue.start_frame + start_frame, cue.end_frame + start_frame, cue.text))
+    return cues
@@ -0,0 +1,183 @@
+import os
+import socket
+import uuid
+from contextlib import contextmanager
+from threading import Lock
+
+import cv2
+from django.conf import settings
+
+from .job_workspace import LOCK_FILE, generated_root, pid_alive, workspace_lock
+
+
+# generated/ 底下記錄執行中渲染工作的目錄：一個工作一個檔案 (主機-pid-uuid)，節點上所有行程共用
+SLOT_DIR = '.cpu_budget'
+# numpy / BLAS 的執行緒數量由這些環境變數決定 (函式庫載入時讀取)
+BLAS_THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                        'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS')
+
+# 目前行程可用的執行緒數 (None = 未設定，交給各函式庫自行決定)
+_thread_limit = None
+
+
+def apply_thread_limits(threads):
+    """
+    Caps the threads of OpenCV's pool and of the ffmpeg encoders / decoders this process
+    starts (see ffmpeg_thread_args). The BLAS variables only reach child processes and
+    libraries loaded after the call; pools numpy already started keep their size (the
+    settings pin them to one thread before numpy loads).
+    Used directly for in-process renders and as the initializer of render worker processes.
+
+    :param threads: Threads this process may keep busy
+    """
+    global _thread_limit
+    threads = max(1, int(threads))
+    _thread_limit = threads
+    cv2.setNumThreads(threads)
+    for var in BLAS_THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    return threads
+
+
+def thread_limit():
+    """
+    Threads handed to this process, or None when no budget was applied.
+    """
+    return _thread_limit
+
+
+def ffmpeg_thread_args():
+    """
+    ffmpeg -threads option matching this process's thread limit (empty when unset).
+    """
+    return ['-threads', str(_thread_limit)] if _thread_limit else []
+
+
+def split_threads(threads, workers):
+    """
+    Threads each of `workers` concurrent processes gets out of `threads`.
+    """
+    return max(1, threads // max(1, workers))
+
+
+class CpuBudget:
+    """
+    Share of the render node's cores for each running render job.
+
+    Every render job registers itself with job(); the configured cores are split evenly
+    between the running jobs, and the share is re-applied whenever a job of this process
+    starts or finishes. With a slot_dir, jobs register as files in that directory (one per
+    job, named host-pid-uuid like workspace leases), so jobs in different worker processes
+    split the cores too; the slot of a process that died stops counting on its own.
+    A job divides its share further among its worker processes (split_threads), so pools,
+    encoders and OpenCV never ask for more threads than the node has.
+    """
+
+    def __init__(self, cores, slot_dir=None):
+        """
+        :param cores: Cores available to rendering on this node
+        :param slot_dir: Directory shared by the node's worker processes; None counts only
+                         the jobs of this process
+        """
+        self.cores = max(1, int(cores))
+        self.slot_dir = slot_dir
+        self._lock = Lock()
+        self._jobs = 0
+
+    @property
+    def running_jobs(self):
+        if self.slot_dir is None:
+            with self._lock:
+                return self._jobs
+        with workspace_lock(self.slot_dir):
+            return len(self._live_slots())
+
+    def share(self):
+        """
+        Cores for each running job.
+        """
+        return max(1, self.cores // max(1, self.running_jobs))
+
+    def _live_slots(self):
+        # 呼叫端須持有 workspace_lock；只計算本節點上仍在執行的行程，已結束的順便清掉
+        host = socket.gethostname()
+        live = []
+        for name in os.listdir(self.slot_dir):
+            if name == LOCK_FILE:
+                continue
+            try:
+                slot_host, pid, _ = name.rsplit('-', 2)
+                pid = int(pid)
+            except ValueError:
+                continue
+            if slot_host != host:
+                continue
+            if pid_alive(pid):
+                live.append(name)
+            else:
+                try:
+                    os.remove(os.path.join(self.slot_dir, name))
+                except FileNotFoundError:
+                    pass
+        return live
+
+    def _register(self):
+        if self.slot_dir is None:
+            with self._lock:
+                self._jobs += 1
+            return None
+        with workspace_lock(self.slot_dir):
+            path = os.path.join(self.slot_dir, f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex}")
+            with open(path, 'w'):
+                pass
+        return path
+
+    def _unregister(self, slot):
+        if slot is None:
+            with self._lock:
+                self._jobs -= 1
+            return
+        with workspace_lock(self.slot_dir):
+            try:
+                os.remove(slot)
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def job(self):
+        """
+        Registers a render job for the duration of the block.
+
+        :return: Cores granted to the job when it starts
+        """
+        slot = self._register()
+        apply_thread_limits(self.share())
+        try:
+            yield self.share()
+        finally:
+            self._unregister(slot)
+            apply_thread_limits(self.share())
+
+
+def budgeted_workers(workers, cores):
+    """
+    Pool size for `workers` concurrent tasks that must stay within a job's `cores`.
+    """
+    return max(1, min(workers, cores))
+
+
+_budget = None
+_budget_lock = Lock()
+
+
+def get_cpu_budget():
+    """
+    Returns the node-wide CpuBudget sized by the RENDER_CPU_CORES setting, shared through
+    generated/.cpu_budget by every worker process on this node.
+    """
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = CpuBudget(getattr(settings, 'RENDER_CPU_CORES', None) or os.cpu_count() or 1,
+                                os.path.join(generated_root(), SLOT_DIR))
+        return _budget
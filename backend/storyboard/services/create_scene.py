@@ -1,46 +1,164 @@
 import cv2
 import numpy as np
-from moviepy.editor import VideoFileClip, AudioFileClip, CompositeAudioClip, ImageClip
+from moviepy.editor import VideoFileClip, CompositeAudioClip, ImageClip
 from moviepy.editor import concatenate_videoclips
+import copy
+from contextlib import nullcontext
 import os
+import shutil
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from django.conf import settings
 from PIL import Image
+from .artifact_index import write_artifact_index
+from .audio_assembly import assemble_audio, samples_for_frames
+from .avatar_compositor import AvatarFrameCompositor, checked_avatar_precision
+from .avatar_keyer import AvatarKeyer
+from .avatar_sharding import render_avatar_sharded
+from .captions import (
+    CAPTION_MODES,
+    CaptionOverlay,
+    default_caption_font,
+    mux_soft_subtitles,
+    paragraph_caption_cues,
+    storyboard_caption_cues,
+    write_webvtt,
+)
+from .cpu_budget import apply_thread_limits, get_cpu_budget, split_threads, thread_limit
+from .encoder_profiles import get_encoder_profile
+from .ffmpeg_reader import FFmpegPipeReader
+from .media_probe import probe_duration, probe_media, probe_video_timing
+from .plate_store import base_plate_names, warm_plate_store
+from .render_cache import get_render_cache, segment_cache_key
+from .timeline_renderer import build_timeline, paragraph_media_path, render_timeline
+from .ffmpeg_writer import (
+    SEGMENT_FPS,
+    FFmpegPipeWriter,
+    concat_copy,
+    encode_still_segment,
+    encode_still_sequence,
+    probe_media_format,
+    segment_audio_args,
+)
+from .layer_compositor import (
+    blend_layer,
+    canvas_to_rgb,
+    layer_cache,
+    load_rgba,
+    new_canvas,
+    psnr,
+    quad_from_info,
+    shared_layer_paths,
+    warp_layer,
+)
 
-def combine_videos(title, output_dir, num_paragraphs):
+# 人偶去背的亮度門檻
+AVATAR_THRESHOLD = 10
+
+def combine_videos(title, output_dir, paragraphs, encoder_profile=None):
     """
-    Combines multiple video clips into a single video file.
+    Combines the silent paragraph segments into a single video file and adds the audio track.
+    The voiceover / avatar audio of all paragraphs is assembled once, sample-accurately, to the
+    frame span of each segment and encoded to AAC a single time (see assemble_audio).
+    Segments sharing the same codec parameters are joined with the ffmpeg concat demuxer
+    (no re-encode); otherwise the clips are re-encoded with moviepy.
     
     :param output_dir: Directory containing the input video files and where the output will be saved
-    :param num_paragraphs: Number of video clips to combine
+    :param paragraphs: storyboard["storyboard"] list the segments were rendered from
+    :param encoder_profile: EncoderProfile (or its name) used if the clips have to be re-encoded
     """
-    from moviepy.editor import VideoFileClip, concatenate_videoclips, CompositeAudioClip
-    import gc
-    import os
-
-    video_clips = []
-    
-    for i in range(1, num_paragraphs + 1):
+    video_paths = []
+    audio_parts = []
+    total_frames = 0
+    for i, paragraph in enumerate(paragraphs, start=1):
         video_path = os.path.join(output_dir, f"final_output_paragraph_{i}.mp4")
         
         # 檢查視頻文件是否存在
         if not os.path.exists(video_path):
             print(f"Warning: Video file {video_path} does not exist.")
             continue
+        video_paths.append(video_path)
+        # 每段音訊依影片實際幀數切齊，段落交界不會累積誤差
+        fps, frame_count = probe_video_timing(video_path)
+        total_frames += frame_count
+        audio_parts.append((_paragraph_audio_source(output_dir, paragraph), samples_for_frames(frame_count, fps)))
+    
+    # 確保有視頻片段可供合併
+    if not video_paths:
+        print("No valid video clips found to combine.")
+        return None
+    
+    final_output_path = os.path.join(output_dir, f"{title}_final_video.mp4")
+    work_dir = tempfile.mkdtemp(prefix='combine_', dir=output_dir)
+    try:
+        audio_path = assemble_audio(audio_parts, os.path.join(work_dir, 'audio.m4a'))
+        duration = total_frames / SEGMENT_FPS
         
-        try:
-            # Add error handling for corrupt frames
-            video = VideoFileClip(video_path)
-            
-            # Trim video slightly to avoid potential corrupt frames at the end
-            if video.duration > 0.1:  # Only trim if video is longer than 0.1 seconds
-                video = video.subclip(0, video.duration - 0.05)  # Trim last 0.05 seconds
-            
-            # 檢查視頻是否有音頻
-            if video.audio is None:
-                print(f"Warning: Video {i} does not have audio.")
-            
-            video_clips.append(video)
+        mismatched = _find_mismatched_segments(video_paths)
+        if not mismatched:
+            try:
+                # 編碼參數一致：直接串接，不重新編碼；音軌已編碼過，直接複製
+                concat_copy(video_paths, final_output_path, audio_source=audio_path, duration=duration,
+                            audio_args=['-c:a', 'copy'])
+                print(f"All videos combined into: {final_output_path}")
+                return final_output_path
+            except Exception as e:
+                print(f"Stream-copy concat failed, falling back to re-encode: {str(e)}")
+        else:
+            print(f"Segments with different codec parameters, re-encoding: {mismatched}")
         
+        video_only = os.path.join(work_dir, 'video.mp4')
+        if _combine_videos_reencode(video_paths, video_only, encoder_profile) is None:
+            return None
+        concat_copy([video_only], final_output_path, audio_source=audio_path, duration=duration,
+                    audio_args=['-c:a', 'copy'])
+        print(f"All videos combined into: {final_output_path}")
+        return final_output_path
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _paragraph_audio_source(output_dir, paragraph):
+    """
+    Media file carrying a paragraph's audio (avatar clip or voiceover), or None when it has no audio.
+    """
+    media_path = paragraph_media_path(output_dir, paragraph)
+    if not os.path.exists(media_path) or probe_media(media_path)['sample_rate'] is None:
+        print(f"Warning: {media_path} has no audio, using silence.")
+        return None
+    return media_path
+
+
+def _segment_signature(info):
+    # 段落影片不含音軌，只比對視訊參數
+    return tuple(info[key] for key in ('video_codec', 'width', 'height', 'fps', 'pix_fmt', 'timescale'))
+
+
+def _find_mismatched_segments(video_paths):
+    """
+    Returns the segments whose codec parameters differ from the first one (or from the
+    shared segment format), i.e. the ones that prevent a stream-copy concat.
+    """
+    signatures = {path: _segment_signature(probe_media_format(path)) for path in video_paths}
+    reference = signatures[video_paths[0]]
+    if None in reference or reference[3] != SEGMENT_FPS:
+        return [os.path.basename(path) for path in video_paths]
+    return [os.path.basename(path) for path, signature in signatures.items() if signature != reference]
+
+
+def _combine_videos_reencode(video_paths, final_output_path, encoder_profile=None):
+    """
+    Fallback for combine_videos: decodes every clip with moviepy and re-encodes the video track.
+    The output has no audio; combine_videos muxes the assembled track afterwards.
+    """
+    from moviepy.editor import VideoFileClip, concatenate_videoclips
+    import gc
+
+    video_clips = []
+    
+    for video_path in video_paths:
+        try:
+            video_clips.append(VideoFileClip(video_path, audio=False))
         except Exception as e:
             print(f"Error loading video {video_path}: {str(e)}")
             continue
@@ -56,38 +174,38 @@ def combine_videos(title, output_dir, num_paragraphs):
     # 合併所有視頻片段
     final_video = concatenate_videoclips(video_clips, method="compose")
     
-    # 確保最終視頻有音頻，必要時創建靜音音軌
-    if final_video.audio is None:
-        print("Warning: The combined video does not have audio. Creating a silent audio track.")
-        final_video = final_video.set_audio(CompositeAudioClip([]))
-    
-    final_output_path = os.path.join(output_dir, f"{title}_final_video.mp4")
-    
     # 寫入最終視頻文件
+    profile = get_encoder_profile(encoder_profile)
     try:
-        final_video.write_videofile(final_output_path, codec="libx264", audio_codec="aac", threads=4)
+        final_video.write_videofile(final_output_path, codec="libx264", audio=False, threads=thread_limit() or 4,
+                                    preset=profile.preset, ffmpeg_params=['-crf', str(profile.crf)])
     except Exception as e:
         print(f"Error writing final video: {str(e)}")
+        final_output_path = None
     
     # 關閉所有視頻片段以釋放資源
     for clip in video_clips:
         clip.close()
     
-    print(f"All videos combined into: {final_output_path}")
+    return final_output_path
 
-def compose_background_with_scenes(output_dir, images, canvas_size):
+def compose_background_with_scenes(output_dir, images, canvas_size, cacheable_paths=None, precision=None):
     """
     Composes multiple images based on their z-index and coordinates.
-    Memory-efficient and numerically stable implementation.
+    Each layer is warped only into the bounding rectangle of its quad and blended there in place.
+
+    :param output_dir: Directory containing the layer images
+    :param images: Layer dicts (img_path, quad corners, z_index)
+    :param canvas_size: Size of the canvas (width, height)
+    :param cacheable_paths: img_path values whose warped plates are kept in the layer cache
+    :param precision: 'float' (float32) or 'fixed' (uint8); default COMPOSITE_PRECISION setting
     """
-    import gc
-    
-    # 強制初始清理
-    gc.collect()
+    cacheable_paths = cacheable_paths or set()
+    precision = precision or getattr(settings, 'COMPOSITE_PRECISION', 'float')
     
     try:
-        # 使用 float32 提供足夠的精度但不過度消耗記憶體
-        canvas = np.zeros((canvas_size[1], canvas_size[0], 4), dtype=np.float32)
+        # 畫布內容為預乘 alpha；fixed 模式的畫布與圖層都是 uint8，記憶體只有 float32 的 1/4
+        canvas = new_canvas(canvas_size, precision)
         
         # Sort images by z-index
         sorted_images = sorted(images, key=lambda x: x.get('z_index', 0))
@@ -95,84 +213,81 @@ def compose_background_with_scenes(output_dir, images, canvas_size):
         for img_info in sorted_images:
             try:
                 img_path = os.path.join(output_dir, img_info["img_path"])
+                quad = quad_from_info(img_info)
                 
-                # 使用 PIL 讀取並立即轉換格式
-                with Image.open(img_path) as pil_img:
-                    # 轉換為 RGBA
-                    if pil_img.mode != 'RGBA':
-                        pil_img = pil_img.convert('RGBA')
-                    # 轉換為 numpy array 並正規化
-                    img = np.array(pil_img, dtype=np.float32) / 255.0
-                
-                # 立即清理 PIL 圖片
-                del pil_img
-                
-                # 獲取座標
-                tl = np.array(img_info["top_left"], dtype=np.float32)
-                tr = np.array(img_info["top_right"], dtype=np.float32)
-                br = np.array(img_info["bottom_right"], dtype=np.float32)
-                bl = np.array(img_info["bottom_left"], dtype=np.float32)
-                
-                # 創建透視變換矩陣
-                src_pts = np.array([[0, 0], 
-                                  [img.shape[1]-1, 0], 
-                                  [img.shape[1]-1, img.shape[0]-1], 
-                                  [0, img.shape[0]-1]], dtype=np.float32)
-                dst_pts = np.array([tl, tr, br, bl], dtype=np.float32)
-                M = cv2.getPerspectiveTransform(src_pts, dst_pts)
-                
-                # 執行透視變換
-                warped_img = cv2.warpPerspective(
-                    img,
-                    M,
-                    (canvas_size[0], canvas_size[1]),
-                    flags=cv2.INTER_LINEAR,
-                    borderMode=cv2.BORDER_CONSTANT,
-                    borderValue=(0,0,0,0)
-                )
-                
-                # 清理不需要的變量
-                del img, M, src_pts, dst_pts
-                gc.collect()
+                if img_info["img_path"] in cacheable_paths:
+                    # 背景、title 等共用圖層：直接取用已變換好的快取
+                    plate = layer_cache.get_or_build(img_path, quad, canvas_size, precision)
+                else:
+                    plate = warp_layer(load_rgba(img_path, precision), quad, canvas_size)
                 
-                # 提取 alpha 通道
-                alpha = warped_img[:, :, 3]
-                alpha = np.clip(alpha, 0, 1)  # 確保 alpha 在有效範圍內
-                
-                # 使用 numpy 的廣播功能進行混合
-                for c in range(3):  # 分別處理 RGB 通道
-                    canvas[:, :, c] = (warped_img[:, :, c] * alpha + 
-                                     canvas[:, :, c] * (1 - alpha))
-                
-                # 更新 alpha 通道
-                canvas[:, :, 3] = np.maximum(canvas[:, :, 3], warped_img[:, :, 3])
-                
-                # 清理本次迭代的變量
-                del warped_img, alpha
-                gc.collect()
+                # 只在圖層的範圍內做混合
+                blend_layer(canvas, plate)
                 
             except Exception as e:
                 print(f"Error processing image {img_path}: {str(e)}")
                 continue
         
         # 確保值在有效範圍內並轉換回 uint8
-        result = (np.clip(canvas[:, :, :3], 0, 1) * 255).astype(np.uint8)
-        
-        return result
+        return canvas_to_rgb(canvas)
         
     except Exception as e:
         print(f"Error in compose_background_with_scenes: {str(e)}")
         return None
-        
-    finally:
-        # 確保清理所有變量
-        try:
-            del canvas
-        except:
-            pass
-        gc.collect()
 
-def avatar_2_background(input_video, output_video, threshold, composed_background, crop_coords, placement_coords):
+
+def validate_composite_precision(output_dir, images, canvas_size, min_psnr=40.0):
+    """
+    Composes the same layers with the float and the fixed-point path and compares them.
+    
+    :param output_dir: Directory containing the layer images
+    :param images: Layer dicts (img_path, quad corners, z_index)
+    :param canvas_size: Size of the canvas (width, height)
+    :param min_psnr: PSNR (dB) the fixed-point result must reach
+    :return: (passed, psnr_db)
+    """
+    reference = compose_background_with_scenes(output_dir, images, canvas_size, precision='float')
+    candidate = compose_background_with_scenes(output_dir, images, canvas_size, precision='fixed')
+    if reference is None or candidate is None:
+        return False, 0.0
+    value = psnr(reference, candidate)
+    print(f"Fixed-point composite PSNR: {value:.2f} dB")
+    return value >= min_psnr, value
+
+
+def _checked_composite_precision(output_dir, paragraphs, canvas_size):
+    """
+    Compositing precision of a job: the COMPOSITE_PRECISION setting, except that 'fixed' falls back
+    to 'float' when the first paragraph's background composited in fixed point stays below
+    COMPOSITE_MIN_PSNR against the float path. Avatar clips are checked on their own
+    (see checked_avatar_precision).
+    """
+    precision = getattr(settings, 'COMPOSITE_PRECISION', 'float')
+    if precision != 'fixed' or not paragraphs:
+        return precision
+    # 逐段生成媒體時段落圖片可能還沒下載完成，只用已經存在的圖層
+    images = [image for image in paragraphs[0].get("images", [])
+              if os.path.exists(os.path.join(output_dir, image["img_path"]))]
+    if not images:
+        return precision
+    min_psnr = getattr(settings, 'COMPOSITE_MIN_PSNR', 40.0)
+    passed, _ = validate_composite_precision(output_dir, images, canvas_size, min_psnr)
+    if not passed:
+        print(f"Fixed-point composite below {min_psnr} dB, using float")
+        return 'float'
+    return precision
+
+def default_avatar_keyer(threshold):
+    """
+    Returns the AvatarKeyer configured by the AVATAR_KEYER_MODE / AVATAR_KEYER_TEMPORAL_TOLERANCE settings.
+    """
+    return AvatarKeyer(threshold,
+                       mode=getattr(settings, 'AVATAR_KEYER_MODE', 'reference'),
+                       temporal_tolerance=getattr(settings, 'AVATAR_KEYER_TEMPORAL_TOLERANCE', None))
+
+
+def avatar_2_background(input_video, output_video, threshold, composed_background, crop_coords, placement_coords, workers=1, keyer=None,
+                        encoder_profile=None, with_audio=True, caption_cues=None, precision=None):
     """
     Replaces the background of a video with a composed background image.
     
@@ -182,129 +297,444 @@ def avatar_2_background(input_video, output_video, threshold, composed_backgroun
     :param composed_background: Composed background image
     :param crop_coords: Coordinates for cropping the input video
     :param placement_coords: Coordinates for placing the video on the background
+    :param workers: Number of worker processes; above 1 the clip is rendered in time shards
+    :param keyer: AvatarKeyer used for background removal (default: AVATAR_KEYER_MODE setting)
+    :param encoder_profile: EncoderProfile (or its name) giving the x264 preset and CRF
+    :param with_audio: Copy the clip's audio track into the output
+    :param caption_cues: CaptionCue list (in frames of the input clip) burned into the output
+    :param precision: Alpha blending, 'float' or 'fixed' (checked against float on the first frame);
+                      default COMPOSITE_PRECISION setting
     """
-    cap = cv2.VideoCapture(input_video)
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-    x, y, w, h = crop_coords
+    profile = get_encoder_profile(encoder_profile)
+    if keyer is None:
+        keyer = default_avatar_keyer(threshold)
+    precision = precision or getattr(settings, 'COMPOSITE_PRECISION', 'float')
+    if precision == 'fixed':
+        # 以第一幀比較定點與浮點的混合結果，PSNR 不足時這段影片改用 float
+        precision = checked_avatar_precision(precision, input_video, composed_background, crop_coords,
+                                             placement_coords, threshold, keyer,
+                                             getattr(settings, 'COMPOSITE_MIN_PSNR', 40.0))
+    
+    if workers > 1:
+        render_avatar_sharded(input_video, output_video, threshold, composed_background,
+                              crop_coords, placement_coords, workers, keyer=keyer, encoder_profile=profile,
+                              with_audio=with_audio, caption_cues=caption_cues, precision=precision)
+        return
+    
+    fps, frame_count = probe_video_timing(input_video)
+    duration = frame_count / fps
     bg_height, bg_width = composed_background.shape[:2]
-    tl, tr, br, bl = placement_coords
     
-    placed_width = int(max(tr[0], br[0]) - min(tl[0], bl[0]))
-    placed_height = int(max(bl[1], br[1]) - min(tl[1], tr[1]))
+    # 整段影片共用的矩陣、ROI 與緩衝區只建立一次
+    compositor = AvatarFrameCompositor(composed_background, crop_coords, placement_coords, threshold, keyer=keyer,
+                                       precision=precision)
+    captions = None
+    if caption_cues:
+        # 字幕只在換句時重畫；與人偶 ROI 重疊的部分每幀補畫
+        captions = CaptionOverlay(caption_cues, compositor.canvas_size)
+        captions.attach(compositor.output, dynamic_rect=compositor.roi)
     
-    # Set up video writer
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    temp_output = os.path.join(os.path.dirname(output_video), f'temp_{os.path.basename(output_video)}')
-    out = cv2.VideoWriter(temp_output, fourcc, fps, (bg_width, bg_height), isColor=True)
+    # 裁切與縮放交給 ffmpeg 解碼端處理，Python 只拿到放置尺寸的畫面；
+    # 合成後的畫面直接送進 ffmpeg 編碼一次，原始音軌在同一個行程中直接複製
+    audio_source = input_video if with_audio else None
+    with FFmpegPipeReader(input_video, (compositor.placed_width, compositor.placed_height),
+                          crop=crop_coords) as reader, \
+            FFmpegPipeWriter(output_video, (bg_width, bg_height), fps, audio_source=audio_source,
+                             audio_args=segment_audio_args(input_video) if with_audio else None,
+                             duration=duration, output_fps=SEGMENT_FPS,
+                             preset=profile.preset, crf=profile.crf) as writer:
+        for frame_index, placed in enumerate(reader):
+            frame = compositor.compose_placed(placed)
+            if captions is not None:
+                captions.update(frame_index)
+            writer.write(frame)
+
+
+def render_paragraph(output_dir, idx, paragraph, canvas_size, crop_coords, cacheable_paths=None, avatar_workers=1,
+                     encoder_profile=None, burn_captions=False, precision=None):
+    """
+    Renders one paragraph to final_output_paragraph_{idx + 1}.mp4 (video only; the audio
+    of all paragraphs is added once by combine_videos).
+    Runs in a worker process when paragraphs are rendered in parallel.
     
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Process each frame
-        frame = cv2.cvtColor(frame[y:y+h, x:x+w], cv2.COLOR_BGR2RGB)
-        frame = cv2.resize(frame, (placed_width, placed_height))
-        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-        mask = np.where(gray < threshold, 0, 255).astype('uint8')
-        blurred_mask = cv2.GaussianBlur(mask, (21, 21), 0).astype(float) / 255.0
-        
-        foreground = frame * blurred_mask[:,:,np.newaxis]
-        bg_copy = composed_background.copy()
-        
-        # Create a perspective transform matrix
-        src_pts = np.array([[0, 0], [placed_width-1, 0], [0, placed_height-1], [placed_width-1, placed_height-1]], dtype="float32")
-        dst_pts = np.array([tl, tr, bl, br], dtype="float32")
-        M = cv2.getPerspectiveTransform(src_pts, dst_pts)
-        
-        # Warp the foreground and mask
-        warped_foreground = cv2.warpPerspective(foreground, M, (bg_width, bg_height))
-        warped_mask = cv2.warpPerspective(blurred_mask, M, (bg_width, bg_height))
-        
-        # Blend foreground with background
-        alpha = 1 - warped_mask[:,:,np.newaxis]
-        blended = bg_copy * alpha + warped_foreground
+    :param output_dir: Job directory holding the paragraph assets
+    :param idx: Zero-based paragraph index
+    :param paragraph: Paragraph dict from the storyboard
+    :param canvas_size: Size of the canvas (width, height)
+    :param crop_coords: Coordinates for cropping the input video (x, y, w, h)
+    :param cacheable_paths: img_path values shared by all paragraphs (see shared_layer_paths)
+    :param avatar_workers: Worker processes available to the avatar renderer
+    :param encoder_profile: EncoderProfile used for the segment encode
+    :param burn_captions: Burn the paragraph's voiceover captions into the segment
+    :param precision: Compositing precision of the job (default COMPOSITE_PRECISION setting)
+    :return: Path of the rendered segment, or None on failure
+    """
+    print(f"Processing paragraph {idx + 1}...")
+    
+    precision = precision or getattr(settings, 'COMPOSITE_PRECISION', 'float')
+    output_video = os.path.join(output_dir, f"final_output_paragraph_{idx + 1}.mp4")
+    caption_cues = _paragraph_caption_cues(output_dir, paragraph, canvas_size) if burn_captions else None
+    options = _render_options(precision)
+    if caption_cues:
+        options['captions'] = caption_cues
+    
+    # 輸入內容沒變的段落直接沿用快取的影片
+    cache = get_render_cache()
+    cache_key = None
+    if cache is not None:
+        try:
+            cache_key = segment_cache_key(output_dir, paragraph, canvas_size, crop_coords,
+                                          get_encoder_profile(encoder_profile), options)
+            if cache.fetch('segments', cache_key, output_video, '.mp4'):
+                print(f"Paragraph {idx + 1} unchanged, reused cached segment")
+                return output_video
+        except (OSError, KeyError) as e:
+            print(f"Render cache unavailable for paragraph {idx + 1}: {str(e)}")
+            cache_key = None
+    if os.path.exists(output_video):
+        # 可能是從快取連結過來的檔案，先移除再重新寫入
+        os.remove(output_video)
+    
+    # Compose background with all images
+    composed_background = compose_background_with_scenes(output_dir, paragraph["images"], canvas_size, cacheable_paths,
+                                                         precision)
+    if composed_background is None:
+        print(f"Error: Failed to compose background for paragraph {idx + 1}")
+        return None
+    
+    # Check if avatar is needed
+    if paragraph.get("needAvatar", False):
+        # Process video with avatar
+        input_video = os.path.join(output_dir, paragraph["video"]["avatar_path"])
+        placement_coords = (paragraph["video"]["top_left"], paragraph["video"]["top_right"], paragraph["video"]["bottom_right"], paragraph["video"]["bottom_left"])
         
-        out.write(cv2.cvtColor(blended.astype(np.uint8), cv2.COLOR_RGB2BGR))
+        avatar_2_background(input_video, output_video, AVATAR_THRESHOLD, composed_background, crop_coords, placement_coords,
+                            workers=avatar_workers, encoder_profile=encoder_profile, with_audio=False,
+                            caption_cues=caption_cues, precision=precision)
+    else:
+        # Create video from background image and audio
+        audio_path = os.path.join(output_dir, paragraph["audio_path"])
+        create_video_from_image_and_audio(composed_background, audio_path, output_video, encoder_profile=encoder_profile,
+                                          with_audio=False, caption_cues=caption_cues)
+    
+    if cache_key is not None and os.path.exists(output_video):
+        cache.store('segments', cache_key, output_video, '.mp4')
     
-    cap.release()
-    out.release()
+    print(f"Video processing complete for paragraph {idx + 1}")
+    return output_video
+
+
+def _paragraph_caption_cues(output_dir, paragraph, canvas_size):
+    """
+    Caption cues of a paragraph in the frames of the clip that carries them:
+    the avatar clip's frames, or the still segment's frames.
+    """
+    media_path = paragraph_media_path(output_dir, paragraph)
+    if paragraph.get("needAvatar", False):
+        frame_count = probe_video_timing(media_path)[1]
+    else:
+        frame_count = int(round(probe_duration(media_path) * SEGMENT_FPS))
+    return paragraph_caption_cues(paragraph, frame_count, canvas_size)
+
+
+def _render_options(precision):
+    """
+    Settings that change the rendered pixels and therefore belong in the segment cache key.
+    """
+    return {
+        'threshold': AVATAR_THRESHOLD,
+        'keyer_mode': getattr(settings, 'AVATAR_KEYER_MODE', 'reference'),
+        'keyer_temporal_tolerance': getattr(settings, 'AVATAR_KEYER_TEMPORAL_TOLERANCE', None),
+        'precision': precision,
+        # 段落影片不含音軌 (音訊由 combine_videos 統一組裝)
+        'segment_audio': False,
+    }
+
+
+def _paragraph_cost(output_dir, paragraph):
+    """
+    Predicted render cost used to order the work: avatar paragraphs first,
+    then the longest media (durations read from the file headers).
+    """
+    media = paragraph["video"]["avatar_path"] if paragraph.get("needAvatar", False) else paragraph.get("audio_path")
+    try:
+        duration = probe_duration(os.path.join(output_dir, media)) if media else 0.0
+    except OSError:
+        duration = 0.0
+    return (paragraph.get("needAvatar", False), duration)
+
+
+def _estimate_render_bytes(canvas_size, precision='float'):
+    """
+    Rough peak memory of one paragraph render: the RGBA canvas, the composed
+    frame and the avatar compositor's frames and ROI buffers.
+    The fixed-point path (uint8 canvas and avatar blend) needs about a third.
+    """
+    return canvas_size[0] * canvas_size[1] * (12 if precision == 'fixed' else 32)
+
+
+def _init_render_worker(threads):
+    """
+    Initializer of paragraph render processes: applies the worker's CPU share and maps the base plates.
+    """
+    apply_thread_limits(threads)
+    warm_plate_store()
+
+
+def _render_pool_size(canvas_size, workers, cpu_slots=None, precision='float'):
+    """
+    Sizes a paragraph render pool: renders kept in flight (bounded by the memory budget,
+    RENDER_MEMORY_BUDGET_MB, and the job's CPU share), threads per render process and
+    avatar shard workers per paragraph.
+
+    :return: (max_in_flight, threads, avatar_workers)
+    """
+    cpu_slots = cpu_slots or get_cpu_budget().share()
+    budget = getattr(settings, 'RENDER_MEMORY_BUDGET_MB', 2048) * 1024 * 1024
+    max_in_flight = max(1, min(workers, cpu_slots, budget // _estimate_render_bytes(canvas_size, precision)))
+    # 每個段落行程分到的核心，剩餘的留給人偶段落的分段渲染
+    threads = split_threads(cpu_slots, max_in_flight)
+    avatar_workers = max(1, min(getattr(settings, 'AVATAR_RENDER_WORKERS', 1), threads))
+    return max_in_flight, threads, avatar_workers
+
+
+def _render_paragraphs_parallel(output_dir, paragraphs, canvas_size, crop_coords, cacheable_paths, workers,
+                                encoder_profile=None, burn_captions=False, cpu_slots=None, precision='float'):
+    """
+    Renders paragraphs in a process pool, most expensive first, never keeping more renders
+    in flight than the memory budget (RENDER_MEMORY_BUDGET_MB) or the job's CPU share allows.
+    """
+    max_in_flight, threads, avatar_workers = _render_pool_size(canvas_size, workers, cpu_slots, precision)
     
-    # Add original audio to the processed video
-    video = VideoFileClip(temp_output)
-    audio = AudioFileClip(input_video)
-    final_video = video.set_audio(audio)
-    final_video.write_videofile(output_video, codec="libx264", audio_codec="aac")
+    queue = sorted(range(len(paragraphs)), key=lambda i: _paragraph_cost(output_dir, paragraphs[i]), reverse=True)
+    print(f"Rendering {len(queue)} paragraphs with {max_in_flight} workers, order: {[i + 1 for i in queue]}")
     
-    video.close()
-    audio.close()
-    os.remove(temp_output)
+    # 每個 worker 啟動時套用 CPU 配額並映射共用的底圖 (唯讀、零複製)
+    with ProcessPoolExecutor(max_workers=max_in_flight, initializer=_init_render_worker,
+                             initargs=(threads,)) as executor:
+        pending = {}
+        while queue or pending:
+            while queue and len(pending) < max_in_flight:
+                idx = queue.pop(0)
+                future = executor.submit(render_paragraph, output_dir, idx, paragraphs[idx], canvas_size,
+                                         crop_coords, cacheable_paths, avatar_workers, encoder_profile,
+                                         burn_captions, precision)
+                pending[future] = idx
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = pending.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error rendering paragraph {idx + 1}: {str(e)}")
+
 
+def _render_paragraphs_as_ready(manager, media_graph, output_dir, canvas_size, crop_coords, cacheable_paths, workers,
+                                encoder_profile=None, burn_captions=False, cpu_slots=None, precision='float'):
+    """
+    Adds a render task per paragraph to media_graph, depending on that paragraph's media tasks
+    (media_graph.group(idx)), and runs the graph. A paragraph is encoding while the voiceovers
+    and avatars of later paragraphs are still being generated; a paragraph whose media failed
+    is not rendered.
+    """
+    paragraphs = manager.get_storyboard()["storyboard"]
+    cpu_slots = cpu_slots or get_cpu_budget().share()
+    if workers > 1:
+        max_in_flight, threads, avatar_workers = _render_pool_size(canvas_size, workers, cpu_slots, precision)
+        print(f"Rendering paragraphs as their media is ready with {max_in_flight} workers")
+        executor = ProcessPoolExecutor(max_workers=max_in_flight, initializer=_init_render_worker,
+                                       initargs=(threads,))
+    else:
+        # 依序渲染，但仍在背景執行緒中進行，讓其他段落的媒體生成繼續排程
+        avatar_workers = min(getattr(settings, 'AVATAR_RENDER_WORKERS', 1), cpu_slots)
+        executor = ThreadPoolExecutor(max_workers=1)
+    
+    def render_task(idx):
+        def submit(*_):
+            # 等 manager 把這個段落的更新寫入後，交出段落的快照
+            manager.wait_for_queue()
+            return executor.submit(render_paragraph, output_dir, idx, copy.deepcopy(paragraphs[idx]), canvas_size,
+                                   crop_coords, cacheable_paths, avatar_workers, encoder_profile, burn_captions,
+                                   precision)
+        return submit
+    
+    with executor:
+        for idx in range(len(paragraphs)):
+            media_graph.add(('render', idx), render_task(idx), deps=media_graph.group(idx))
+        media_graph.run()
+    manager.wait_for_queue()
+    for idx in range(len(paragraphs)):
+        error = media_graph.errors.get(('render', idx))
+        if error is not None:
+            print(f"Error rendering paragraph {idx + 1}: {str(error)}")
 
 
-def create_videos_from_images_and_audio(manager, canvas_size, crop_coords):
+def create_videos_from_images_and_audio(manager, canvas_size, crop_coords, max_workers=None, encoder_profile=None,
+                                        render_mode=None, caption_mode=None, media_graph=None, cpu_slots=None):
     """
     Creates videos by combining background images, scene images, and audio (with or without avatar videos).
     
     :param manager: Manager object containing the storyboard and other necessary information
     :param canvas_size: Size of the canvas (width, height)
     :param crop_coords: Coordinates for cropping the input video (x, y, w, h)
+    :param max_workers: Paragraphs rendered concurrently (default PARAGRAPH_RENDER_WORKERS)
+    :param encoder_profile: EncoderProfile (or its name); canvas_size and the storyboard quads
+                            must already be scaled to it (see scale_layout_config)
+    :param render_mode: 'segments' (one mp4 per paragraph, then concat) or 'timeline'
+                        (whole storyboard in one encode); default RENDER_MODE setting
+    :param caption_mode: Voiceover captions, one of CAPTION_MODES (off, burn, soft, both);
+                         default CAPTION_MODE setting
+    :param media_graph: TaskGraph still producing the paragraphs' media (images, voiceovers, avatar
+                        clips), its tasks grouped by paragraph index. In segments mode each
+                        paragraph is rendered as soon as its own group has finished.
     """
+    encoder_profile = get_encoder_profile(encoder_profile)
+    render_mode = render_mode or getattr(settings, 'RENDER_MODE', 'segments')
     storyboard = manager.get_storyboard()
     title = storyboard.get('title')
     output_dir = os.path.join(settings.BASE_DIR, 'generated', storyboard['random_id'])
+    paragraphs = storyboard["storyboard"]
+    # 背景與 title 在每個段落都相同，只需變換一次；版面底圖直接取用共用的 plate store
+    cacheable_paths = shared_layer_paths(paragraphs) | base_plate_names()
+    warm_plate_store()
+    caption_mode = _usable_caption_mode(caption_mode or getattr(settings, 'CAPTION_MODE', 'off'), canvas_size)
+    burn_captions = caption_mode in ('burn', 'both')
+    precision = _checked_composite_precision(output_dir, paragraphs, canvas_size)
     
-    for idx, paragraph in enumerate(storyboard["storyboard"]):
-        print(f"Processing paragraph {idx + 1}...")
-        
-        # Compose background with all images
-        composed_background = compose_background_with_scenes(output_dir, paragraph["images"], canvas_size)
-        if composed_background is None:
-            print(f"Error: Failed to compose background for paragraph {idx + 1}")
-            continue
-        
-        # Check if avatar is needed
-        if paragraph.get("needAvatar", False):
-            # Process video with avatar
-            input_video = os.path.join(output_dir, paragraph["video"]["avatar_path"])
-            output_video = os.path.join(output_dir, f"final_output_paragraph_{idx + 1}.mp4")
-            placement_coords = (paragraph["video"]["top_left"], paragraph["video"]["top_right"], paragraph["video"]["bottom_right"], paragraph["video"]["bottom_left"])
-            
-            avatar_2_background(input_video, output_video, 10, composed_background, crop_coords, placement_coords)
+    # 依節點核心數與同時執行的工作數分配 CPU (見 cpu_budget)
+    with (nullcontext(cpu_slots) if cpu_slots else get_cpu_budget().job()) as cpu_slots:
+        if render_mode == 'timeline':
+            # 整份分鏡一次編碼，不產生段落影片，需等所有段落的媒體完成
+            if media_graph is not None:
+                media_graph.run()
+                manager.wait_for_queue()
+            final_output_path = os.path.join(output_dir, f"{title}_final_video.mp4")
+            result = render_timeline(output_dir, paragraphs, canvas_size, crop_coords, final_output_path,
+                                     AVATAR_THRESHOLD, compose_background_with_scenes, default_avatar_keyer,
+                                     cacheable_paths, encoder_profile, burn_captions=burn_captions,
+                                     precision=precision,
+                                     min_psnr=getattr(settings, 'COMPOSITE_MIN_PSNR', 40.0))
+            if result is not None and caption_mode in ('soft', 'both'):
+                spans = [(entry.paragraph, entry.start_frame, entry.frame_count)
+                         for entry in build_timeline(output_dir, paragraphs)]
+                _add_soft_subtitles(result, spans, canvas_size)
+            _index_final_video(result)
+            print("Final combined video created successfully!")
+            return result
+        workers = min(max_workers or getattr(settings, 'PARAGRAPH_RENDER_WORKERS', 1), len(paragraphs), cpu_slots)
+    
+        if media_graph is not None:
+            _render_paragraphs_as_ready(manager, media_graph, output_dir, canvas_size, crop_coords, cacheable_paths,
+                                        workers, encoder_profile, burn_captions, cpu_slots, precision)
+        elif workers > 1:
+            _render_paragraphs_parallel(output_dir, paragraphs, canvas_size, crop_coords, cacheable_paths, workers,
+                                        encoder_profile, burn_captions, cpu_slots, precision)
         else:
-            # Create video from background image and audio
-            output_video = os.path.join(output_dir, f"final_output_paragraph_{idx + 1}.mp4")
-            audio_path = os.path.join(output_dir, paragraph["audio_path"])
-            create_video_from_image_and_audio(composed_background, audio_path, output_video)
-        
-        print(f"Video processing complete for paragraph {idx + 1}")
+            for idx, paragraph in enumerate(paragraphs):
+                render_paragraph(output_dir, idx, paragraph, canvas_size, crop_coords, cacheable_paths,
+                                 avatar_workers=min(getattr(settings, 'AVATAR_RENDER_WORKERS', 1), cpu_slots),
+                                 encoder_profile=encoder_profile, burn_captions=burn_captions, precision=precision)
     
-    print("All videos processed successfully!")
+        print("All videos processed successfully!")
 
-    # Combine all videos into one final video
-    num_paragraphs = len(storyboard["storyboard"])
-    combine_videos(title, output_dir, num_paragraphs)
+        # Combine all videos into one final video
+        final_output_path = combine_videos(title, output_dir, paragraphs, encoder_profile)
+        if final_output_path is not None and caption_mode in ('soft', 'both'):
+            _add_soft_subtitles(final_output_path, _segment_spans(output_dir, paragraphs), canvas_size)
+        _index_final_video(final_output_path)
     
-    print("Final combined video created successfully!")
+        print("Final combined video created successfully!")
+        return final_output_path
+
+
+def _index_final_video(video_path):
+    """
+    Writes the job's artifact index (see write_artifact_index) for the delivery view.
+    """
+    if video_path is None:
+        return
+    try:
+        write_artifact_index(video_path)
+    except OSError as e:
+        print(f"Error indexing final video: {str(e)}")
+
+
+def _usable_caption_mode(caption_mode, canvas_size):
+    """
+    Returns caption_mode, or 'off' when the caption font cannot be loaded.
+    """
+    if caption_mode not in CAPTION_MODES:
+        raise ValueError(f"Unknown caption mode {caption_mode!r}, expected one of {CAPTION_MODES}")
+    if caption_mode == 'off':
+        return caption_mode
+    try:
+        default_caption_font(canvas_size)
+    except OSError as e:
+        print(f"Captions disabled, caption font unavailable: {str(e)}")
+        return 'off'
+    return caption_mode
+
+
+def _segment_spans(output_dir, paragraphs):
+    """
+    (paragraph, start_frame, frame_count) of every rendered segment on the combined video.
+    """
+    spans = []
+    start_frame = 0
+    for i, paragraph in enumerate(paragraphs, start=1):
+        video_path = os.path.join(output_dir, f"final_output_paragraph_{i}.mp4")
+        if not os.path.exists(video_path):
+            continue
+        frame_count = probe_video_timing(video_path)[1]
+        spans.append((paragraph, start_frame, frame_count))
+        start_frame += frame_count
+    return spans
+
+
+def _add_soft_subtitles(video_path, spans, canvas_size):
+    """
+    Writes the captions next to the video as WebVTT and muxes them in as a mov_text track.
+    """
+    subtitle_path = os.path.splitext(video_path)[0] + '.vtt'
+    try:
+        write_webvtt(storyboard_caption_cues(spans, canvas_size), subtitle_path, SEGMENT_FPS)
+        mux_soft_subtitles(video_path, subtitle_path)
+        print(f"Soft subtitles added: {subtitle_path}")
+    except (OSError, RuntimeError) as e:
+        print(f"Error adding soft subtitles: {str(e)}")
 
 
 # New function to create video from image and audio
-def create_video_from_image_and_audio(image, audio_path, output_path, fps=24):
+def create_video_from_image_and_audio(image, audio_path, output_path, fps=SEGMENT_FPS, encoder_profile=None,
+                                      with_audio=True, caption_cues=None):
     """
     Creates a video from a static image and an audio file.
     
     :param image: The background image (numpy array)
     :param audio_path: Path to the audio file
     :param output_path: Path to save the output video
-    :param fps: Frames per second for the output video (default is 24)
-    """
-    audio = AudioFileClip(audio_path)
-    video = ImageClip(image).set_duration(audio.duration)
-    video = video.set_audio(audio)
-    video.fps = fps  # Set the fps for the video clip
-    video.write_videofile(output_path, codec="libx264", audio_codec="aac")
-    video.close()
-    audio.close()
+    :param fps: Frames per second for the output video (default is the shared SEGMENT_FPS)
+    :param encoder_profile: EncoderProfile (or its name) giving the x264 preset and CRF
+    :param with_audio: Mux the audio file into the output; otherwise it only sets the length
+    :param caption_cues: CaptionCue list (in output frames) burned into the video
+    """
+    profile = get_encoder_profile(encoder_profile)
+    # 直接讀取檔頭取得長度，不必開啟 ffmpeg 解碼
+    duration = probe_duration(audio_path)
+    
+    if caption_cues:
+        if with_audio:
+            raise ValueError("Burned-in captions are only supported for silent segments")
+        # 每句字幕只合成並寫入一張靜態畫面
+        frame_count = int(round(duration * fps))
+        stills = CaptionOverlay(caption_cues, (image.shape[1], image.shape[0])).stills(
+            cv2.cvtColor(image, cv2.COLOR_RGB2BGR), frame_count)
+        encode_still_sequence(stills, output_path, fps=fps, pix_fmt='bgr24', preset=profile.preset, crf=profile.crf)
+        return
+    
+    # 靜態畫面只送進 ffmpeg 一次，由 ffmpeg 重複畫格
+    encode_still_segment(image, output_path, duration, fps=fps, audio_source=audio_path if with_audio else None,
+                         preset=profile.preset, crf=profile.crf)
 
 if __name__ == "__main__":
     create_videos_from_images_and_audio()
@@ -0,0 +1,61 @@
+import copy
+from collections import namedtuple
+
+
+class EncoderProfile(namedtuple('EncoderProfile', ['name', 'scale', 'preset', 'crf'])):
+    """
+    Named encoder settings for a render job.
+    scale resizes the whole layout (canvas and every quad), preset / crf are passed to libx264.
+    """
+    __slots__ = ()
+
+
+ENCODER_PROFILES = {
+    # 給編輯確認版面用：540p、最快的編碼
+    'draft': EncoderProfile('draft', 0.5, 'ultrafast', 30),
+    'final': EncoderProfile('final', 1.0, 'slower', 20),
+    'archive': EncoderProfile('archive', 1.0, 'veryslow', 16),
+}
+DEFAULT_ENCODER_PROFILE = 'final'
+
+_QUAD_KEYS = ('top_left', 'top_right', 'bottom_right', 'bottom_left')
+
+
+def get_encoder_profile(name=None):
+    """
+    Returns the EncoderProfile registered under `name` (default profile when empty).
+
+    :param name: Profile name, e.g. 'draft', 'final', 'archive'
+    """
+    if isinstance(name, EncoderProfile):
+        return name
+    name = name or DEFAULT_ENCODER_PROFILE
+    if name not in ENCODER_PROFILES:
+        raise ValueError(f"Unknown encoder profile: {name}. Available: {', '.join(ENCODER_PROFILES)}")
+    return ENCODER_PROFILES[name]
+
+
+def scale_layout_config(config, scale):
+    """
+    Returns a copy of a layout config (HALF_CONFIG, FULL_CONFIG...) with canvas_size and every
+    quad corner scaled. crop_coords is left alone since it refers to the source avatar video.
+
+    :param config: Layout config dict
+    :param scale: Scale factor, e.g. 0.5 for a 540p draft
+    """
+    scaled = copy.deepcopy(config)
+    if scale == 1.0:
+        return scaled
+
+    def _scale(node):
+        for key, value in node.items():
+            if key in _QUAD_KEYS:
+                node[key] = [int(round(v * scale)) for v in value]
+            elif key == 'canvas_size':
+                # libx264 的 yuv420p 需要偶數寬高
+                node[key] = tuple(int(round(v * scale / 2)) * 2 for v in value)
+            elif isinstance(value, dict):
+                _scale(value)
+
+    _scale(scaled)
+    return scaled
@@ -0,0 +1,114 @@
+import subprocess
+import tempfile
+
+import numpy as np
+
+from .cpu_budget import ffmpeg_thread_args
+from .ffmpeg_writer import get_ffmpeg_exe
+
+
+class FFmpegPipeReader:
+    """
+    Decodes a video with ffmpeg and streams raw frames through a pipe.
+    Cropping and scaling run inside ffmpeg's filter graph, so only the placed-size pixels
+    ever reach Python; every frame is read into the same preallocated buffer.
+
+    Usage:
+        with FFmpegPipeReader(input_video, (450, 485), crop=(760, 110, 450, 485)) as reader:
+            for frame in reader:
+                ...
+    """
+
+    def __init__(self, input_path, size, crop=None, start_time=None, frame_count=None, pix_fmt='bgr24', fps=None):
+        """
+        :param input_path: Path to the video file
+        :param size: Output frame size (width, height) after cropping
+        :param crop: Optional source rectangle (x, y, w, h) cut out before scaling
+        :param start_time: Optional start position in seconds (frame-accurate seek)
+        :param frame_count: Optional number of frames to decode
+        :param pix_fmt: Pixel format of the returned frames ('bgr24' or 'rgb24')
+        :param fps: Optional output frame rate; frames are duplicated/dropped by ffmpeg to match it
+        """
+        self.input_path = input_path
+        self.size = tuple(int(v) for v in size)
+        self.frame_count = 0
+        self._finished = False
+
+        filters = [f'fps={fps}'] if fps else []
+        if crop:
+            x, y, w, h = crop
+            filters.append(f'crop={w}:{h}:{x}:{y}')
+        filters.append(f'scale={self.size[0]}:{self.size[1]}:flags=bilinear')
+
+        cmd = [get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-nostdin']
+        if start_time:
+            cmd += ['-ss', f'{start_time:.6f}']
+        # 解碼執行緒數依 CPU 預算分配 (見 cpu_budget)
+        cmd += ffmpeg_thread_args()
+        cmd += ['-i', input_path, '-map', '0:v:0']
+        if frame_count is not None:
+            cmd += ['-frames:v', str(int(frame_count))]
+        # passthrough：每個解碼出的畫格原樣輸出，不補幀也不丟幀
+        cmd += ['-vf', ','.join(filters), '-vsync', 'passthrough',
+                '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-']
+
+        self._buffer = np.empty((self.size[1], self.size[0], 3), dtype=np.uint8)
+        self._view = memoryview(self._buffer).cast('B')
+        # stderr 寫到暫存檔，避免管線塞滿造成死結
+        self._log = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=self._log,
+                                      bufsize=self._buffer.nbytes)
+
+    def read(self):
+        """
+        Reads the next frame.
+
+        :return: uint8 array of shape (height, width, 3), reused by the next call; None at the end of the stream
+        """
+        if self._proc is None:
+            return None
+        filled = 0
+        total = len(self._view)
+        while filled < total:
+            n = self._proc.stdout.readinto(self._view[filled:])
+            if not n:
+                break
+            filled += n
+        if filled < total:
+            self._finished = True
+            self.close()
+            return None
+        self.frame_count += 1
+        return self._buffer
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+    def close(self):
+        """
+        Stops the decoder. Raises RuntimeError if ffmpeg exited with an error after the stream
+        was read to the end; a reader closed early simply kills the decoder.
+        """
+        if self._proc is None:
+            return
+        proc, self._proc = self._proc, None
+        if not self._finished:
+            proc.kill()
+        proc.stdout.close()
+        returncode = proc.wait()
+        self._log.seek(0)
+        log = self._log.read().decode('utf-8', 'replace')
+        self._log.close()
+        if self._finished and returncode != 0:
+            raise RuntimeError(f"ffmpeg failed ({returncode}) reading {self.input_path}: {log[-2000:]}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
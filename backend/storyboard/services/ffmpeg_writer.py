@@ -0,0 +1,353 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+import imageio_ffmpeg
+import numpy as np
+
+from .cpu_budget import ffmpeg_thread_args
+
+
+# 所有段落影片共用的編碼參數，combine_videos 才能直接串接而不重新編碼
+SEGMENT_FPS = 25
+SEGMENT_PIX_FMT = 'yuv420p'
+SEGMENT_TIMESCALE = 12800
+SEGMENT_AUDIO_CODEC = 'aac'
+SEGMENT_AUDIO_RATE = 44100
+SEGMENT_AUDIO_CHANNELS = 2
+SEGMENT_AUDIO_ARGS = ['-c:a', SEGMENT_AUDIO_CODEC, '-ar', str(SEGMENT_AUDIO_RATE), '-ac', str(SEGMENT_AUDIO_CHANNELS)]
+
+
+def get_ffmpeg_exe():
+    """
+    Returns the ffmpeg binary, the same one moviepy uses (bundled with imageio-ffmpeg
+    unless IMAGEIO_FFMPEG_EXE points elsewhere).
+    """
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def run_ffmpeg(args):
+    """
+    Runs ffmpeg with the given arguments and raises RuntimeError with its log on failure.
+
+    :param args: ffmpeg arguments, without the executable
+    :return: ffmpeg's stderr output
+    """
+    result = subprocess.run([get_ffmpeg_exe(), '-hide_banner', '-y'] + list(args),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    log = result.stderr.decode('utf-8', 'replace')
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {log[-2000:]}")
+    return log
+
+
+def probe_media_format(path):
+    """
+    Reads the stream parameters of a media file from ffmpeg's input banner.
+
+    :param path: Path to the media file
+    :return: Dict with duration (seconds), video_codec, width, height, fps, pix_fmt, timescale,
+             audio_codec, sample_rate, channels (missing streams give None values)
+    """
+    result = subprocess.run([get_ffmpeg_exe(), '-hide_banner', '-i', path],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    log = result.stderr.decode('utf-8', 'replace')
+
+    info = dict.fromkeys(['duration', 'video_codec', 'width', 'height', 'fps', 'pix_fmt', 'timescale',
+                          'audio_codec', 'sample_rate', 'channels'])
+    duration = re.search(r'Duration: (\d+):(\d+):([\d.]+)', log)
+    if duration:
+        hours, minutes, seconds = duration.groups()
+        info['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    video = re.search(r'Stream #\S+: Video: (\w+).*', log)
+    if video:
+        line = video.group(0)
+        info['video_codec'] = video.group(1)
+        size = re.search(r', ([a-z0-9]+)(?:\([^)]*\))?, (\d+)x(\d+)', line)
+        if size:
+            info['pix_fmt'], info['width'], info['height'] = size.group(1), int(size.group(2)), int(size.group(3))
+        fps = re.search(r'([\d.]+) fps', line)
+        info['fps'] = float(fps.group(1)) if fps else None
+        tbn = re.search(r'([\d.]+k?) tbn', line)
+        info['timescale'] = tbn.group(1) if tbn else None
+    audio = re.search(r'Stream #\S+: Audio: (\w+).*?, (\d+) Hz, ([^,]+)', log)
+    if audio:
+        info['audio_codec'] = audio.group(1)
+        info['sample_rate'] = int(audio.group(2))
+        info['channels'] = audio.group(3).strip()
+    return info
+
+
+def segment_audio_args(audio_source):
+    """
+    Returns the ffmpeg audio arguments that bring `audio_source` to the segment audio format:
+    a plain stream copy when it already matches, an AAC re-encode otherwise.
+
+    :param audio_source: Media file providing the audio track
+    """
+    info = probe_media_format(audio_source)
+    if (info['audio_codec'] == SEGMENT_AUDIO_CODEC and info['sample_rate'] == SEGMENT_AUDIO_RATE
+            and info['channels'] == 'stereo'):
+        return ['-c:a', 'copy']
+    return list(SEGMENT_AUDIO_ARGS)
+
+
+def concat_copy(input_paths, output_path, audio_source=None, duration=None, audio_args=None):
+    """
+    Joins video files with the ffmpeg concat demuxer, without re-encoding the video.
+    The inputs must share codec parameters.
+
+    :param input_paths: Files to join, in order
+    :param output_path: Path to save the joined video
+    :param audio_source: Optional media file whose audio track replaces the inputs' audio
+    :param duration: Optional output duration in seconds
+    :param audio_args: ffmpeg audio arguments (default: stream copy)
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8') as list_file:
+        for path in input_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+    try:
+        args = ['-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_file.name]
+        if audio_source:
+            args += ['-i', audio_source, '-map', '0:v:0', '-map', '1:a:0?']
+        if duration:
+            args += ['-t', f'{duration:.6f}']
+        args += ['-c:v', 'copy'] + (audio_args or ['-c:a', 'copy'])
+        args += ['-movflags', '+faststart', output_path]
+        run_ffmpeg(args)
+    finally:
+        os.remove(list_file.name)
+
+
+def encode_still_segment(image, output_path, duration, fps=SEGMENT_FPS, audio_source=None, pix_fmt='rgb24',
+                         codec='libx264', preset='medium', crf=23, gop_seconds=10):
+    """
+    Encodes a single still frame held for `duration` seconds.
+    The frame crosses the pipe once and ffmpeg's loop filter repeats it, with x264 tuned for
+    still images and a long GOP, so the repeated frames are nearly free to encode.
+
+    :param image: uint8 array of shape (height, width, 3) in pix_fmt order
+    :param output_path: Path to save the output video
+    :param duration: Length of the segment in seconds
+    :param fps: Frames per second of the output
+    :param audio_source: Optional audio file muxed into the output (encoded to the segment audio format)
+    :param pix_fmt: Pixel format of `image`
+    :param codec: Video codec
+    :param preset: x264 preset
+    :param crf: x264 constant rate factor
+    :param gop_seconds: Keyframe interval in seconds
+    """
+    height, width = image.shape[:2]
+    cmd = [
+        get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'rawvideo',
+        '-pix_fmt', pix_fmt,
+        '-s', f'{width}x{height}',
+        '-r', f'{fps}',
+        '-i', '-',
+    ]
+    if audio_source:
+        cmd += ['-i', audio_source, '-map', '0:v:0', '-map', '1:a:0'] + SEGMENT_AUDIO_ARGS
+    # 編碼執行緒數依 CPU 預算分配 (見 cpu_budget)
+    cmd += ffmpeg_thread_args()
+    cmd += [
+        '-filter:v', 'loop=loop=-1:size=1:start=0',
+        '-t', f'{duration:.6f}',
+        '-c:v', codec,
+        '-tune', 'stillimage',
+        '-preset', preset,
+        '-crf', str(crf),
+        '-g', str(int(round(fps * gop_seconds))),
+        '-pix_fmt', SEGMENT_PIX_FMT,
+        '-video_track_timescale', str(SEGMENT_TIMESCALE),
+        '-movflags', '+faststart',
+        output_path,
+    ]
+    result = subprocess.run(cmd, input=np.ascontiguousarray(image).tobytes(),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        log = result.stderr.decode('utf-8', 'replace')
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}) writing {output_path}: {log[-2000:]}")
+
+
+
+def encode_still_sequence(stills, output_path, fps=SEGMENT_FPS, pix_fmt='rgb24', codec='libx264', preset='medium',
+                          crf=23, gop_seconds=10):
+    """
+    Encodes a sequence of still frames, each held for a whole number of frames
+    (e.g. a still paragraph whose burned-in caption changes a few times).
+    Every distinct frame is written once and timed by the concat demuxer, so like
+    encode_still_segment nothing is piped per output frame.
+
+    :param stills: List of (image, frame_count); images are uint8 arrays in pix_fmt order
+    :param output_path: Path to save the output video
+    :param fps: Frames per second of the output
+    :param pix_fmt: Pixel format of the images, rgb24 or bgr24
+    :param codec: Video codec
+    :param preset: x264 preset
+    :param crf: x264 constant rate factor
+    :param gop_seconds: Keyframe interval in seconds
+    """
+    stills = [(image, frame_count) for image, frame_count in stills if frame_count > 0]
+    if not stills:
+        raise ValueError(f"No frames to encode for {output_path}")
+    work_dir = tempfile.mkdtemp(prefix='stills_', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        lines = ['ffconcat version 1.0']
+        for i, (image, frame_count) in enumerate(stills):
+            height, width = image.shape[:2]
+            rgb = image[:, :, ::-1] if pix_fmt == 'bgr24' else image
+            # PPM：檔頭加原始 RGB，寫入幾乎不花時間
+            with open(os.path.join(work_dir, f'{i:04d}.ppm'), 'wb') as f:
+                f.write(b'P6\n%d %d\n255\n' % (width, height))
+                f.write(np.ascontiguousarray(rgb).tobytes())
+            lines += [f"file '{i:04d}.ppm'", f'duration {frame_count / fps:.6f}']
+        # concat demuxer 會忽略最後一個檔案的 duration，重複列出一次
+        lines.append(f"file '{len(stills) - 1:04d}.ppm'")
+        list_path = os.path.join(work_dir, 'stills.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+        total_frames = sum(frame_count for _, frame_count in stills)
+        args = [
+            '-loglevel', 'error',
+            '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-filter:v', f'fps={fps}',
+            '-t', f'{total_frames / fps:.6f}',
+        ]
+        args += ffmpeg_thread_args()
+        args += [
+            '-c:v', codec,
+            '-tune', 'stillimage',
+            '-preset', preset,
+            '-crf', str(crf),
+            '-g', str(int(round(fps * gop_seconds))),
+            '-pix_fmt', SEGMENT_PIX_FMT,
+            '-video_track_timescale', str(SEGMENT_TIMESCALE),
+            '-movflags', '+faststart',
+            output_path,
+        ]
+        run_ffmpeg(args)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+class FFmpegPipeWriter:
+    """
+    Streams raw frames into a single ffmpeg libx264 encode.
+    When audio_source is given, its first audio stream is muxed into the output
+    in the same ffmpeg process (stream-copied by default), so no temp file or second encode is needed.
+
+    Usage:
+        with FFmpegPipeWriter(output_path, (1920, 1080), 25, audio_source=input_video) as writer:
+            for frame in frames:
+                writer.write(frame)
+    """
+
+    def __init__(self, output_path, size, fps, audio_source=None, pix_fmt='bgr24',
+                 codec='libx264', preset='medium', crf=23, audio_args=None, duration=None, output_fps=None):
+        """
+        :param output_path: Path to save the output video
+        :param size: Frame size (width, height)
+        :param fps: Frames per second of the incoming frames
+        :param audio_source: Optional media file whose audio track is muxed into the output
+        :param pix_fmt: Pixel format of the frames passed to write()
+        :param codec: Video codec
+        :param preset: x264 preset
+        :param crf: x264 constant rate factor
+        :param audio_args: ffmpeg arguments for the muxed audio (default: stream copy)
+        :param duration: Optional output duration in seconds; trims a longer audio track
+        :param output_fps: Optional output frame rate; frames are duplicated/dropped to match it
+        """
+        self.output_path = output_path
+        self.size = tuple(size)
+        self.frame_count = 0
+        self._frame_shape = (self.size[1], self.size[0], 3)
+
+        cmd = [
+            get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'rawvideo',
+            '-pix_fmt', pix_fmt,
+            '-s', f'{self.size[0]}x{self.size[1]}',
+            '-r', f'{fps}',
+            '-i', '-',
+        ]
+        if audio_source:
+            # 不使用 -shortest：搭配管線輸入時 ffmpeg 會提早截斷最後幾秒畫面
+            cmd += ['-i', audio_source, '-map', '0:v:0', '-map', '1:a:0?'] + (audio_args or ['-c:a', 'copy'])
+        if duration:
+            cmd += ['-t', f'{duration:.6f}']
+        if output_fps:
+            cmd += ['-r', f'{output_fps}']
+        cmd += ffmpeg_thread_args()
+        cmd += [
+            '-c:v', codec,
+            '-preset', preset,
+            '-crf', str(crf),
+            '-pix_fmt', SEGMENT_PIX_FMT,
+            '-video_track_timescale', str(SEGMENT_TIMESCALE),
+            '-movflags', '+faststart',
+            output_path,
+        ]
+
+        # stderr 寫到暫存檔，避免管線塞滿造成死結
+        self._log = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._log)
+
+    def write(self, frame):
+        """
+        Sends one frame to the encoder.
+
+        :param frame: uint8 array of shape (height, width, 3) in the writer's pix_fmt
+        :raises ValueError: The frame does not match the writer's size
+        """
+        # 尺寸不符的畫面寫進 rawvideo 管線不會報錯，只會讓之後的畫面全部錯位
+        if frame.shape != self._frame_shape or frame.dtype != np.uint8:
+            raise ValueError(f"Expected a uint8 frame of shape {self._frame_shape}, got {frame.dtype} {frame.shape}")
+        try:
+            self._proc.stdin.write(memoryview(frame).cast('B') if frame.flags.c_contiguous else frame.tobytes())
+        except BrokenPipeError:
+            self.close()
+            raise
+        self.frame_count += 1
+
+    def close(self):
+        """
+        Flushes the encoder and waits for ffmpeg to finish.
+        """
+        if self._proc is None:
+            return
+        proc, self._proc = self._proc, None
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = proc.wait()
+        self._log.seek(0)
+        log = self._log.read().decode('utf-8', 'replace')
+        self._log.close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed ({returncode}) writing {self.output_path}: {log[-2000:]}")
+
+    def abort(self):
+        """
+        Kills the encoder without finalising the output.
+        """
+        if self._proc is None:
+            return
+        proc, self._proc = self._proc, None
+        proc.kill()
+        proc.wait()
+        self._log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
@@ -0,0 +1,177 @@
+import os
+import shutil
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+from .artifact_index import ARTIFACT_INDEX_FILE
+from .job_workspace import ACCESS_FILE, LEASE_DIR, generated_root, is_leased, prune_workspace, remove_workspace
+
+
+# 工作目錄中保留到最後的成品；其餘 (段落影片、音檔、人偶影片、圖片) 都能重新產生
+FINAL_ARTIFACT_MARKERS = ('final_video',)
+FINAL_ARTIFACT_NAMES = ('story_board.json', ARTIFACT_INDEX_FILE)
+
+
+class WorkspaceUsage(namedtuple('WorkspaceUsage', ['path', 'last_access', 'intermediate_bytes', 'final_bytes', 'leased'])):
+    """
+    Disk usage of one job workspace, as seen by the janitor.
+    """
+    __slots__ = ()
+
+    @property
+    def total_bytes(self):
+        return self.intermediate_bytes + self.final_bytes
+
+
+def is_final_artifact(relative_path):
+    """
+    True for files of a workspace that are kept once its intermediates are pruned.
+    """
+    name = os.path.basename(relative_path)
+    return name in FINAL_ARTIFACT_NAMES or any(marker in name for marker in FINAL_ARTIFACT_MARKERS)
+
+
+def scan_workspace(job_dir, ttl=None):
+    """
+    Measures a workspace. Its last access is the newest file write or recorded read (mark_access).
+    """
+    intermediate_bytes = final_bytes = 0
+    # 不用目錄本身的 mtime：清理中間檔也會更新它
+    last_access = None
+    for dirpath, dirnames, filenames in os.walk(job_dir):
+        if LEASE_DIR in dirnames:
+            dirnames.remove(LEASE_DIR)
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            last_access = stat.st_mtime if last_access is None else max(last_access, stat.st_mtime)
+            if name == ACCESS_FILE:
+                continue
+            if is_final_artifact(os.path.relpath(path, job_dir)):
+                final_bytes += stat.st_size
+            else:
+                intermediate_bytes += stat.st_size
+    if last_access is None:
+        last_access = os.path.getmtime(job_dir)
+    return WorkspaceUsage(job_dir, last_access, intermediate_bytes, final_bytes, is_leased(job_dir, ttl))
+
+
+def enforce_generated_quota(quota_bytes, root=None, ttl=None, grace=0):
+    """
+    Shrinks generated/ below quota_bytes, least recently used workspaces first. Intermediates
+    of every idle workspace go before any final video; a whole workspace is only removed
+    once pruning is not enough. Leased workspaces (jobs in flight, requests opening a video)
+    are never touched. A video handed to the web server (x-accel / x-sendfile) is opened after
+    the lease is gone, so workspaces used within the last `grace` seconds keep their final video.
+
+    :param quota_bytes: Bytes generated/ may use
+    :param root: Directory holding the workspaces (default generated_root())
+    :param ttl: Lease TTL for leases of other hosts (default JOB_LEASE_TTL_SECONDS setting)
+    :param grace: Seconds since the last access (mark_access) during which a workspace is not removed
+    :return: Report dict
+    """
+    root = root or generated_root()
+    report = {'total_bytes': 0, 'freed_bytes': 0, 'pruned': [], 'removed': []}
+    if not os.path.isdir(root):
+        return report
+
+    workspaces = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.startswith('.trash-'):
+            # 上次刪除到一半中斷的目錄
+            shutil.rmtree(path, ignore_errors=True)
+        elif not name.startswith('.') and os.path.isdir(path):
+            try:
+                workspaces.append(scan_workspace(path, ttl))
+            except OSError:
+                continue
+
+    sizes = {usage.path: usage.total_bytes for usage in workspaces}
+    total = report['total_bytes'] = sum(sizes.values())
+    idle = sorted((usage for usage in workspaces if not usage.leased), key=lambda usage: usage.last_access)
+
+    # 先刪中間檔，全部都刪過仍超量才移除整個工作目錄 (含成品)
+    for usage in idle:
+        if total <= quota_bytes:
+            break
+        if not usage.intermediate_bytes:
+            continue
+        freed = prune_workspace(usage.path, is_final_artifact, ttl)
+        if freed:
+            total -= freed
+            sizes[usage.path] -= freed
+            report['freed_bytes'] += freed
+            report['pruned'].append(os.path.basename(usage.path))
+    recent = time.time() - grace
+    for usage in idle:
+        if total <= quota_bytes or usage.last_access > recent:
+            # idle 依最近使用時間排序：之後的工作都在寬限期內
+            break
+        if remove_workspace(usage.path, ttl):
+            total -= sizes[usage.path]
+            report['freed_bytes'] += sizes[usage.path]
+            report['removed'].append(os.path.basename(usage.path))
+    return report
+
+
+def enforce_cache_quota(quota_bytes, root, exclude=()):
+    """
+    Shrinks a RenderCache below quota_bytes, least recently used entries first
+    (RenderCache.fetch refreshes an entry's mtime on every hit). An entry still hard-linked
+    from a workspace (caches written before fetch switched to copies) is counted under the
+    generated/ quota only and left alone here: removing it would free nothing.
+
+    :param quota_bytes: Bytes the cache may use
+    :param root: Cache directory
+    :param exclude: Directories under root left alone (e.g. the plate store)
+    :return: Report dict
+    """
+    report = {'total_bytes': 0, 'freed_bytes': 0, 'removed': 0}
+    if not os.path.isdir(root):
+        return report
+    excluded = {os.path.abspath(path) for path in exclude if path}
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if os.path.abspath(os.path.join(dirpath, name)) not in excluded]
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if stat.st_nlink > 1:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = report['total_bytes'] = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= quota_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        report['freed_bytes'] += size
+        report['removed'] += 1
+    return report
+
+
+def run_janitor():
+    """
+    Applies the disk quotas of generated/ (GENERATED_QUOTA_MB) and of the render cache
+    (RENDER_CACHE_QUOTA_MB). Runs as the cleanup_old_files Celery task, outside the request path.
+    """
+    report = {'generated': enforce_generated_quota(getattr(settings, 'GENERATED_QUOTA_MB', 20480) * 1024 * 1024,
+                                                   grace=getattr(settings, 'VIDEO_SERVE_GRACE_SECONDS', 3600))}
+    cache_root = getattr(settings, 'RENDER_CACHE_DIR', None)
+    if cache_root:
+        report['render_cache'] = enforce_cache_quota(getattr(settings, 'RENDER_CACHE_QUOTA_MB', 10240) * 1024 * 1024,
+                                                     cache_root, exclude=[getattr(settings, 'PLATE_STORE_DIR', None)])
+    return report
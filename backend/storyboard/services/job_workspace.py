@@ -0,0 +1,254 @@
+import fcntl
+import os
+import random
+import shutil
+import socket
+import string
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+# 工作目錄中存放租約檔案的子目錄 (一個持有者一個檔案)
+LEASE_DIR = '.leases'
+# generated/ 底下的鎖檔：租約的增減與清理互斥
+LOCK_FILE = '.workspaces.lock'
+# 最後一次讀取成品的時間 (以 mtime 記錄，不動到成品本身)
+ACCESS_FILE = '.last_access'
+JOB_ID_ALPHABET = string.ascii_lowercase + string.digits
+
+
+def generated_root():
+    """
+    Directory holding one workspace per job (BASE_DIR/generated).
+    """
+    return os.path.join(settings.BASE_DIR, 'generated')
+
+
+def new_job_id(length=10):
+    """
+    Random job id of lowercase letters and digits.
+    """
+    return ''.join(random.choices(JOB_ID_ALPHABET, k=length))
+
+
+@contextmanager
+def workspace_lock(root):
+    """
+    Exclusive lock over the workspaces (or other shared entries, e.g. CPU budget slots)
+    under root, shared by every process on this host.
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, LOCK_FILE), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def pid_alive(pid):
+    """
+    True while a process with this pid runs on this host.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _lease_is_live(lease_path, ttl=None):
+    """
+    A lease is live while the process holding it runs. Leases taken on another host
+    (generated/ on a shared volume) cannot be checked that way and expire after ttl seconds
+    (JOB_LEASE_TTL_SECONDS setting).
+    """
+    try:
+        host, pid, _ = os.path.basename(lease_path).rsplit('-', 2)
+        pid = int(pid)
+    except ValueError:
+        return False
+    if host == socket.gethostname():
+        return pid_alive(pid)
+    if ttl is None:
+        ttl = getattr(settings, 'JOB_LEASE_TTL_SECONDS', 6 * 3600)
+    try:
+        return time.time() - os.path.getmtime(lease_path) < ttl
+    except OSError:
+        return False
+
+
+def live_leases(job_dir, ttl=None):
+    """
+    Names of the live leases on a workspace.
+    """
+    lease_dir = os.path.join(job_dir, LEASE_DIR)
+    try:
+        names = os.listdir(lease_dir)
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+    return [name for name in names if _lease_is_live(os.path.join(lease_dir, name), ttl)]
+
+
+def is_leased(job_dir, ttl=None):
+    """
+    True while anything holds a lease on the workspace.
+    """
+    return bool(live_leases(job_dir, ttl))
+
+
+class WorkspaceLease:
+    """
+    One holder's lease on a JobWorkspace. Release it (or use it as a context manager)
+    when done; a lease whose process died stops counting on its own.
+    """
+
+    def __init__(self, workspace, path):
+        self.workspace = workspace
+        self.path = path
+
+    @property
+    def job_id(self):
+        return self.workspace.job_id
+
+    def release(self):
+        """
+        Drops the lease (idempotent).
+        """
+        with workspace_lock(self.workspace.root):
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class JobWorkspace:
+    """
+    Directory of one render job under generated/, named by a unique job id.
+
+    Everything that works in a workspace holds a lease on it (acquire). Leases are files
+    under <workspace>/.leases, one per holder, so they are reference-counted across threads
+    and processes; remove_workspace never deletes a workspace with a live lease.
+    """
+
+    def __init__(self, job_id, root=None):
+        """
+        :param job_id: Job id (directory name)
+        :param root: Directory holding the workspaces (default generated_root())
+        """
+        self.job_id = job_id
+        self.root = root or generated_root()
+        self.path = os.path.join(self.root, job_id)
+
+    @classmethod
+    def create(cls, root=None, length=10):
+        """
+        Creates a workspace under a new, unused job id. The workspace is leased from the moment
+        it exists, so cleanup cannot remove it before the caller starts using it.
+
+        :return: WorkspaceLease held by the caller (lease.workspace is the new workspace)
+        """
+        root = root or generated_root()
+        while True:
+            workspace = cls(new_job_id(length), root)
+            with workspace_lock(root):
+                try:
+                    os.mkdir(workspace.path)
+                except FileExistsError:
+                    continue
+                return workspace._add_lease()
+
+    def acquire(self):
+        """
+        Takes a lease on an existing workspace.
+
+        :return: WorkspaceLease
+        :raises FileNotFoundError: The workspace no longer exists
+        """
+        with workspace_lock(self.root):
+            if not os.path.isdir(self.path):
+                raise FileNotFoundError(f"Workspace {self.job_id} does not exist")
+            return self._add_lease()
+
+    def _add_lease(self):
+        # 呼叫端須持有 workspace_lock
+        lease_dir = os.path.join(self.path, LEASE_DIR)
+        os.makedirs(lease_dir, exist_ok=True)
+        path = os.path.join(lease_dir, f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex}")
+        with open(path, 'w'):
+            pass
+        return WorkspaceLease(self, path)
+
+    def is_leased(self):
+        return is_leased(self.path)
+
+
+def remove_workspace(job_dir, ttl=None):
+    """
+    Deletes a workspace unless it is leased. The directory is moved aside under the lock and
+    deleted after it, so a lease can never be taken on a half-deleted workspace.
+
+    :return: True when the workspace was removed
+    """
+    root = os.path.dirname(os.path.abspath(job_dir))
+    with workspace_lock(root):
+        if not os.path.isdir(job_dir) or is_leased(job_dir, ttl):
+            return False
+        trash = os.path.join(root, f'.trash-{os.path.basename(job_dir)}-{uuid.uuid4().hex[:8]}')
+        os.rename(job_dir, trash)
+    shutil.rmtree(trash, ignore_errors=True)
+    return True
+
+
+def mark_access(job_dir):
+    """
+    Records that a workspace was just used (e.g. its video was served), for LRU cleanup.
+    """
+    try:
+        with open(os.path.join(job_dir, ACCESS_FILE), 'a'):
+            pass
+        os.utime(os.path.join(job_dir, ACCESS_FILE))
+    except OSError:
+        pass
+
+
+def prune_workspace(job_dir, keep, ttl=None):
+    """
+    Deletes the files of a workspace that keep() rejects, unless the workspace is leased.
+    Runs under the workspace lock, so no lease can be taken while files are disappearing.
+
+    :param job_dir: Workspace directory
+    :param keep: Callable taking a path relative to job_dir; True keeps the file
+    :return: Bytes freed, or None when the workspace is leased
+    """
+    root = os.path.dirname(os.path.abspath(job_dir))
+    freed = 0
+    with workspace_lock(root):
+        if not os.path.isdir(job_dir) or is_leased(job_dir, ttl):
+            return None
+        for dirpath, dirnames, filenames in os.walk(job_dir, topdown=False):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                relative = os.path.relpath(path, job_dir)
+                if relative.startswith(LEASE_DIR) or name == ACCESS_FILE or keep(relative):
+                    continue
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                    freed += size
+                except OSError:
+                    pass
+            if dirpath != job_dir and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+    return freed
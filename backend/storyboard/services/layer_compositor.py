@@ -0,0 +1,300 @@
+from collections import Counter, OrderedDict, namedtuple
+from threading import Lock
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .render_cache import file_digest
+
+
+# float: float32 [0, 1] 運算；fixed: uint8 定點運算，記憶體只有 1/4
+PRECISIONS = ('float', 'fixed')
+
+
+def quad_from_info(img_info):
+    """
+    Returns the destination quad of a layer as a (4, 2) float32 array in tl, tr, br, bl order.
+
+    :param img_info: Layer dict with top_left / top_right / bottom_right / bottom_left
+    """
+    return np.array([img_info["top_left"],
+                     img_info["top_right"],
+                     img_info["bottom_right"],
+                     img_info["bottom_left"]], dtype=np.float32)
+
+
+def load_rgba(img_path, precision='float'):
+    """
+    Reads an image file as an RGBA array: float32 normalised to [0, 1],
+    or the raw uint8 values for the fixed-point path.
+
+    :param img_path: Path to the image file
+    :param precision: One of PRECISIONS
+    """
+    with Image.open(img_path) as pil_img:
+        if pil_img.mode != 'RGBA':
+            pil_img = pil_img.convert('RGBA')
+        if precision == 'fixed':
+            return np.array(pil_img, dtype=np.uint8)
+        return np.asarray(pil_img, dtype=np.float32) / 255.0
+
+
+def new_canvas(canvas_size, precision='float'):
+    """
+    Returns an empty (transparent) premultiplied RGBA canvas for the given precision.
+
+    :param canvas_size: Size of the canvas (width, height)
+    :param precision: One of PRECISIONS
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown compositing precision: {precision}")
+    dtype = np.uint8 if precision == 'fixed' else np.float32
+    return np.zeros((canvas_size[1], canvas_size[0], 4), dtype=dtype)
+
+
+def canvas_to_rgb(canvas):
+    """
+    Flattens a premultiplied canvas onto black and returns it as RGB uint8.
+
+    :param canvas: Canvas from new_canvas
+    """
+    if canvas.dtype == np.uint8:
+        return np.ascontiguousarray(canvas[:, :, :3])
+    return (np.clip(canvas[:, :, :3], 0, 1) * 255).astype(np.uint8)
+
+
+def psnr(reference, candidate):
+    """
+    Peak signal-to-noise ratio (dB) between two uint8 images; inf when they are identical.
+    Used to validate the fixed-point path against the float path.
+
+    :param reference: Reference uint8 image
+    :param candidate: uint8 image of the same shape
+    """
+    mse = np.mean((reference.astype(np.float64) - candidate.astype(np.float64)) ** 2)
+    if mse == 0:
+        return float('inf')
+    return 10.0 * np.log10(255.0 ** 2 / mse)
+
+
+class Plate(namedtuple('Plate', ['x', 'y', 'pixels'])):
+    """
+    A warped, premultiplied RGBA layer that only covers the bounding rectangle
+    of its destination quad; (x, y) is the top-left corner of that rectangle on the canvas.
+    """
+    __slots__ = ()
+
+    @property
+    def width(self):
+        return self.pixels.shape[1]
+
+    @property
+    def height(self):
+        return self.pixels.shape[0]
+
+
+def quad_roi(quad, canvas_size):
+    """
+    Returns the canvas rectangle (x0, y0, x1, y1) touched by warping onto the quad,
+    clipped to the canvas, or None when the quad lies entirely outside it.
+
+    :param quad: Destination quad (tl, tr, br, bl)
+    :param canvas_size: Size of the canvas (width, height)
+    """
+    quad = np.asarray(quad, dtype=np.float32)
+    # 雙線性插值最多會影響到右/下方多一個像素
+    x0 = max(int(np.floor(quad[:, 0].min())), 0)
+    y0 = max(int(np.floor(quad[:, 1].min())), 0)
+    x1 = min(int(np.ceil(quad[:, 0].max())) + 1, canvas_size[0])
+    y1 = min(int(np.ceil(quad[:, 1].max())) + 1, canvas_size[1])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return x0, y0, x1, y1
+
+
+def axis_aligned_rect(quad):
+    """
+    Returns the pixel rectangle (x0, y0, x1, y1) covered by an axis-aligned quad with integer
+    corners (x1 / y1 exclusive, so the corner pixels are included), or None for skewed quads.
+
+    :param quad: Quad (tl, tr, br, bl)
+    """
+    quad = np.asarray(quad, dtype=np.float32)
+    tl, tr, br, bl = quad
+    if not np.array_equal(quad, np.round(quad)):
+        return None
+    if tl[1] != tr[1] or bl[1] != br[1] or tl[0] != bl[0] or tr[0] != br[0]:
+        return None
+    if tr[0] <= tl[0] or bl[1] <= tl[1]:
+        return None
+    return int(tl[0]), int(tl[1]), int(tr[0]) + 1, int(bl[1]) + 1
+
+
+def warp_layer(img, quad, canvas_size):
+    """
+    Warps an RGBA image onto its destination quad and premultiplies it by alpha.
+    Only the bounding rectangle of the quad is rendered, not the whole canvas.
+    Axis-aligned rectangles (almost every quad in config.py) take a plain resize instead of a
+    perspective warp. uint8 images stay uint8 (fixed-point path), float32 images stay float32.
+
+    :param img: float32 RGBA image in [0, 1], or uint8 RGBA image
+    :param quad: Destination quad (tl, tr, br, bl)
+    :param canvas_size: Size of the canvas (width, height)
+    :return: Plate covering the quad ROI, or None when the quad is off-canvas
+    """
+    roi = quad_roi(quad, canvas_size)
+    if roi is None:
+        return None
+    x0, y0, x1, y1 = roi
+
+    rect = axis_aligned_rect(quad)
+    if rect is not None:
+        # 矩形：縮放到目的大小後直接貼上，超出畫布的部分裁掉
+        rx0, ry0, rx1, ry1 = rect
+        resized = cv2.resize(img, (rx1 - rx0, ry1 - ry0), interpolation=cv2.INTER_LINEAR)
+        pixels = np.ascontiguousarray(resized[y0 - ry0:y1 - ry0, x0 - rx0:x1 - rx0])
+    else:
+        src_pts = np.array([[0, 0],
+                            [img.shape[1] - 1, 0],
+                            [img.shape[1] - 1, img.shape[0] - 1],
+                            [0, img.shape[0] - 1]], dtype=np.float32)
+        dst_pts = np.asarray(quad, dtype=np.float32) - np.array([x0, y0], dtype=np.float32)
+        M = cv2.getPerspectiveTransform(src_pts, dst_pts)
+
+        pixels = cv2.warpPerspective(
+            img,
+            M,
+            (x1 - x0, y1 - y0),
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=(0, 0, 0, 0)
+        )
+    if pixels.dtype == np.uint8:
+        # 定點版本：rgb * a / 255，由 OpenCV 四捨五入
+        alpha = cv2.merge([pixels[:, :, 3]] * 3 + [np.full(pixels.shape[:2], 255, dtype=np.uint8)])
+        cv2.multiply(pixels, alpha, dst=pixels, scale=1.0 / 255.0)
+        return Plate(x0, y0, pixels)
+    np.clip(pixels[:, :, 3], 0, 1, out=pixels[:, :, 3])
+    # 預先乘上 alpha，之後每次合成只需要一次乘加
+    pixels[:, :, :3] *= pixels[:, :, 3:4]
+    return Plate(x0, y0, pixels)
+
+
+def blend_layer(canvas, plate):
+    """
+    Composites a premultiplied plate over the canvas (Porter-Duff "over"),
+    in place and only inside the plate's rectangle.
+
+    :param canvas: RGBA canvas from new_canvas (same precision as the plate), modified in place
+    :param plate: Plate returned by warp_layer
+    """
+    if plate is None:
+        return
+    region = canvas[plate.y:plate.y + plate.height, plate.x:plate.x + plate.width]
+    if canvas.dtype == np.uint8:
+        # region * (255 - a) / 255 + plate，預乘後的總和不會超過 255
+        inverse_alpha = cv2.merge([255 - plate.pixels[:, :, 3]] * 4)
+        cv2.multiply(region, inverse_alpha, dst=region, scale=1.0 / 255.0)
+        cv2.add(region, plate.pixels, dst=region)
+        return
+    region *= 1.0 - plate.pixels[:, :, 3:4]
+    region += plate.pixels
+
+
+def shared_layer_paths(paragraphs):
+    """
+    Returns the img_path values used by more than one paragraph (background, title...).
+    Those are the layers worth keeping in the layer cache.
+
+    :param paragraphs: storyboard["storyboard"] list
+    """
+    counts = Counter(img_info["img_path"]
+                     for paragraph in paragraphs
+                     for img_info in paragraph.get("images", []))
+    return {img_path for img_path, count in counts.items() if count > 1}
+
+
+class LayerCache:
+    """
+    LRU cache of warped, premultiplied layer plates (see Plate).
+    Keyed by image content hash (file_digest), destination quad, canvas size and precision, so the same
+    background / title file placed at the same spot is only decoded and warped once.
+    Pinned plates (e.g. memory-mapped base plates from the plate store) are never evicted.
+    """
+
+    def __init__(self, max_entries=6):
+        self.max_entries = max_entries
+        self._plates = OrderedDict()
+        self._pinned = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def make_key(img_path, quad, canvas_size, precision='float'):
+        # 內容雜湊依 (路徑, 大小, mtime) 記憶，同一個檔案只讀一次
+        quad_key = tuple(float(v) for v in np.asarray(quad).ravel())
+        return file_digest(img_path), quad_key, tuple(canvas_size), precision
+
+    def get(self, key):
+        with self._lock:
+            if key in self._pinned:
+                return self._pinned[key]
+            plate = self._plates.get(key)
+            if plate is not None:
+                self._plates.move_to_end(key)
+            return plate
+
+    def put(self, key, plate):
+        # 快取內容是唯讀的，避免合成時被誤改
+        if plate is not None:
+            plate.pixels.flags.writeable = False
+        with self._lock:
+            self._plates[key] = plate
+            self._plates.move_to_end(key)
+            while len(self._plates) > self.max_entries:
+                self._plates.popitem(last=False)
+
+    def pin(self, key, plate):
+        """
+        Registers a plate outside the LRU; the pixels are used as given (no copy).
+        """
+        if plate is not None and plate.pixels.flags.writeable:
+            plate.pixels.flags.writeable = False
+        with self._lock:
+            self._pinned[key] = plate
+
+    def is_pinned(self, key):
+        with self._lock:
+            return key in self._pinned
+
+    def get_or_build(self, img_path, quad, canvas_size, precision='float'):
+        """
+        Returns the cached plate for the layer, warping and storing it on a miss.
+
+        :param img_path: Path to the layer image file
+        :param quad: Destination quad (tl, tr, br, bl)
+        :param canvas_size: Size of the canvas (width, height)
+        :param precision: One of PRECISIONS
+        """
+        key = self.make_key(img_path, quad, canvas_size, precision)
+        with self._lock:
+            if key in self._pinned:
+                return self._pinned[key]
+            if key in self._plates:
+                self._plates.move_to_end(key)
+                return self._plates[key]
+        plate = warp_layer(load_rgba(img_path, precision), quad, canvas_size)
+        self.put(key, plate)
+        return plate
+
+    def clear(self):
+        with self._lock:
+            self._plates.clear()
+            self._pinned.clear()
+
+    def __len__(self):
+        return len(self._plates) + len(self._pinned)
+
+
+# 行程內共用的圖層快取
+layer_cache = LayerCache()
@@ -0,0 +1,334 @@
+import os
+import struct
+from functools import lru_cache
+
+from .ffmpeg_writer import probe_media_format
+
+
+# MPEG audio 標頭對照表 (kbps / Hz)
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    2.5: [11025, 12000, 8000],
+}
+
+# Celery / Django 行程長時間執行，只保留最近探測過的檔案
+PROBE_CACHE_SIZE = 1024
+
+
+def _empty_info(fmt):
+    return {'format': fmt, 'duration': None, 'sample_rate': None, 'channels': None,
+            'video_duration': None, 'frame_count': None, 'fps': None}
+
+
+def _parse_mp3(f, file_size):
+    info = _empty_info('mp3')
+    head = f.read(10)
+    start = 0
+    if head[:3] == b'ID3' and len(head) == 10:
+        # ID3v2 的長度是 synchsafe integer
+        size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+        start = 10 + size + (10 if head[5] & 0x10 else 0)
+    f.seek(start)
+    data = f.read(64 * 1024)
+    for offset in range(len(data) - 4):
+        if data[offset] != 0xFF or (data[offset + 1] & 0xE0) != 0xE0:
+            continue
+        b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+        version = {3: 1, 2: 2, 0: 2.5}.get((b1 >> 3) & 0x3)
+        layer = {3: 1, 2: 2, 1: 3}.get((b1 >> 1) & 0x3)
+        bitrate_index = b2 >> 4
+        rate_index = (b2 >> 2) & 0x3
+        if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+            continue
+        bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        mono = (b3 >> 6) == 3
+        samples_per_frame = 384 if layer == 1 else (1152 if layer == 2 or version == 1 else 576)
+        info['sample_rate'] = sample_rate
+        info['channels'] = 1 if mono else 2
+
+        # VBR 檔案的第一幀帶有 Xing/Info 或 VBRI 標頭，記錄總幀數
+        if version == 1:
+            side_info = 17 if mono else 32
+        else:
+            side_info = 9 if mono else 17
+        frame = data[offset:offset + 200]
+        xing = frame[4 + side_info:4 + side_info + 12]
+        frames = None
+        if xing[:4] in (b'Xing', b'Info') and len(xing) >= 12:
+            flags = struct.unpack('>I', xing[4:8])[0]
+            if flags & 0x1:
+                frames = struct.unpack('>I', xing[8:12])[0]
+        elif frame[36:40] == b'VBRI' and len(frame) >= 54:
+            frames = struct.unpack('>I', frame[50:54])[0]
+
+        if frames:
+            info['duration'] = frames * samples_per_frame / sample_rate
+        else:
+            audio_bytes = file_size - start - offset
+            f.seek(max(file_size - 128, 0))
+            if f.read(3) == b'TAG':
+                audio_bytes -= 128
+            info['duration'] = audio_bytes * 8 / bitrate
+        return info
+    return None
+
+
+def _parse_wav(f, file_size):
+    info = _empty_info('wav')
+    f.seek(12)
+    byte_rate = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        chunk_id, size = header[:4], struct.unpack('<I', header[4:])[0]
+        if chunk_id == b'fmt ':
+            fmt = f.read(size)
+            info['channels'], info['sample_rate'], byte_rate = struct.unpack('<HII', fmt[2:12])
+            f.seek(size % 2, 1)
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            # 串流寫入的 wav 可能沒有填 data 長度
+            if size in (0, 0xFFFFFFFF):
+                size = file_size - f.tell()
+            info['duration'] = size / byte_rate
+            return info
+        else:
+            f.seek(size + size % 2, 1)
+
+
+def _iter_boxes(f, end):
+    while f.tell() + 8 <= end:
+        start = f.tell()
+        size, box_type = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header:
+            return
+        yield box_type, start + header, start + size
+        f.seek(start + size)
+
+
+def _find_box(f, start, end, box_type):
+    f.seek(start)
+    for found, body, box_end in _iter_boxes(f, end):
+        if found == box_type:
+            return body, box_end
+    return None
+
+
+def _read_descriptor(f):
+    # MPEG-4 descriptor：1 byte tag，長度每 byte 7 bits (最高位元表示還有下一個 byte)
+    tag = f.read(1)[0]
+    length = 0
+    for _ in range(4):
+        byte = f.read(1)[0]
+        length = (length << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            break
+    return tag, length
+
+
+def _esds_channels(f, esds):
+    # esds → ES_Descriptor → DecoderConfigDescriptor → AudioSpecificConfig 的 channelConfiguration
+    f.seek(esds[0] + 4)
+    tag, _ = _read_descriptor(f)
+    if tag != 0x03:
+        return None
+    f.seek(2, 1)
+    flags = f.read(1)[0]
+    if flags & 0x80:
+        f.seek(2, 1)
+    if flags & 0x40:
+        f.seek(f.read(1)[0], 1)
+    if flags & 0x20:
+        f.seek(2, 1)
+    tag, _ = _read_descriptor(f)
+    if tag != 0x04:
+        return None
+    f.seek(13, 1)
+    tag, _ = _read_descriptor(f)
+    if tag != 0x05:
+        return None
+    config = int.from_bytes(f.read(5), 'big') << 24
+    bits = 40 + 24
+    object_type = config >> (bits - 5)
+    offset = 5
+    if object_type == 31:
+        offset += 6
+    frequency_index = (config >> (bits - offset - 4)) & 0xF
+    offset += 4 + (24 if frequency_index == 15 else 0)
+    return (config >> (bits - offset - 4)) & 0xF or None
+
+
+def _mp4_channels(f, mdia):
+    # 第一個音訊 sample entry (stsd)：8 bytes 標頭、6 保留、2 資料參照、8 保留後是聲道數；
+    # AAC 的這個欄位固定寫 2，實際聲道數在 esds 的 AudioSpecificConfig
+    minf = _find_box(f, mdia[0], mdia[1], b'minf')
+    stbl = _find_box(f, minf[0], minf[1], b'stbl') if minf else None
+    stsd = _find_box(f, stbl[0], stbl[1], b'stsd') if stbl else None
+    if stsd is None or stsd[1] - stsd[0] < 8 + 36:
+        return None
+    entry = stsd[0] + 8
+    f.seek(entry)
+    entry_size, entry_type = struct.unpack('>I4s', f.read(8))
+    f.seek(entry + 24)
+    channels = struct.unpack('>H', f.read(2))[0] or None
+    if entry_type == b'mp4a':
+        esds = _find_box(f, entry + 36, min(entry + entry_size, stsd[1]), b'esds')
+        if esds is not None:
+            channels = _esds_channels(f, esds) or channels
+    return channels
+
+
+def _parse_mp4(f, file_size):
+    info = _empty_info('mp4')
+    moov = _find_box(f, 0, file_size, b'moov')
+    if moov is None:
+        return None
+
+    mvhd = _find_box(f, moov[0], moov[1], b'mvhd')
+    if mvhd is not None:
+        f.seek(mvhd[0])
+        version = f.read(4)[0]
+        if version == 1:
+            f.seek(16, 1)
+            timescale, duration = struct.unpack('>IQ', f.read(12))
+        else:
+            f.seek(8, 1)
+            timescale, duration = struct.unpack('>II', f.read(8))
+        if timescale:
+            info['duration'] = duration / timescale
+
+    f.seek(moov[0])
+    tracks = [(body, box_end) for box_type, body, box_end in _iter_boxes(f, moov[1]) if box_type == b'trak']
+    for trak_start, trak_end in tracks:
+        mdia = _find_box(f, trak_start, trak_end, b'mdia')
+        if mdia is None:
+            continue
+        hdlr = _find_box(f, mdia[0], mdia[1], b'hdlr')
+        mdhd = _find_box(f, mdia[0], mdia[1], b'mdhd')
+        if hdlr is None or mdhd is None:
+            continue
+        f.seek(hdlr[0] + 8)
+        handler = f.read(4)
+        f.seek(mdhd[0])
+        version = f.read(4)[0]
+        if version == 1:
+            f.seek(16, 1)
+            timescale, duration = struct.unpack('>IQ', f.read(12))
+        else:
+            f.seek(8, 1)
+            timescale, duration = struct.unpack('>II', f.read(8))
+        if not timescale:
+            continue
+
+        if handler == b'soun':
+            info['sample_rate'] = info['sample_rate'] or timescale
+            if info['channels'] is None:
+                info['channels'] = _mp4_channels(f, mdia)
+        elif handler == b'vide' and info['frame_count'] is None:
+            info['video_duration'] = duration / timescale
+            minf = _find_box(f, mdia[0], mdia[1], b'minf')
+            stbl = _find_box(f, minf[0], minf[1], b'stbl') if minf else None
+            stts = _find_box(f, stbl[0], stbl[1], b'stts') if stbl else None
+            if stts is None:
+                continue
+            f.seek(stts[0] + 4)
+            entry_count = struct.unpack('>I', f.read(4))[0]
+            entries = [struct.unpack('>II', f.read(8)) for _ in range(entry_count)]
+            frame_count = sum(count for count, _ in entries)
+            info['frame_count'] = frame_count
+            if len(entries) == 1 and entries[0][1]:
+                # 固定幀率：直接由取樣間隔換算
+                info['fps'] = timescale / entries[0][1]
+            elif duration:
+                info['fps'] = frame_count * timescale / duration
+    return info
+
+
+# ffmpeg 回報的聲道配置 (probe_media_format) 對應的聲道數
+_LAYOUT_CHANNELS = {'mono': 1, 'stereo': 2, '2.1': 3, '4.0': 4, 'quad': 4, '5.0': 5, '5.1': 6, '5.1(side)': 6,
+                    '7.1': 8}
+
+_PARSERS = {
+    '.mp3': _parse_mp3,
+    '.wav': _parse_wav,
+    '.mp4': _parse_mp4,
+    '.m4a': _parse_mp4,
+    '.mov': _parse_mp4,
+}
+
+
+def probe_media(path):
+    """
+    Reads duration and stream details of an mp3 / wav / mp4 file straight from its headers,
+    without spawning a decoder. Results are cached per (path, size, mtime).
+    Other formats, or headers that cannot be parsed, fall back to ffmpeg (probe_media_format).
+
+    :param path: Path to the media file
+    :return: Dict with format, duration, sample_rate, channels, video_duration, frame_count, fps
+             (None for anything the file does not carry)
+    """
+    stat = os.stat(path)
+    # 回傳副本：呼叫端修改結果不會影響快取
+    return dict(_probe_media_cached(os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+
+
+@lru_cache(maxsize=PROBE_CACHE_SIZE)
+def _probe_media_cached(path, size, mtime_ns):
+    # 以 (路徑, 大小, mtime) 為鍵的 LRU 快取，檔案改變後自然換成新的鍵
+    info = None
+    parser = _PARSERS.get(os.path.splitext(path)[1].lower())
+    if parser is not None:
+        try:
+            with open(path, 'rb') as f:
+                info = parser(f, size)
+        except (OSError, struct.error, IndexError, TypeError) as e:
+            print(f"Header probe failed for {path}, falling back to ffmpeg: {str(e)}")
+            info = None
+    if info is None or info['duration'] is None:
+        probed = probe_media_format(path)
+        info = _empty_info(os.path.splitext(path)[1].lstrip('.').lower())
+        info['duration'] = probed['duration']
+        info['sample_rate'] = probed['sample_rate']
+        info['channels'] = _LAYOUT_CHANNELS.get(probed['channels'])
+        info['fps'] = probed['fps']
+        if probed['fps'] and probed['duration']:
+            info['video_duration'] = probed['duration']
+            info['frame_count'] = int(round(probed['fps'] * probed['duration']))
+    return info
+
+
+def probe_duration(path):
+    """
+    Duration of a media file in seconds (0.0 when unknown).
+
+    :param path: Path to the media file
+    """
+    return probe_media(path)['duration'] or 0.0
+
+
+def probe_video_timing(path):
+    """
+    Returns (fps, frame_count) of the first video track of a media file.
+
+    :param path: Path to the video file
+    """
+    info = probe_media(path)
+    return info['fps'] or 25, info['frame_count'] or 0
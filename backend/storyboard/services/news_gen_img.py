@@ -12,6 +12,8 @@ import re
 import concurrent.futures
 from collections import OrderedDict
 from datetime import datetime
+from .cpu_budget import budgeted_workers, get_cpu_budget
+from .render_cache import get_render_cache, make_cache_key
 
 load_dotenv(os.path.join(settings.BASE_DIR, '.env'))
 # 設定 logger
@@ -149,7 +151,7 @@ def generate_images_from_descriptions(title, image_descriptions, random_id):
                 log_and_print(f"圖片生成進度: {progress_counter}/{total_images}")
         return idx, None
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=budgeted_workers(5, get_cpu_budget().share())) as executor:
         future_to_idx = {executor.submit(generate_image, idx, desc): idx for idx, desc in enumerate(image_descriptions)}
         for future in concurrent.futures.as_completed(future_to_idx):
             idx, result = future.result()
@@ -161,74 +163,105 @@ def generate_images_from_descriptions(title, image_descriptions, random_id):
 
     return image_results
 
+def download_paragraph_image(manager, storyboard_object, random_id, idx, coordinates, extend_coordinates):
+    """
+    Downloads (or decodes) the image of one paragraph into the job directory.
+
+    :param manager: StoryboardManager of the job
+    :param storyboard_object: Storyboard dict
+    :param random_id: Job id (directory under generated/)
+    :param idx: Zero-based paragraph index
+    :param coordinates: Image quad of avatar paragraphs
+    :param extend_coordinates: Image quad of full-screen paragraphs
+    :return: (image_url or None for base64 images, image_path, image_info), or None when the
+             paragraph has no usable image
+    """
+    save_directory = os.path.join(settings.MEDIA_ROOT, 'generated', random_id)
+    os.makedirs(save_directory, exist_ok=True)
+
+    title = storyboard_object.get('title')
+    image_url = storyboard_object.get('storyboard', [])[idx].get('imageUrl')
+    if not image_url:
+        return None
+
+    log_and_print(f"開始處理 Paragraph {idx + 1} 的圖片")
+    try:
+        # 使用原有的命名方式
+        safe_title = re.sub(r'[^\w\-_\. ]', '_', title)
+        image_filename = f'{safe_title}_{idx+1}.png'
+        image_path = os.path.join(save_directory, image_filename)
+        cache = get_render_cache()
+        cache_key = make_cache_key('image', image_url)
+
+        # 檢查是否為 base64 圖片
+        if image_url.startswith('data:image'):
+            # 直接從 base64 字符串中提取圖片數據
+            image_data = image_url.split(',')[1]
+            import base64
+            image_content = base64.b64decode(image_data)
+        elif cache is not None and cache.fetch('images', cache_key, image_path):
+            # 同一個網址已下載過，直接沿用
+            image_content = None
+        else:
+            # 下載圖片
+            image_response = requests.get(image_url)
+            if image_response.status_code != 200:
+                log_and_print(f"下載圖片失敗: {image_url}")
+                return None
+            image_content = image_response.content
+
+        # 保存圖片
+        if image_content is not None:
+            with open(image_path, 'wb') as f:
+                f.write(image_content)
+            if cache is not None and not image_url.startswith('data:image'):
+                cache.store('images', cache_key, image_path)
+
+        # 圖片配置
+        quad = coordinates if manager.get_storyboard()['storyboard'][idx]['needAvatar'] else extend_coordinates
+        image_info = {
+            "img_path": image_filename,
+            "url": image_url if not image_url.startswith('data:image') else None,
+            "top_left": quad["top_left"],
+            "top_right": quad["top_right"],
+            "bottom_right": quad["bottom_right"],
+            "bottom_left": quad["bottom_left"],
+            "z_index": 0
+        }
+        log_and_print(f"成功處理 Paragraph {idx + 1} 的圖片")
+        return (image_url if not image_url.startswith('data:image') else None, image_path, image_info)
+    except Exception as e:
+        log_and_print(f"處理圖片時發生錯誤: {str(e)}")
+        return None
+
+def run_paragraph_image(manager, storyboard_object, random_id, idx, coordinates, extend_coordinates):
+    """
+    Image stage of one paragraph in the per-paragraph pipeline: downloads the image and adds it
+    on top of the layers already set on the paragraph (background, title).
+
+    :return: (image_url, image_path), or None when the paragraph has no usable image
+    """
+    result = download_paragraph_image(manager, storyboard_object, random_id, idx, coordinates, extend_coordinates)
+    if result is None:
+        return None
+    image_url, image_path, image_info = result
+    manager.add_image(idx, image_info)
+    return image_url, image_path
+
 # 測試新聞生成邏輯
 def run_news_gen_img(manager, storyboard_object, random_id, coordinates, extend_coordinates):
     try:
         log_and_print("開始下載新聞圖片")
-        
-        save_directory = os.path.join(settings.MEDIA_ROOT, 'generated', random_id)
-        if not os.path.exists(save_directory):
-            os.makedirs(save_directory)
-
-        title = storyboard_object.get('title')
         image_results = []
 
-        for idx, item in enumerate(storyboard_object.get('storyboard', [])):
-            image_url = item.get('imageUrl')
-            if image_url:
-                log_and_print(f"開始處理 Paragraph {idx + 1} 的圖片")
-                try:
-                    # 檢查是否為 base64 圖片
-                    if image_url.startswith('data:image'):
-                        # 直接從 base64 字符串中提取圖片數據
-                        image_data = image_url.split(',')[1]
-                        import base64
-                        image_content = base64.b64decode(image_data)
-                    else:
-                        # 下載圖片
-                        image_response = requests.get(image_url)
-                        if image_response.status_code != 200:
-                            log_and_print(f"下載圖片失敗: {image_url}")
-                            continue
-                        image_content = image_response.content
-
-                    # 使用原有的命名方式
-                    safe_title = re.sub(r'[^\w\-_\. ]', '_', title)
-                    image_filename = f'{safe_title}_{idx+1}.png'
-                    image_path = os.path.join(save_directory, image_filename)
-                    
-                    # 保存圖片
-                    with open(image_path, 'wb') as f:
-                        f.write(image_content)
-                    
-                    # 更新圖片配置
-                    if manager.get_storyboard()['storyboard'][idx]['needAvatar']:
-                        image_info = {
-                            "img_path": image_filename,
-                            "url": image_url if not image_url.startswith('data:image') else None,
-                            "top_left": coordinates["top_left"],
-                            "top_right": coordinates["top_right"],
-                            "bottom_right": coordinates["bottom_right"],
-                            "bottom_left": coordinates["bottom_left"],
-                            "z_index": 0
-                        }
-                    else:
-                        image_info = {
-                            "img_path": image_filename,
-                            "url": image_url if not image_url.startswith('data:image') else None,
-                            "top_left": extend_coordinates["top_left"],
-                            "top_right": extend_coordinates["top_right"],
-                            "bottom_right": extend_coordinates["bottom_right"],
-                            "bottom_left": extend_coordinates["bottom_left"],
-                            "z_index": 0
-                        }
-                    
-                    manager.update_paragraph(idx, {"images": [image_info]})
-                    image_results.append((image_url if not image_url.startswith('data:image') else None, image_path))
-                    log_and_print(f"成功處理 Paragraph {idx + 1} 的圖片")
-                except Exception as e:
-                    log_and_print(f"處理圖片時發生錯誤: {str(e)}")
-                    continue
+        for idx in range(len(storyboard_object.get('storyboard', []))):
+            result = download_paragraph_image(manager, storyboard_object, random_id, idx, coordinates, extend_coordinates)
+            if result is None:
+                continue
+            image_url, image_path, image_info = result
+            # 更新圖片配置
+            manager.update_paragraph(idx, {"images": [image_info]})
+            image_results.append((image_url, image_path))
 
         manager.wait_for_queue()
         log_and_print("完成所有圖片處理")
@@ -6,6 +6,8 @@ import re
 import io
 import time 
 from datetime import datetime
+from .cpu_budget import budgeted_workers, get_cpu_budget
+from .render_cache import file_digest, get_render_cache, make_cache_key
 API_BASE_IP = "38.224.253.230"
 VOICE_API_PORT = "9875"
 AVATAR_API_PORT = "8787"
@@ -21,7 +23,21 @@ def log_and_print(message):
         print(f"日志記錄失敗: {str(e)}")
 
 def generate_voice(text, filename, save_directory, avatar):
+    filtered_text = text
     try:
+        # 過濾掉包含英文字母的單詞
+        filtered_text = ''.join(c for c in text if not (c.isalpha() and ord(c) < 128))
+
+        # 同樣的文字與聲音直接沿用快取的音檔
+        cache = get_render_cache()
+        file_path = os.path.join(save_directory, filename)
+        cache_key = make_cache_key('tts', filtered_text, avatar)
+        if cache is not None:
+            os.makedirs(save_directory, exist_ok=True)
+            if cache.fetch('tts', cache_key, file_path, '.mp3'):
+                log_and_print(f"使用快取音檔: {filename}")
+                return filename
+
         # Initialize API
 
         api = VoiceAPI(api_base_ip=API_BASE_IP, api_port=VOICE_API_PORT)
@@ -32,8 +48,6 @@ def generate_voice(text, filename, save_directory, avatar):
         # Introduce a delay of 2 seconds
         time.sleep(2)
 
-        # 過濾掉包含英文字母的單詞
-        filtered_text = ''.join(c for c in text if not (c.isalpha() and ord(c) < 128))
         #print(filtered_text)
         # Generate voice
         #print(f"Attempting to generate voice for text: {filtered_text[:100]}...")
@@ -48,9 +62,10 @@ def generate_voice(text, filename, save_directory, avatar):
         if not os.path.exists(save_directory):
             os.makedirs(save_directory)
 
-        file_path = os.path.join(save_directory, filename)
         with open(file_path, 'wb') as f:
             f.write(audio_buffer.getvalue())
+        if cache is not None:
+            cache.store('tts', cache_key, file_path, '.mp3')
 
         log_and_print(f"成功獲取音檔: {filename}")
 
@@ -82,6 +97,13 @@ def generate_video(manager, audio_file_name, avatar):
         need_avatar = manager.storyboard['storyboard'][paragraph_index].get('needAvatar', False)
 
         if need_avatar:
+            # 同樣的音檔與人偶直接沿用快取的影片
+            cache = get_render_cache()
+            cache_key = make_cache_key('avatar', file_digest(audio_file_path), avatar)
+            if cache is not None and cache.fetch('avatar', cache_key, save_path, '.mp4'):
+                log_and_print(f"使用快取影片: {video_filename}")
+                return video_filename
+
             log_and_print(f"開始使用音檔生成影片: {audio_file_name}")
             generator = FullBodyAvatarGenerator(
                 api_base_ip=API_BASE_IP, 
@@ -91,6 +113,8 @@ def generate_video(manager, audio_file_name, avatar):
             video_url = generator.generate_full_body_avatar(character=avatar,
                                                             audio_file_path=audio_file_path,
                                                             save_path=save_path)
+            if cache is not None and os.path.exists(save_path):
+                cache.store('avatar', cache_key, save_path, '.mp4')
             log_and_print(f"成功生成影片: {video_filename}")
         else:
             # 如果不需要人偶，只返回音頻文件名
@@ -104,6 +128,47 @@ def generate_video(manager, audio_file_name, avatar):
         log_and_print(error_message)
         return None
 
+def run_paragraph_voice(manager, storyboard_object, random_id, idx):
+    """
+    Voice stage of one paragraph in the per-paragraph pipeline: generates the voiceover
+    and records it on the paragraph.
+
+    :return: File name of the voiceover in the job directory
+    """
+    title = storyboard_object.get('title', '')
+    avatar = storyboard_object.get('avatar', 'woman1')
+    safetitle = re.sub(r'[^\w\-\. ]', '_', title)
+    text = storyboard_object['storyboard'][idx].get('voiceover', '')
+    save_directory = os.path.join(settings.MEDIA_ROOT, 'generated', random_id)
+
+    audio_file_name = generate_voice(text, f'{safetitle}_{idx+1}.mp3', save_directory, avatar)
+    if not audio_file_name:
+        raise RuntimeError(f"Voice generation failed for paragraph {idx + 1}")
+    manager.add_audio_path(idx, audio_file_name)
+    return audio_file_name
+
+def run_paragraph_avatar(manager, storyboard_object, idx, avatar_coordinates, audio_file_name):
+    """
+    Avatar stage of one paragraph in the per-paragraph pipeline: renders the avatar clip
+    of the voiceover and records it on the paragraph.
+
+    :param audio_file_name: Voiceover produced by run_paragraph_voice
+    :return: File name of the avatar clip in the job directory
+    """
+    avatar = storyboard_object.get('avatar', 'woman1')
+    video_path = generate_video(manager, audio_file_name, avatar)
+    if not video_path:
+        raise RuntimeError(f"Avatar generation failed for paragraph {idx + 1}")
+    manager.add_video(idx, {
+        'avatar_path': video_path,
+        "top_left": avatar_coordinates["top_left"],
+        "top_right": avatar_coordinates["top_right"],
+        "bottom_right": avatar_coordinates["bottom_right"],
+        "bottom_left": avatar_coordinates["bottom_left"],
+        'z_index': 1,
+    })
+    return video_path
+
 def run_news_gen_voice_and_video(manager, storyboard_object, random_id, avatar_coordinates):
     title = storyboard_object.get('title', '')
     avatar = storyboard_object.get('avatar', 'woman1')
@@ -119,7 +184,7 @@ def run_news_gen_voice_and_video(manager, storyboard_object, random_id, avatar_c
     results = [None] * len(voice_texts)
     save_directory = os.path.join(settings.MEDIA_ROOT, 'generated', random_id)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=budgeted_workers(10, get_cpu_budget().share())) as executor:
         # 使用字典來存儲結果，避免列表索引問題
         results_dict = {}
         future_to_idx = {executor.submit(generate_voice, text, f'{safetitle}_{idx+1}.mp3', save_directory, avatar): idx
@@ -1,18 +1,27 @@
-from .news_gen_img import run_news_gen_img
-from .news_gen_voice_and_video import run_news_gen_voice_and_video
+from .news_gen_img import run_news_gen_img, run_paragraph_image
+from .news_gen_voice_and_video import run_news_gen_voice_and_video, run_paragraph_avatar, run_paragraph_voice
 import os 
 from django.conf import settings
 from .create_scene import create_videos_from_images_and_audio
 from .storyboard_manager import StoryboardManager
 import shutil
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 import os
-import random
-import string
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from .config import HALF_CONFIG, FULL_CONFIG, HALF_CONFIG2
+from .captions import load_font, render_text
+from .cpu_budget import budgeted_workers, get_cpu_budget
+from .encoder_profiles import get_encoder_profile, scale_layout_config
+from .job_workspace import JobWorkspace
+from .task_graph import TaskGraph
 from storyboard.services.upload_to_bucket import upload_to_bucket
 
+# 各階段同時進行的請求數上限 (圖片與語音另受 CPU 預算限制)；人偶 API 一次只處理一段
+IMAGE_DOWNLOAD_WORKERS = 5
+VOICE_WORKERS = 10
+AVATAR_WORKERS = 1
+
 def execute_news_gen_img(manager, storyboard_object, random_id, scene_coordinates, extend_scene_coordinates):
     try:
         result = run_news_gen_img(manager, storyboard_object, random_id, scene_coordinates, extend_scene_coordinates)
@@ -48,10 +57,11 @@ def execute_news_gen_voice_and_video(manager, storyboard_object, random_id, avat
         return [""]  # 返回一个包含空字符串的列表，表示出错
 
 def process_storyboard(story_object, background):
-    def generate_random_id(length=10):
-        """生成指定長度的隨機字母數字字符串"""
-        return ''.join(random.choices(string.ascii_lowercase + string.digits, k=length))
+    # 每次生成給予專屬 id 與工作目錄；渲染期間持有租約，清理不會刪除進行中的工作
+    with JobWorkspace.create() as lease:
+        return _process_storyboard(story_object, background, lease.job_id)
 
+def _process_storyboard(story_object, background, random_id):
     def setup_image(manager, random_id, image_name, config_item, extend_image_name = None, extend_config_item = None, is_background=True):
         # Set the image configuration
         if extend_image_name:
@@ -74,9 +84,6 @@ def process_storyboard(story_object, background):
 
     avatar_count = 2
     story_object['storyboard'] = story_object['storyboard'][:]
-    random_id = generate_random_id()#每次生成給予專屬id
-    #移除generated資料夾
-    remove_generated_folder()
     manager = execute_storyboard_manager(os.path.join(settings.MEDIA_ROOT, 'generated', random_id), random_id, story_object, avatar_count=avatar_count)
     
     config = None
@@ -92,6 +99,10 @@ def process_storyboard(story_object, background):
         elif background == 'background1':
             config = FULL_CONFIG
     
+    #依編碼設定檔縮放整個版面（draft 為 540p）
+    encoder_profile = get_encoder_profile(story_object.get('encoderProfile'))
+    config = scale_layout_config(config, encoder_profile.scale)
+    
     #設定影片尺寸
     canvas_size = config['canvas_size']
     # 定義圖片在影片各個scene中的坐標
@@ -105,14 +116,11 @@ def process_storyboard(story_object, background):
     
 
 
-    with ThreadPoolExecutor(max_workers=2) as executor:  
-        future_img = executor.submit(execute_news_gen_img, manager, manager.storyboard, random_id, scene_place_coordinates, extend_scene_place_coordinates) 
-        future_voice_and_video = executor.submit(execute_news_gen_voice_and_video, manager, manager.storyboard, random_id, avatar_place_coordinates)
-
     # 獲取結果 
     try: # 選擇配置
         
         #設定背景 只有背景需要添加extend_background
+        #背景與 title 先放進每個段落，段落圖片下載完成後再疊在其上
         setup_image(manager, 
                     random_id, 
                     config['background']['img_path'],
@@ -153,9 +161,36 @@ def process_storyboard(story_object, background):
         #             is_background=False)
 
 
-        img_binary, image_urls = future_img.result()
-        audios_path = future_voice_and_video.result()  # 等待語音生成完成，但不使用其結果
-        video_paths = create_videos_from_images_and_audio(manager, canvas_size, crop_coords)
+        # 每個段落各自一條鏈：圖片；語音 → 人偶 → 去背合成 → 編碼
+        # 段落的媒體一完成就開始渲染，不等其他段落
+        # 媒體與渲染同屬一個工作，共用同一份 CPU 預算 (見 cpu_budget)
+        media_graph = TaskGraph()
+        with get_cpu_budget().job() as cpu_slots, \
+                ThreadPoolExecutor(max_workers=budgeted_workers(IMAGE_DOWNLOAD_WORKERS, cpu_slots)) as image_pool, \
+                ThreadPoolExecutor(max_workers=budgeted_workers(VOICE_WORKERS, cpu_slots)) as voice_pool, \
+                ThreadPoolExecutor(max_workers=AVATAR_WORKERS) as avatar_pool:
+            for idx, paragraph in enumerate(manager.storyboard['storyboard']):
+                media_graph.add(('image', idx),
+                                partial(image_pool.submit, run_paragraph_image, manager, manager.storyboard, random_id,
+                                        idx, scene_place_coordinates, extend_scene_place_coordinates),
+                                group=idx)
+                if not paragraph.get('voiceover'):
+                    continue
+                media_graph.add(('voice', idx),
+                                partial(voice_pool.submit, run_paragraph_voice, manager, manager.storyboard, random_id, idx),
+                                group=idx)
+                if paragraph.get('needAvatar', False):
+                    media_graph.add(('avatar', idx),
+                                    partial(avatar_pool.submit, run_paragraph_avatar, manager, manager.storyboard, idx,
+                                            avatar_place_coordinates),
+                                    deps=[('voice', idx)], group=idx)
+            video_paths = create_videos_from_images_and_audio(manager, canvas_size, crop_coords, encoder_profile=encoder_profile,
+                                                              render_mode=story_object.get('renderMode'),
+                                                              caption_mode=story_object.get('captionMode'),
+                                                              media_graph=media_graph, cpu_slots=cpu_slots)
+        image_urls = [{"url": media_graph.results[('image', idx)][0]}
+                      for idx in range(len(manager.storyboard['storyboard']))
+                      if media_graph.results.get(('image', idx))]
         #return video_paths.split('/')[1]
         return random_id, image_urls
     except Exception as e:
@@ -176,40 +211,19 @@ def text_to_image(text, font_path, output_path, font_size=32, padding=0, bg_colo
     # 創建完整的目錄結構
     os.makedirs(os.path.dirname(absolute_output_path), exist_ok=True)
     
-    # 檢查字體文件是否存在
-    if not os.path.exists(font_path):
-        raise FileNotFoundError(f"Font file not found: {font_path}")
-
-    # 設置字體
+    # 設置字體 (每個行程只載入一次，字幕也共用同一份)
     try:
-        # Load a bold font if available
-        font = ImageFont.truetype(font_path, font_size)
+        font = load_font(font_path, font_size)
         print("Font loaded successfully")
     except Exception as e:
         print(f"Error loading font: {str(e)}")
         raise
 
-    # 獲取文字大小
-    bbox = font.getbbox(text)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
-    print(f"Text dimensions: {text_width}x{text_height}")
-
-    # 創建一個比文字稍大的 PIL 圖像
-    image_width = text_width + 2 * padding
-    image_height = text_height + 2 * padding
-    pil_image = Image.new('RGBA', (image_width, image_height), bg_color)
+    # 繪製剛好容納文字的 RGBA 圖像（位置考慮內邊距）
+    pil_image = render_text(text, font, padding=padding, bg_color=bg_color, text_color=text_color)
+    image_width, image_height = pil_image.size
     print(f"Image created with dimensions: {image_width}x{image_height}")
 
-    # 創建一個可以在 PIL 圖像上繪圖的對象
-    draw = ImageDraw.Draw(pil_image)
-
-    # 在圖像上繪製文字（位置考慮內邊距）
-    # Adjust the text position to move it upwards
-    text_y_position = padding - bbox[1]  # Adjust by the top of the bounding box
-    draw.text((padding, text_y_position), text, font=font, fill=text_color)
-    print("Text drawn on image")
-
     # 直接保存 PIL 图像
     try:
         pil_image.save(absolute_output_path, format='PNG')
@@ -224,45 +238,3 @@ def execute_upload_to_drive(random_id):
     #file_id = upload_to_drive(random_id)
     file_id, public_url = upload_to_bucket(random_id)
     return {"status":"success", "file_id":file_id, "public_url":public_url}
-
-def remove_generated_folder():
-    generated_path = os.path.join(settings.BASE_DIR, 'generated')
-    
-    if not os.path.exists(generated_path):
-        print(f"'generated' folder does not exist in {settings.BASE_DIR}")
-        return
-    
-    try:
-        # 获取generated文件夹下的所有子文件夹
-        subfolders = []
-        for item in os.listdir(generated_path):
-            item_path = os.path.join(generated_path, item)
-            if os.path.isdir(item_path):
-                # 获取文件夹的创建时间
-                creation_time = os.path.getctime(item_path)
-                subfolders.append((item_path, creation_time))
-        
-        # 如果子文件夹数量超过5个，删除最早创建的文件夹
-        if len(subfolders) > 5:
-            # 按创建时间排序（最早的在前面）
-            subfolders.sort(key=lambda x: x[1])
-            
-            # 计算需要删除的文件夹数量
-            folders_to_delete = len(subfolders) - 5
-            
-            # 删除最早创建的文件夹
-            for i in range(folders_to_delete):
-                folder_path = subfolders[i][0]
-                try:
-                    shutil.rmtree(folder_path)
-                    folder_name = os.path.basename(folder_path)
-                    print(f"Deleted old folder: {folder_name}")
-                except Exception as e:
-                    print(f"Error deleting folder {folder_path}: {e}")
-            
-            print(f"Maintained {len(subfolders) - folders_to_delete} folders in generated directory")
-        else:
-            print(f"Current folder count ({len(subfolders)}) is within limit (5). No cleanup needed.")
-            
-    except Exception as e:
-        print(f"Error occurred while managing 'generated' folder: {e}")
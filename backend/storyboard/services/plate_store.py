@@ -0,0 +1,175 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+from django.conf import settings
+
+from . import config as layout_configs
+from .encoder_profiles import ENCODER_PROFILES, scale_layout_config
+from .layer_compositor import (
+    PRECISIONS,
+    LayerCache,
+    Plate,
+    layer_cache,
+    load_rgba,
+    quad_from_info,
+    quad_roi,
+    warp_layer,
+)
+
+
+# 每個版面設定中共用的底圖
+BASE_PLATE_LAYERS = ('background', 'extend_background')
+
+
+class PlateStore:
+    """
+    On-disk store of warped base plates saved as .npy files.
+    Plates are opened with np.load(mmap_mode='r'), so every render process maps the same
+    page-cache pages read-only instead of decoding and warping its own copy.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, key):
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.root, name + '.npy')
+
+    def load(self, key, quad, canvas_size):
+        """
+        Returns the stored plate as a zero-copy read-only view, or None when it is not stored.
+        """
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        roi = quad_roi(quad, canvas_size)
+        if roi is None:
+            return None
+        return Plate(roi[0], roi[1], np.load(path, mmap_mode='r'))
+
+    def prune(self, keep_keys):
+        """
+        Deletes stored plates whose key is not in keep_keys (e.g. plates of a background
+        image that has since changed). Processes that already mapped one keep their view.
+
+        :return: Number of plates deleted
+        """
+        keep = {os.path.basename(self.path_for(key)) for key in keep_keys}
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return 0
+        removed = 0
+        for name in names:
+            if not name.endswith('.npy') or name.startswith('.tmp_') or name in keep:
+                continue
+            try:
+                os.remove(os.path.join(self.root, name))
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def save(self, key, plate):
+        """
+        Writes a plate atomically (concurrent workers building the same plate are harmless).
+        """
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', suffix='.npy', dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.ascontiguousarray(plate.pixels))
+            os.replace(tmp_path, self.path_for(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def layout_plate_specs(background_dir, scales):
+    """
+    Yields (img_path, quad, canvas_size) for the base plates of every layout config in config.py
+    at every encoder profile scale.
+
+    :param background_dir: Directory holding the background image library
+    :param scales: Layout scale factors (see EncoderProfile.scale)
+    """
+    seen = set()
+    for name in dir(layout_configs):
+        layout = getattr(layout_configs, name)
+        if not name.isupper() or not isinstance(layout, dict) or 'canvas_size' not in layout:
+            continue
+        for scale in scales:
+            scaled = scale_layout_config(layout, scale)
+            for layer in BASE_PLATE_LAYERS:
+                if layer not in scaled:
+                    continue
+                info = scaled[layer]
+                spec = (os.path.join(background_dir, info['img_path']),
+                        tuple(map(tuple, quad_from_info(info).tolist())), tuple(scaled['canvas_size']))
+                if spec not in seen:
+                    seen.add(spec)
+                    yield spec
+
+
+def base_plate_names():
+    """
+    Returns the img_path names of the base plates of every layout config (background_half.jpg...).
+    Those layers are always looked up in the layer cache.
+    """
+    names = set()
+    for name in dir(layout_configs):
+        layout = getattr(layout_configs, name)
+        if name.isupper() and isinstance(layout, dict):
+            names.update(layout[layer]['img_path'] for layer in BASE_PLATE_LAYERS if layer in layout)
+    return names
+
+
+def warm_plate_store(cache=None, precision=None):
+    """
+    Builds (first call) or maps (every later call) the base plates of all layout configs
+    and pins them into the layer cache, so compositing starts from a shared zero-copy view.
+    Stored plates that no longer match a layout background are deleted.
+    Used as the initializer of render worker processes.
+
+    :param cache: LayerCache to register the plates in (default: the process-wide layer_cache)
+    :param precision: Compositing precision (default COMPOSITE_PRECISION setting)
+    :return: Number of plates registered
+    """
+    root = getattr(settings, 'PLATE_STORE_DIR', None)
+    if not root:
+        return 0
+    cache = cache if cache is not None else layer_cache
+    precision = precision or getattr(settings, 'COMPOSITE_PRECISION', 'float')
+    background_dir = os.path.join(settings.BASE_DIR, 'background')
+    scales = sorted({profile.scale for profile in ENCODER_PROFILES.values()})
+    store = PlateStore(root)
+
+    registered = 0
+    current_keys = set()
+    for img_path, quad, canvas_size in layout_plate_specs(background_dir, scales):
+        if not os.path.exists(img_path):
+            continue
+        try:
+            # 其他精度的底圖也是有效的，只刪除已不對應任何版面的舊底圖
+            current_keys.update(LayerCache.make_key(img_path, quad, canvas_size, other) for other in PRECISIONS)
+            key = LayerCache.make_key(img_path, quad, canvas_size, precision)
+            if cache.is_pinned(key):
+                registered += 1
+                continue
+            plate = store.load(key, quad, canvas_size)
+            if plate is None:
+                built = warp_layer(load_rgba(img_path, precision), quad, canvas_size)
+                if built is None:
+                    continue
+                store.save(key, built)
+                plate = store.load(key, quad, canvas_size)
+            cache.pin(key, plate)
+            registered += 1
+        except (OSError, ValueError) as e:
+            print(f"Error preparing base plate {img_path}: {str(e)}")
+    # 背景圖改變後舊的底圖不會再被使用，也不在清理範圍內 (見 janitor)
+    store.prune(current_keys)
+    return registered
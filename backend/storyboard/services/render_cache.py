@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from functools import lru_cache
+
+from django.conf import settings
+
+
+# 渲染邏輯改變時調高版本，舊的快取自然失效
+RENDER_CACHE_VERSION = 1
+
+# Celery / Django 行程長時間執行，只保留最近雜湊過的檔案
+DIGEST_CACHE_SIZE = 4096
+
+
+def file_digest(path):
+    """
+    sha256 of a file's bytes, memoised per (path, size, mtime) so the
+    shared background / title files are only hashed once per process.
+
+    :param path: Path to the file
+    """
+    stat = os.stat(path)
+    return _file_digest_cached(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=DIGEST_CACHE_SIZE)
+def _file_digest_cached(path, size, mtime_ns):
+    # 以 (路徑, 大小, mtime) 為鍵的 LRU 快取，檔案改變後自然換成新的鍵
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(*parts):
+    """
+    Hashes JSON-serialisable parts (plus RENDER_CACHE_VERSION) into a cache key.
+    """
+    payload = json.dumps([RENDER_CACHE_VERSION] + list(parts), sort_keys=True, default=list, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _quad(info):
+    return [list(info[corner]) for corner in ('top_left', 'top_right', 'bottom_right', 'bottom_left')]
+
+
+def segment_cache_key(output_dir, paragraph, canvas_size, crop_coords, encoder_profile, options=None):
+    """
+    Cache key of a rendered paragraph segment: the bytes of every layer image, the audio
+    and the avatar clip, the layer quads, canvas, crop and the encoder profile.
+
+    :param output_dir: Job directory holding the paragraph assets
+    :param paragraph: Paragraph dict from the storyboard
+    :param canvas_size: Size of the canvas (width, height)
+    :param crop_coords: Avatar crop (x, y, w, h)
+    :param encoder_profile: EncoderProfile of the render
+    :param options: Other settings that change the output (keyer mode, precision...)
+    """
+    layers = [[file_digest(os.path.join(output_dir, info['img_path'])), _quad(info), info.get('z_index', 0)]
+              for info in paragraph.get('images', [])]
+    parts = {
+        'layers': layers,
+        'canvas_size': list(canvas_size),
+        'encoder_profile': list(encoder_profile),
+        'options': options or {},
+    }
+    if paragraph.get('needAvatar', False):
+        video = paragraph['video']
+        parts['avatar'] = [file_digest(os.path.join(output_dir, video['avatar_path'])), _quad(video)]
+        parts['crop_coords'] = list(crop_coords)
+    else:
+        parts['audio'] = file_digest(os.path.join(output_dir, paragraph['audio_path']))
+    return make_cache_key('segment', parts)
+
+
+class RenderCache:
+    """
+    Content-addressed file store for render outputs (paragraph segments, TTS audio,
+    avatar clips, downloaded images), shared by all jobs.
+    Entries are copied in and copied out, never hard-linked: a job file and a cache entry
+    never share storage, so writing to either one cannot change the other.
+
+    Layout: <root>/<namespace>/<key[:2]>/<key><suffix>
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, namespace, key, suffix=''):
+        return os.path.join(self.root, namespace, key[:2], key + suffix)
+
+    def fetch(self, namespace, key, dest_path, suffix=''):
+        """
+        Places the cached entry at dest_path.
+
+        :return: True on a cache hit
+        """
+        cached = self.path_for(namespace, key, suffix)
+        if not os.path.exists(cached):
+            return False
+        try:
+            _place(cached, dest_path)
+        except OSError as e:
+            print(f"Render cache fetch failed for {cached}: {str(e)}")
+            return False
+        # 更新 mtime，清理時依最近使用時間淘汰
+        try:
+            os.utime(cached)
+        except OSError:
+            pass
+        return True
+
+    def store(self, namespace, key, src_path, suffix=''):
+        """
+        Adds src_path to the cache under key (atomic; concurrent writers are harmless).
+        """
+        cached = self.path_for(namespace, key, suffix)
+        if os.path.exists(cached):
+            return cached
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', dir=os.path.dirname(cached))
+        os.close(fd)
+        try:
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, cached)
+        except OSError as e:
+            print(f"Render cache store failed for {src_path}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        return cached
+
+
+def _place(src_path, dest_path):
+    # 先複製到暫存檔再換名：目的地若是舊的硬連結，只會解除連結，不會寫進快取
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', dir=os.path.dirname(os.path.abspath(dest_path)))
+    os.close(fd)
+    try:
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, dest_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def get_render_cache():
+    """
+    Returns the RenderCache configured by RENDER_CACHE_DIR, or None when RENDER_CACHE_ENABLED is off.
+    """
+    if not getattr(settings, 'RENDER_CACHE_ENABLED', False):
+        return None
+    root = getattr(settings, 'RENDER_CACHE_DIR', os.path.join(settings.BASE_DIR, 'render_cache'))
+    os.makedirs(root, exist_ok=True)
+    return RenderCache(root)
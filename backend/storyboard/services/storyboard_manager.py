@@ -69,6 +69,8 @@ class StoryboardManager:
                 self._add_audio_path(*args)
             elif action == "add_video":
                 self._add_video(*args)
+            elif action == "add_image":
+                self._add_image(*args)
             self.queue.task_done()
 
     def update_paragraph(self, paragraph_index, new_data):
@@ -80,6 +82,9 @@ class StoryboardManager:
     def add_video(self, paragraph_index, video):
         self.queue.put(("add_video", (paragraph_index, video)))
 
+    def add_image(self, paragraph_index, image):
+        self.queue.put(("add_image", (paragraph_index, image)))
+
     def _update_paragraph(self, paragraph_index, new_data):
         if not isinstance(self.storyboard, dict) or "storyboard" not in self.storyboard:
             print("Error: storyboard is not in the correct format")
@@ -120,6 +125,15 @@ class StoryboardManager:
             self.storyboard["storyboard"][paragraph_index]["video"] = video
             self.save_storyboard()
 
+    def _add_image(self, paragraph_index, image):
+        if not isinstance(self.storyboard, dict) or "storyboard" not in self.storyboard:
+            print("Error: storyboard is not in the correct format")
+            return
+        if paragraph_index < len(self.storyboard["storyboard"]):
+            # 疊在既有圖層 (背景、title) 之後，不覆蓋
+            self.storyboard["storyboard"][paragraph_index].setdefault("images", []).append(image)
+            self.save_storyboard()
+
     def set_image_config(self,image_name, config_item, extend_image_name, extend_config_item = None):
         self.img_config =  {
             "img_path": image_name,
@@ -0,0 +1,88 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class TaskSkipped(Exception):
+    """
+    Recorded for a task that never ran because one of its dependencies failed.
+    """
+
+
+class TaskGraph:
+    """
+    Runs dependent tasks, each on the executor chosen by the caller, starting every task
+    the moment the tasks it depends on have finished (not when a whole stage has finished).
+
+    A task is added with a submit callable that receives the results of its dependencies
+    and returns a Future, e.g. functools.partial(pool.submit, fn, *args). Dependencies must be
+    added before the tasks that use them, so the graph can never contain a cycle.
+    """
+
+    def __init__(self):
+        # name -> (submit, deps)，依加入順序 (即拓撲順序) 排列
+        self._tasks = {}
+        self._groups = {}
+        self.results = {}
+        self.errors = {}
+
+    def add(self, name, submit, deps=(), group=None):
+        """
+        Adds a task.
+
+        :param name: Unique, hashable task name, e.g. ('voice', 3)
+        :param submit: Callable taking the results of deps (in order) and returning a Future
+        :param deps: Names of tasks that must succeed before this one starts
+        :param group: Optional key collecting related tasks (see group)
+        """
+        if name in self._tasks:
+            raise ValueError(f"Task {name!r} already added")
+        missing = [dep for dep in deps if dep not in self._tasks]
+        if missing:
+            raise ValueError(f"Task {name!r} depends on tasks not added yet: {missing}")
+        self._tasks[name] = (submit, tuple(deps))
+        if group is not None:
+            self._groups.setdefault(group, []).append(name)
+        return name
+
+    def group(self, key):
+        """
+        Names of the tasks added with group=key.
+        """
+        return list(self._groups.get(key, []))
+
+    def run(self):
+        """
+        Runs the graph until every task has finished, failed or been skipped.
+        A failed task does not stop the others; only the tasks depending on it are skipped.
+
+        :return: Dict of task name -> result for the tasks that succeeded (failures in self.errors)
+        """
+        waiting = [name for name in self._tasks if name not in self.results and name not in self.errors]
+        pending = {}
+        while waiting or pending:
+            still_waiting = []
+            for name in waiting:
+                submit, deps = self._tasks[name]
+                failed = [dep for dep in deps if dep in self.errors]
+                if failed:
+                    self.errors[name] = TaskSkipped(f"{name!r} skipped, {failed[0]!r} failed")
+                elif all(dep in self.results for dep in deps):
+                    try:
+                        pending[submit(*[self.results[dep] for dep in deps])] = name
+                    except Exception as e:
+                        self.errors[name] = e
+                else:
+                    still_waiting.append(name)
+            waiting = still_waiting
+            if not pending:
+                continue
+
+            # 任一任務完成就回頭檢查，讓依賴它的任務立刻開始
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    self.results[name] = future.result()
+                except Exception as e:
+                    print(f"Task {name!r} failed: {str(e)}")
+                    self.errors[name] = e
+        return self.results
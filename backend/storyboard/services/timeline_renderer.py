@@ -0,0 +1,230 @@
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from .audio_assembly import assemble_audio, samples_for_frames
+from .avatar_compositor import AvatarFrameCompositor, checked_avatar_precision
+from .captions import CaptionOverlay, default_caption_font, paragraph_caption_cues
+from .encoder_profiles import get_encoder_profile
+from .ffmpeg_reader import FFmpegPipeReader
+from .ffmpeg_writer import SEGMENT_FPS, FFmpegPipeWriter
+from .media_probe import probe_duration, probe_media, probe_video_timing
+
+
+class TimelineEntry(namedtuple('TimelineEntry', ['index', 'start_frame', 'end_frame', 'media_path', 'paragraph'])):
+    """
+    One paragraph on the storyboard timeline: frames [start_frame, end_frame) of the output,
+    and the media file (avatar clip or voiceover) whose audio plays during them.
+    """
+    __slots__ = ()
+
+    @property
+    def frame_count(self):
+        return self.end_frame - self.start_frame
+
+
+def paragraph_duration(output_dir, paragraph):
+    """
+    Length of a paragraph in seconds: the avatar clip's video length, or the voiceover length.
+    """
+    if paragraph.get("needAvatar", False):
+        fps, frame_count = probe_video_timing(os.path.join(output_dir, paragraph["video"]["avatar_path"]))
+        return frame_count / fps
+    return probe_duration(os.path.join(output_dir, paragraph["audio_path"]))
+
+
+def paragraph_media_path(output_dir, paragraph):
+    """
+    Media file whose length and audio define a paragraph: the avatar clip or the voiceover.
+    """
+    if paragraph.get("needAvatar", False):
+        return os.path.join(output_dir, paragraph["video"]["avatar_path"])
+    return os.path.join(output_dir, paragraph["audio_path"])
+
+
+def build_timeline(output_dir, paragraphs, fps=SEGMENT_FPS):
+    """
+    Lays the paragraphs end to end on a single frame-accurate timeline.
+    Boundaries are rounded to whole frames once, so the audio and video stay in sync
+    over the whole storyboard instead of drifting by a fraction of a frame per paragraph.
+
+    :param output_dir: Job directory holding the paragraph assets
+    :param paragraphs: storyboard["storyboard"] list
+    :param fps: Output frame rate
+    :return: List of TimelineEntry
+    """
+    timeline = []
+    elapsed = 0.0
+    start_frame = 0
+    for idx, paragraph in enumerate(paragraphs):
+        try:
+            duration = paragraph_duration(output_dir, paragraph)
+            media_path = paragraph_media_path(output_dir, paragraph)
+        except (KeyError, OSError) as e:
+            print(f"Warning: skipping paragraph {idx + 1} on the timeline: {str(e)}")
+            continue
+        elapsed += duration
+        end_frame = int(round(elapsed * fps))
+        if end_frame > start_frame:
+            timeline.append(TimelineEntry(idx, start_frame, end_frame, media_path, paragraph))
+            start_frame = end_frame
+    return timeline
+
+
+def mix_timeline_audio(timeline, output_path, fps=SEGMENT_FPS):
+    """
+    Concatenates the audio of every timeline entry into one AAC track, in a single encode.
+    Each entry is padded with silence or trimmed to exactly its frame span.
+
+    :param timeline: List of TimelineEntry
+    :param output_path: Path of the audio file to write (.m4a)
+    :param fps: Output frame rate of the timeline
+    """
+    # 沒有音軌的素材以靜音補齊
+    parts = [(entry.media_path if probe_media(entry.media_path)['sample_rate'] is not None else None,
+              samples_for_frames(entry.frame_count, fps)) for entry in timeline]
+    assemble_audio(parts, output_path)
+
+
+class _TimelineFrames:
+    """
+    Lazily produces the BGR frame for every output timestamp.
+    Only the current paragraph's background and avatar decoder are alive at any time.
+    """
+
+    def __init__(self, output_dir, canvas_size, crop_coords, threshold, cacheable_paths, compose, keyer_factory, fps,
+                 burn_captions=False, precision='float', min_psnr=40.0):
+        self.output_dir = output_dir
+        self.canvas_size = canvas_size
+        self.crop_coords = crop_coords
+        self.threshold = threshold
+        self.cacheable_paths = cacheable_paths
+        self.compose = compose
+        self.keyer_factory = keyer_factory
+        self.fps = fps
+        self.precision = precision
+        self.min_psnr = min_psnr
+        self.caption_font = default_caption_font(canvas_size) if burn_captions else None
+
+    def captions(self, entry):
+        """
+        CaptionOverlay for an entry's voiceover, or None when captions are off.
+        """
+        if self.caption_font is None:
+            return None
+        cues = paragraph_caption_cues(entry.paragraph, entry.frame_count, self.canvas_size, self.caption_font)
+        return CaptionOverlay(cues, self.canvas_size, self.caption_font)
+
+    def frames(self, entry):
+        """
+        Yields entry.frame_count BGR frames for one timeline entry. A paragraph whose
+        background cannot be composed is logged and shown as black for its span, so the
+        rest of the storyboard still renders and stays in sync with the mixed audio.
+        """
+        paragraph = entry.paragraph
+        try:
+            composed = self.compose(self.output_dir, paragraph["images"], self.canvas_size, self.cacheable_paths,
+                                    self.precision)
+        except Exception as e:
+            print(f"Error composing background for paragraph {entry.index + 1}: {str(e)}")
+            composed = None
+        if composed is None:
+            print(f"Warning: paragraph {entry.index + 1} has no background, rendering {entry.frame_count} black frames")
+            black = np.zeros((self.canvas_size[1], self.canvas_size[0], 3), dtype=np.uint8)
+            for _ in range(entry.frame_count):
+                yield black
+            return
+
+        captions = self.captions(entry)
+        if not paragraph.get("needAvatar", False):
+            background = cv2.cvtColor(composed, cv2.COLOR_RGB2BGR)
+            if captions is not None:
+                captions.attach(background)
+            for frame_index in range(entry.frame_count):
+                if captions is not None:
+                    captions.update(frame_index)
+                yield background
+            return
+
+        video = paragraph["video"]
+        placement_coords = (video["top_left"], video["top_right"], video["bottom_right"], video["bottom_left"])
+        keyer = self.keyer_factory(self.threshold)
+        precision = checked_avatar_precision(self.precision, entry.media_path, composed, self.crop_coords,
+                                             placement_coords, self.threshold, keyer, self.min_psnr)
+        compositor = AvatarFrameCompositor(composed, self.crop_coords, placement_coords, self.threshold,
+                                           keyer=keyer, precision=precision)
+        frame = compositor.output
+        if captions is not None:
+            captions.attach(frame, dynamic_rect=compositor.roi)
+        with FFmpegPipeReader(entry.media_path, (compositor.placed_width, compositor.placed_height),
+                              crop=self.crop_coords, frame_count=entry.frame_count, fps=self.fps) as reader:
+            held = None
+            for frame_index in range(entry.frame_count):
+                placed = reader.read()
+                # 影片比時間軸短時停在最後一幀
+                if placed is not None:
+                    frame = compositor.compose_placed(placed)
+                    held = placed
+                elif captions is not None and held is not None:
+                    # 字幕假設人偶 ROI 每幀都重寫；讀到結尾後 reader 的緩衝區仍是最後一幀
+                    frame = compositor.compose_placed(held)
+                if captions is not None:
+                    captions.update(frame_index)
+                yield frame
+
+
+def render_timeline(output_dir, paragraphs, canvas_size, crop_coords, output_path, threshold, compose,
+                    keyer_factory, cacheable_paths=None, encoder_profile=None, fps=SEGMENT_FPS, burn_captions=False,
+                    precision='float', min_psnr=40.0):
+    """
+    Renders the whole storyboard in one encode pass: frames are generated per timestamp
+    straight into a single FFmpegPipeWriter and the audio of all paragraphs is mixed once,
+    so no per-paragraph mp4 is written and nothing is encoded twice.
+
+    :param output_dir: Job directory holding the paragraph assets
+    :param paragraphs: storyboard["storyboard"] list
+    :param canvas_size: Size of the canvas (width, height)
+    :param crop_coords: Coordinates for cropping the avatar video (x, y, w, h)
+    :param output_path: Path of the final video
+    :param threshold: Threshold for avatar background removal
+    :param compose: Background compositing function (see compose_background_with_scenes), called with the precision
+    :param keyer_factory: Callable(threshold) returning the AvatarKeyer for an avatar paragraph
+    :param cacheable_paths: img_path values shared by all paragraphs
+    :param encoder_profile: EncoderProfile (or its name) giving the x264 preset and CRF
+    :param fps: Output frame rate
+    :param burn_captions: Burn each paragraph's voiceover captions into the frames
+    :param precision: Compositing precision, 'float' or 'fixed'
+    :param min_psnr: PSNR (dB) the fixed-point avatar blend must reach on a clip's first frame, else float is used
+    :return: output_path, or None when there is nothing to render
+    """
+    timeline = build_timeline(output_dir, paragraphs, fps)
+    if not timeline:
+        print("No paragraphs with media found for the timeline.")
+        return None
+    profile = get_encoder_profile(encoder_profile)
+    total_frames = timeline[-1].end_frame
+    print(f"Timeline: {len(timeline)} paragraphs, {total_frames} frames "
+          f"{[(entry.index + 1, entry.start_frame, entry.end_frame) for entry in timeline]}")
+
+    work_dir = tempfile.mkdtemp(prefix='timeline_', dir=output_dir)
+    try:
+        audio_path = os.path.join(work_dir, 'audio.m4a')
+        mix_timeline_audio(timeline, audio_path, fps)
+
+        producer = _TimelineFrames(output_dir, canvas_size, crop_coords, threshold, cacheable_paths or set(),
+                                   compose, keyer_factory, fps, burn_captions, precision, min_psnr)
+        with FFmpegPipeWriter(output_path, canvas_size, fps, audio_source=audio_path,
+                              duration=total_frames / fps, preset=profile.preset, crf=profile.crf) as writer:
+            for entry in timeline:
+                print(f"Rendering paragraph {entry.index + 1} on the timeline...")
+                for frame in producer.frames(entry):
+                    writer.write(frame)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"Timeline rendered into: {output_path}")
+    return output_path
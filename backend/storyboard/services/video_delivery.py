@@ -0,0 +1,149 @@
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+from .job_workspace import generated_root
+
+
+# django: Django 串流 (支援 Range)；x-accel: nginx X-Accel-Redirect；x-sendfile: Apache / lighttpd X-Sendfile
+DELIVERY_MODES = ('django', 'x-accel', 'x-sendfile')
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+_CHUNK_SIZE = 256 * 1024
+
+
+class RangeNotSatisfiable(ValueError):
+    """
+    The requested byte range starts past the end of the file.
+    """
+
+
+def parse_range(header, size):
+    """
+    Parses a single-range Range header against a file of `size` bytes.
+    Multiple ranges, other units and malformed headers are ignored, i.e. the whole file is sent.
+
+    :return: (start, end) inclusive, or None to send the whole file
+    :raises RangeNotSatisfiable: The range lies outside the file
+    """
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # bytes=-N：最後 N 個位元組
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and end < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+class _RangeReader:
+    """
+    Streams `length` bytes of an already open file from `start`; closed with the response.
+    """
+
+    def __init__(self, f, start, length):
+        self._file = f
+        self._file.seek(start)
+        self._remaining = length
+
+    def __iter__(self):
+        while self._remaining > 0:
+            chunk = self._file.read(min(_CHUNK_SIZE, self._remaining))
+            if not chunk:
+                break
+            self._remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        self._file.close()
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def _range_applies(request, etag, last_modified):
+    # If-Range：成品沒變才回傳片段，否則回傳整個檔案
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    return if_range == etag or parse_http_date_safe(if_range) == last_modified
+
+
+def serve_artifact(request, artifact, mode=None):
+    """
+    Responds with a final video from the artifact index (see read_artifact_index):
+    ETag / Last-Modified validation (304), byte ranges (206 / 416) so players can seek,
+    or, in the x-accel / x-sendfile modes, a header telling the web server to send the file
+    itself (it then handles ranges too).
+
+    In the django mode the file is opened before the response is returned, so a caller holding
+    a workspace lease only needs it for this call: an open file stays readable even if the
+    janitor removes the workspace afterwards. The web server opens the file later in the other
+    modes; the janitor leaves recently read workspaces alone for that (VIDEO_SERVE_GRACE_SECONDS).
+
+    :param request: Django request
+    :param artifact: Index entry with 'path', 'size', 'mtime_ns', 'etag' and 'content_type'
+    :param mode: One of DELIVERY_MODES (default VIDEO_DELIVERY_MODE setting)
+    :raises FileNotFoundError: The artifact disappeared (django mode)
+    """
+    mode = mode or getattr(settings, 'VIDEO_DELIVERY_MODE', 'django')
+    path = artifact['path']
+    size = artifact['size']
+    content_type = artifact.get('content_type', 'video/mp4')
+    etag = quote_etag(artifact['etag'])
+    last_modified = artifact['mtime_ns'] // 1_000_000_000
+    headers = {'ETag': etag, 'Last-Modified': http_date(last_modified), 'Accept-Ranges': 'bytes'}
+
+    if _not_modified(request, etag, last_modified):
+        response = HttpResponse(status=304)
+    elif mode == 'x-accel':
+        response = HttpResponse(content_type=content_type)
+        relative = os.path.relpath(path, generated_root()).replace(os.sep, '/')
+        prefix = getattr(settings, 'VIDEO_ACCEL_REDIRECT_PREFIX', '/protected/generated/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(relative)
+    elif mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        # 標頭以 latin-1 送出：把路徑的原始位元組原樣交給 web server (檔名可能含中文)
+        response['X-Sendfile'] = os.fsencode(os.path.abspath(path)).decode('latin-1')
+    else:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size) \
+                if _range_applies(request, etag, last_modified) else None
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        f = open(path, 'rb')
+        if byte_range is None:
+            response = FileResponse(f, content_type=content_type)
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(_RangeReader(f, start, length), status=206, content_type=content_type)
+            response['Content-Length'] = str(length)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    for name, value in headers.items():
+        response[name] = value
+    return response
@@ -0,0 +1,60 @@
+"""
+流程設定
+提供主流程與各處理器的預設設定，以及從 JSON 檔案載入覆寫值
+"""
+
+import copy
+import json
+import os
+from typing import Any, Dict, Optional
+
+
+DEFAULT_CONFIG: Dict[str, Any] = {
+    'pipeline': {
+        # 依序執行的階段，名稱對應 MainPipeline 的方法
+        'stages': ['process_scenes', 'final_composition'],
+    },
+    'audio': {
+        'max_concurrency': 2,
+    },
+    'image': {
+        'max_concurrency': 5,
+    },
+}
+
+
+def get_default_config() -> Dict[str, Any]:
+    """
+    取得預設設定 (每次回傳新的副本，呼叫端可以自由修改)
+
+    Returns:
+        設定字典
+    """
+    return copy.deepcopy(DEFAULT_CONFIG)
+
+
+def _merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            _merge(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+
+def load_config(path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    載入設定：以 JSON 檔案的內容覆寫預設設定
+
+    Args:
+        path: JSON 設定檔路徑，未指定時讀取 PIPELINE_CONFIG 環境變數
+
+    Returns:
+        設定字典
+    """
+    config = get_default_config()
+    path = path or os.environ.get('PIPELINE_CONFIG')
+    if not path:
+        return config
+    with open(path, 'r', encoding='utf-8') as f:
+        return _merge(config, json.load(f))
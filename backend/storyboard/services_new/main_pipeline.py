@@ -3,7 +3,7 @@
 負責協調整個影片生成流程
 """
 
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, List, Any, Optional
 import logging
 import os
 from .processors.image_processor import ImageProcessor
@@ -11,9 +11,12 @@ from .processors.audio_processor import AudioProcessor
 from .processors.character_processor import CharacterProcessor
 from .processors.scene_compositor import SceneCompositor
 from .processors.final_compositor import FinalCompositor
+from .processors.pipeline_stage import PipelineStage
 from .utils.validation import validate_storyboard_data
 from .config.settings import get_default_config
-from projectNews.settings import BASE_DIR
+from ..services.captions import CAPTION_MODES
+from ..services.encoder_profiles import get_encoder_profile
+from ..services.job_workspace import JobWorkspace
 import cloudinary
 import cloudinary.uploader
 
@@ -37,14 +40,18 @@ class MainPipeline:
         # 基本屬性
         self.storyboard = None
         self.random_id = None
+        self.workspace_lease = None
         self.scenes = []
         self.scene_videos = []
+        self.encoder_profile = None
+        self.caption_mode = None
         
         # 管理器
         self.progress_manager = None
         self.output_path = None
-        # 處理器
+        # 處理器 (各階段的狀態由 get_status() 回報)
         self.processors = {}
+        self.progress_callback = None
         
     def initialize(self, storyboard: Dict) -> bool:
         """初始化工作環境"""
@@ -52,33 +59,53 @@ class MainPipeline:
             self.logger.info("開始初始化主流程")
             
 
-            # 2. 生成唯一 ID
-            self.random_id = 'ppxsrz95b7'
+            # 2. 生成唯一 ID 並建立專屬工作目錄；流程結束前持有租約，清理不會刪除
+            self.workspace_lease = JobWorkspace.create()
+            self.random_id = self.workspace_lease.job_id
             
             self.storyboard = storyboard
             self.title = self.storyboard.get('title', 'untitled')
             self.scenes = storyboard.get('storyboard', [])
+            # 編碼設定檔 (draft / final / archive)，由 API 的 encoderProfile 指定
+            # 注意：process_scenes / final_composition 尚未實作，API 路徑目前不會渲染影片，
+            # 設定檔與字幕模式只會被驗證並在 get_status() 回報；渲染階段完成後須以
+            # encoder_profile / caption_mode 傳給 create_videos_from_images_and_audio
+            self.encoder_profile = get_encoder_profile(storyboard.get('encoderProfile'))
+            # 旁白字幕 (off / burn / soft / both)，由 API 的 captionMode 指定；未指定時沿用 CAPTION_MODE 設定
+            self.caption_mode = storyboard.get('captionMode') or None
+            if self.caption_mode is not None and self.caption_mode not in CAPTION_MODES:
+                raise ValueError(f"Unknown captionMode: {self.caption_mode}")
             
-            #創建輸出目錄
+            #輸出目錄
 
-            self.output_path = os.path.join(BASE_DIR, 'generated', self.random_id)
+            self.output_path = self.workspace_lease.workspace.path
             self.logger.info(f"初始化完成，場景數量: {len(self.scenes)}, ID: {self.random_id}")
             return True
             
         except Exception as e:
             self.logger.error(f"初始化失敗: {e}")
+            self.release_workspace()
             return False
     
-    def execute(self) -> Dict[str, Any]:
-        """執行完整流程"""
+    def execute(self, progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        執行完整流程
+        
+        Args:
+            progress_callback: 每個階段開始與結束時以 get_status() 的內容呼叫
+        """
+        self.progress_callback = progress_callback
+        stages = self.config.get('pipeline', {}).get('stages', ['process_scenes', 'final_composition'])
+        self.processors = {name: PipelineStage(name, getattr(self, name)) for name in stages}
         try:
             self.logger.info("開始執行主流程")
             
             # Phase 1: 處理所有場景
-            self.process_scenes()
-            
             # Phase 2: 最終合成
-            self.final_composition()
+            for stage in self.processors.values():
+                self._report_progress()
+                stage.execute(None)
+            self._report_progress()
             
             # Phase 3: 清理和返回結果
             result = {
@@ -91,11 +118,47 @@ class MainPipeline:
             
         except Exception as e:
             self.logger.error(f"主流程執行失敗: {e}")
+            self._report_progress()
             return {
                 'status': 'error',
                 'error_message': str(e),
                 'random_id': self.random_id
             }
+        finally:
+            self.release_workspace()
+    
+    def release_workspace(self):
+        """釋放工作目錄的租約，之後清理工作才能刪除這個目錄"""
+        if self.workspace_lease is not None:
+            self.workspace_lease.release()
+            self.workspace_lease = None
+    
+    def get_status(self) -> Dict[str, Any]:
+        """
+        取得流程狀態：整體進度與每個階段的 BaseProcessor.get_status()
+        
+        Returns:
+            包含狀態資訊的字典
+        """
+        stages = [processor.get_status() for processor in self.processors.values()]
+        progress = sum(stage['progress'] for stage in stages) / len(stages) if stages else 0.0
+        return {
+            'random_id': self.random_id,
+            'title': getattr(self, 'title', None),
+            'progress': progress,
+            'encoder_profile': self.encoder_profile.name if self.encoder_profile else None,
+            'caption_mode': self.caption_mode,
+            'stages': stages,
+        }
+    
+    def _report_progress(self):
+        """回報目前進度，回報失敗不影響流程"""
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback(self.get_status())
+        except Exception as e:
+            self.logger.warning(f"進度回報失敗: {e}")
     
     def process_scenes(self) -> List[str]:
         """處理所有場景"""
@@ -136,17 +199,18 @@ class MainPipeline:
     
     #最終合成
     def final_composition(self) -> str:
-        """最終合成階段"""
+        """
+        最終合成階段
+        
+        尚未實作：實作時須把 self.encoder_profile 與 self.caption_mode 傳給
+        create_videos_from_images_and_audio(..., encoder_profile=self.encoder_profile,
+        caption_mode=self.caption_mode)，在此之前 API 指定的 encoderProfile / captionMode
+        不會影響任何輸出
+        """
         # TODO: 實作最終合成邏輯
         return 
     
 
-    def _generate_random_id(self) -> str:
-        """生成唯一識別碼"""
-        import random
-        import string
-        return ''.join(random.choices(string.ascii_lowercase + string.digits, k=10)) 
-    
     def upload_assets_to_cdn(self) -> List[str]:
         """上傳所有生成的 MP3 資源到 CDN"""
         try:
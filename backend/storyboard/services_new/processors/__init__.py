@@ -8,6 +8,7 @@ from .audio_processor import AudioProcessor
 from .character_processor import CharacterProcessor
 from .scene_compositor import SceneCompositor
 from .final_compositor import FinalCompositor
+from .pipeline_stage import PipelineStage
 
 __all__ = [
     'BaseProcessor',
@@ -15,5 +16,6 @@ __all__ = [
     'AudioProcessor',
     'CharacterProcessor',
     'SceneCompositor', 
-    'FinalCompositor'
+    'FinalCompositor',
+    'PipelineStage'
 ] 
\ No newline at end of file
@@ -48,7 +48,17 @@ class BaseProcessor(ABC):
         """
         pass
         
-    
+    def validate_input(self, input_data: Any) -> bool:
+        """
+        驗證輸入資料，子類可以覆寫此方法
+        
+        Args:
+            input_data: 輸入資料
+            
+        Returns:
+            bool: 驗證結果
+        """
+        return True
         
     def execute(self, input_data: Any) -> Any:
         """
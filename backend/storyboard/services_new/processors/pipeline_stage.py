@@ -0,0 +1,30 @@
+"""
+流程階段處理器
+把 MainPipeline 的一個階段包裝成處理器，沿用 BaseProcessor 的狀態與進度追蹤
+"""
+
+from typing import Any, Callable
+from .base_processor import BaseProcessor
+
+
+class PipelineStage(BaseProcessor):
+    """
+    流程階段
+    執行指定的函式，狀態由 get_status() 回報
+    """
+    
+    def __init__(self, name: str, func: Callable[[], Any]):
+        super().__init__(name)
+        self.func = func
+        
+    def process(self, input_data: Any) -> Any:
+        """
+        執行階段函式
+        
+        Args:
+            input_data: 未使用
+            
+        Returns:
+            階段函式的回傳值
+        """
+        return self.func()
@@ -1,14 +1,67 @@
 from celery import shared_task
-from .services.news_service import execute_newsapi, execute_news_gen
+from celery.utils import uuid
+
+# 已送出、還沒有 worker 接手的影片工作；送出前先寫入結果後端，
+# 狀態查詢才能分辨排隊中的工作與不存在的工作 ID (兩者在 Celery 都是 PENDING)
+QUEUED = 'QUEUED'
 
 @shared_task
 def task_run_newsapi(keyword):
+    # 延遲匯入：避免 worker 載入任務模組時就拉進整個渲染流程
+    from .services.news_service import execute_newsapi
     result = execute_newsapi(keyword)
     print(result)
     return f"NewsAPI executed for keyword: {keyword}"
 
 @shared_task
 def task_run_news_gen():
+    from .services.news_service import execute_news_gen
     result = execute_news_gen()
     print(result)
-    return "News generation executed"
\ No newline at end of file
+    return "News generation executed"
+
+@shared_task(bind=True)
+def task_run_news_gen_video(self, storyboard):
+    """
+    Runs MainPipeline for a storyboard submitted to NewsGenVideoView.
+    Stage progress (MainPipeline.get_status) is published as the PROGRESS state of the task,
+    so the job status endpoint can report it while the render runs.
+
+    :param storyboard: Storyboard JSON posted to the API
+    :return: Pipeline result with the final stage statuses
+    """
+    pipeline = _main_pipeline()
+    if not pipeline.initialize(storyboard):
+        raise RuntimeError('初始化失敗')
+    result = pipeline.execute(progress_callback=lambda status: self.update_state(state='PROGRESS', meta=status))
+    if result.get('status') != 'success':
+        raise RuntimeError(result.get('error_message', 'pipeline failed'))
+    result.update(pipeline.get_status())
+    return result
+
+def _main_pipeline():
+    from .services_new.main_pipeline import MainPipeline
+    return MainPipeline()
+
+def enqueue_news_gen_video(storyboard):
+    """
+    Queues task_run_news_gen_video under a new job id, recorded as QUEUED in the result
+    backend before the task is sent, so the id is known even before a worker picks it up.
+
+    :param storyboard: Storyboard JSON posted to the API
+    :return: AsyncResult of the job
+    """
+    job_id = uuid()
+    task_run_news_gen_video.backend.store_result(job_id, None, QUEUED)
+    return task_run_news_gen_video.apply_async((storyboard,), task_id=job_id)
+
+@shared_task
+def cleanup_old_files():
+    """
+    Janitor run by Celery beat: keeps generated/ and the render cache under their disk quotas
+    (see janitor.run_janitor). Jobs in flight hold a lease on their workspace and are skipped.
+    """
+    from .services.janitor import run_janitor
+    report = run_janitor()
+    print(report)
+    return report
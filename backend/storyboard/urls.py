@@ -1,11 +1,13 @@
 from django.urls import path
 from .views import (
     NewsGenVideoView,
+    NewsGenVideoStatusView,
     GetGeneratedVideoView,
 )
 from . import views
 
 urlpatterns = [
     path('storyboard/gen-video', NewsGenVideoView.as_view(), name='execute_news_gen_video'),
+    path('storyboard/gen-video/<str:job_id>', NewsGenVideoStatusView.as_view(), name='news_gen_video_status'),
     path('storyboard/get-generated-video', GetGeneratedVideoView.as_view(), name='get_generated_videos'),  # Add this line
 ]
\ No newline at end of file
@@ -3,12 +3,21 @@ from datetime import datetime
 import logging
 from rest_framework.views import APIView
 from django.views import View
-from django.http import FileResponse, HttpResponseNotFound, HttpResponseBadRequest, JsonResponse
+from django.http import HttpResponseNotFound, HttpResponseBadRequest, JsonResponse
 from django.conf import settings
 import traceback
 import os
+import re
 import logging
-from storyboard.services_new.main_pipeline import MainPipeline
+from celery.result import AsyncResult
+from django.urls import reverse
+from projectNews.celery import app as celery_app
+from storyboard.tasks import QUEUED, enqueue_news_gen_video
+from storyboard.services.artifact_index import read_artifact_index
+from storyboard.services.captions import CAPTION_MODES
+from storyboard.services.encoder_profiles import ENCODER_PROFILES
+from storyboard.services.job_workspace import JobWorkspace, mark_access
+from storyboard.services.video_delivery import serve_artifact
 
 logger = logging.getLogger(__name__)
 
@@ -21,19 +30,41 @@ class NewsGenVideoView(APIView):
 
         if not storyboard:
             return JsonResponse({'error': 'Missing storyboard parameter'}, status=400)
+        encoder_profile = storyboard.get('encoderProfile')
+        if encoder_profile and encoder_profile not in ENCODER_PROFILES:
+            return JsonResponse({'error': f'Unknown encoderProfile: {encoder_profile}',
+                                 'available': list(ENCODER_PROFILES)}, status=400)
+        caption_mode = storyboard.get('captionMode')
+        if caption_mode and caption_mode not in CAPTION_MODES:
+            return JsonResponse({'error': f'Unknown captionMode: {caption_mode}',
+                                 'available': list(CAPTION_MODES)}, status=400)
         try:
-            
-            pipeline = MainPipeline()  # 不傳參數到 __init__
-            if not pipeline.initialize(storyboard):  # 檢查初始化是否成功
-                return JsonResponse({'error': '初始化失敗'}, status=500)
-            result = pipeline.execute()
-            random_id = pipeline.random_id
-            
+            # 渲染交給 Celery worker，請求立即回傳工作 ID
+            job = enqueue_news_gen_video(storyboard)
         except Exception as e:
-            print(f"Error in combine_media: {str(e)}")
+            print(f"Error queueing video job: {str(e)}")
             print(traceback.format_exc())
             return JsonResponse({'message': 'error'}, status=500)
-        return JsonResponse({'message': 'success', 'image_urls': random_id}, status=200)
+        return JsonResponse({'message': 'accepted', 'job_id': job.id,
+                             'status_url': reverse('news_gen_video_status', args=[job.id])}, status=202)
+
+class NewsGenVideoStatusView(View):
+    def get(self, request, job_id):
+        job = AsyncResult(job_id, app=celery_app)
+        state = job.state
+        # 送出的工作一律先記錄為 QUEUED，仍是 PENDING 代表從未送出 (或結果已過期)
+        if state == 'PENDING':
+            return JsonResponse({'error': 'Unknown job_id', 'job_id': job_id}, status=404)
+        body = {'job_id': job_id, 'state': 'pending' if state == QUEUED else state.lower()}
+        
+        if state == 'PROGRESS':
+            # 執行中：MainPipeline.get_status() 的各階段進度
+            body.update(job.info or {})
+        elif state == 'SUCCESS':
+            body.update(job.result or {})
+        elif state == 'FAILURE':
+            body['error'] = str(job.result)
+        return JsonResponse(body, status=200)
 
 class GetGeneratedVideoView(View):
     def get(self, request):
@@ -42,26 +73,32 @@ class GetGeneratedVideoView(View):
         if not id:
             logger.warning("Missing id parameter in request")
             return HttpResponseBadRequest("Missing id parameter")
+        if not re.fullmatch(r'[a-z0-9]+', id):
+            logger.warning(f"Invalid id parameter: {id}")
+            return HttpResponseBadRequest("Invalid id parameter")
 
-        video_dir = os.path.join(settings.MEDIA_ROOT, 'generated', id)
+        workspace = JobWorkspace(id)
+        video_dir = workspace.path
 
-        # 確保目錄存在
-        if not os.path.exists(video_dir):
+        # 短暫持有租約，直到成品已開啟 (或交給 web server)，清理不會在這之間刪掉它
+        try:
+            lease = workspace.acquire()
+        except FileNotFoundError:
             logger.warning(f"Directory not found: {video_dir}")
             return HttpResponseNotFound("Video directory not found")
 
-        # 搜尋包含 'final_video' 的檔案
-        final_video_file = None
-        for filename in os.listdir(video_dir):
-            if 'final_video' in filename:
-                final_video_file = filename
-                break
+        with lease:
+            # 渲染完成時寫入的成品索引，不必掃描目錄
+            artifact = read_artifact_index(video_dir)
+            if artifact is None:
+                logger.warning(f"Final video file not found in directory: {video_dir}")
+                return HttpResponseNotFound("Final video not found")
 
-        if final_video_file:
-            video_path = os.path.join(video_dir, final_video_file)
-            logger.info(f"Serving video file: {video_path}")
-            return FileResponse(open(video_path, 'rb'), content_type='video/mp4')
-        else:
-            logger.warning(f"Final video file not found in directory: {video_dir}")
-            return HttpResponseNotFound("Final video not found")
-        
+            logger.info(f"Serving video file: {artifact['path']}")
+            # 記錄讀取時間，清理時依最近使用時間淘汰
+            mark_access(video_dir)
+            try:
+                return serve_artifact(request, artifact)
+            except FileNotFoundError:
+                logger.warning(f"Final video file disappeared: {artifact['path']}")
+                return HttpResponseNotFound("Final video not found")
@@ -0,0 +1,10 @@
+import os
+
+import django
+
+# 測試使用專案設定；不需要 redis：工作在請求中直接執行 (eager)，broker 與結果後端都放在記憶體
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'projectNews.settings')
+os.environ['CELERY_TASK_ALWAYS_EAGER'] = '1'
+os.environ['CELERY_BROKER_URL'] = 'memory://'
+os.environ['CELERY_RESULT_BACKEND'] = 'cache+memory://'
+django.setup()
@@ -0,0 +1,47 @@
+import wave
+
+import numpy as np
+import pytest
+from storyboard.services.audio_assembly import assemble_audio, decode_pcm, fit_samples, samples_for_frames
+
+
+def _write_tone(path, seconds, sample_rate=44100):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    tone = (np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16)
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(tone.tobytes())
+
+
+def test_fit_samples_trims_pads_and_fades():
+    pcm = np.full((100, 2), 1000, dtype=np.int16)
+    trimmed = fit_samples(pcm, 60)
+    assert trimmed.shape == (60, 2) and (trimmed == 1000).all()
+    # 不足的部分補靜音，交界處淡入淡出
+    padded = fit_samples(pcm, 150, fade_samples=10)
+    assert padded.shape == (150, 2)
+    assert (padded[100:] == 0).all()
+    assert padded[0, 0] == 0 and padded[99, 0] == 0
+    assert (padded[10:90] == 1000).all()
+
+
+def test_samples_for_frames_is_exact_at_25fps():
+    assert samples_for_frames(25, 25) == 44100
+    assert samples_for_frames(1, 25) == 1764
+
+
+def test_assemble_audio_places_parts_on_frame_boundaries(tmp_path):
+    voice = tmp_path / "voice.wav"
+    _write_tone(voice, 1.0)
+    output = tmp_path / "audio.m4a"
+    parts = [(str(voice), samples_for_frames(10, 25)), (None, samples_for_frames(5, 25)),
+             (str(voice), samples_for_frames(30, 25))]
+    assemble_audio(parts, str(output))
+    pcm = decode_pcm(str(output))
+    # AAC 只會在結尾補到完整的編碼框
+    assert len(pcm) == pytest.approx(45 * 1764, abs=1024)
+    # 第二段是靜音，第三段從第 15 幀開始
+    assert np.abs(pcm[11 * 1764:14 * 1764]).max() < 50
+    assert np.abs(pcm[16 * 1764:20 * 1764]).max() > 4000
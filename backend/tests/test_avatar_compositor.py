@@ -0,0 +1,123 @@
+import cv2
+import numpy as np
+import pytest
+from storyboard.services.avatar_compositor import (
+    AvatarFrameCompositor,
+    checked_avatar_precision,
+    validate_avatar_precision,
+)
+from storyboard.services.ffmpeg_writer import FFmpegPipeWriter
+from storyboard.services.layer_compositor import psnr
+
+THRESHOLD = 10
+CROP = (10, 0, 100, 90)
+
+
+def _reference_blend(frame, composed_background, crop_coords, placement_coords):
+    # 原本 avatar_2_background 的逐幀運算：整張畫布透視變換後以浮點數混合
+    x, y, w, h = crop_coords
+    bg_height, bg_width = composed_background.shape[:2]
+    tl, tr, br, bl = placement_coords
+    placed_width = int(max(tr[0], br[0]) - min(tl[0], bl[0]))
+    placed_height = int(max(bl[1], br[1]) - min(tl[1], tr[1]))
+    frame = cv2.cvtColor(frame[y:y+h, x:x+w], cv2.COLOR_BGR2RGB)
+    frame = cv2.resize(frame, (placed_width, placed_height))
+    gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+    mask = np.where(gray < THRESHOLD, 0, 255).astype('uint8')
+    blurred_mask = cv2.GaussianBlur(mask, (21, 21), 0).astype(float) / 255.0
+    foreground = frame * blurred_mask[:, :, np.newaxis]
+    src_pts = np.array([[0, 0], [placed_width-1, 0], [0, placed_height-1], [placed_width-1, placed_height-1]], dtype="float32")
+    dst_pts = np.array([tl, tr, bl, br], dtype="float32")
+    M = cv2.getPerspectiveTransform(src_pts, dst_pts)
+    warped_foreground = cv2.warpPerspective(foreground, M, (bg_width, bg_height))
+    warped_mask = cv2.warpPerspective(blurred_mask, M, (bg_width, bg_height))
+    blended = composed_background * (1 - warped_mask[:, :, np.newaxis]) + warped_foreground
+    return cv2.cvtColor(blended.astype(np.uint8), cv2.COLOR_RGB2BGR)
+
+
+def _background():
+    # 三個通道內容不同 (RGB)，BGR 順序弄錯就會明顯不符
+    background = np.zeros((120, 160, 3), dtype=np.uint8)
+    background[..., 0] = np.linspace(0, 255, 160, dtype=np.uint8)[np.newaxis, :]
+    background[..., 1] = 90
+    background[..., 2] = np.linspace(255, 0, 120, dtype=np.uint8)[:, np.newaxis]
+    return background
+
+
+def _avatar_frame():
+    # 黑色背景上的人偶 (BGR)
+    frame = np.zeros((90, 120, 3), dtype=np.uint8)
+    cv2.circle(frame, (60, 30), 18, (40, 120, 230), -1)
+    cv2.rectangle(frame, (35, 45), (85, 90), (220, 60, 30), -1)
+    return frame
+
+
+@pytest.mark.parametrize('placement', [
+    ((45, 15), (110, 25), (105, 112), (38, 100)),
+    # 貼齊畫布右下邊緣與超出畫布：ROI 被截在畫布內
+    ((120, 60), (160, 60), (160, 120), (120, 120)),
+    ((130, 70), (175, 70), (175, 130), (130, 130)),
+])
+def test_warp_path_matches_reference_blend(placement):
+    background, frame = _background(), _avatar_frame()
+    compositor = AvatarFrameCompositor(background, CROP, placement, THRESHOLD)
+    assert not compositor.axis_aligned
+    output = compositor.compose(frame).astype(np.int16)
+    diff = np.abs(_reference_blend(frame, background, CROP, placement).astype(np.int16) - output)
+    # 只差浮點數轉 uint8 的捨入
+    assert diff.max() <= 3
+
+    # ROI 外維持原本的背景 (轉成 BGR)
+    x0, y0, x1, y1 = compositor.roi
+    outside = np.ones(background.shape[:2], dtype=bool)
+    outside[y0:y1, x0:x1] = False
+    assert np.array_equal(output[outside], cv2.cvtColor(background, cv2.COLOR_RGB2BGR)[outside])
+
+
+def test_axis_aligned_path_matches_reference_blend():
+    background, frame = _background(), _avatar_frame()
+    placement = ((40, 20), (100, 20), (100, 110), (40, 110))
+    compositor = AvatarFrameCompositor(background, CROP, placement, THRESHOLD)
+    assert compositor.axis_aligned and compositor.M is None
+    assert compositor.roi == (40, 20, 101, 111)
+    output = compositor.compose(frame).astype(np.int16)
+    diff = np.abs(_reference_blend(frame, background, CROP, placement).astype(np.int16) - output)
+    # 直接縮放取代透視變換：取樣位置差不到一個像素，只有人偶邊緣略有差異
+    assert diff.mean() < 1.0
+    assert np.percentile(diff, 99) <= 8
+
+
+def test_compose_reuses_output_buffer():
+    background = _background()
+    compositor = AvatarFrameCompositor(background, CROP, ((40, 20), (100, 20), (100, 110), (40, 110)), THRESHOLD)
+    first = compositor.compose(_avatar_frame())
+    second = compositor.compose(np.zeros((90, 120, 3), dtype=np.uint8))
+    assert first is second
+    # 全黑的畫面完全被去背，只剩背景
+    assert np.array_equal(second, cv2.cvtColor(background, cv2.COLOR_RGB2BGR))
+
+
+@pytest.mark.parametrize('placement', [
+    ((40, 20), (100, 20), (100, 110), (40, 110)),
+    ((45, 15), (110, 25), (105, 112), (38, 100)),
+])
+def test_fixed_point_blend_matches_float_blend(placement):
+    background, frame = _background(), _avatar_frame()
+    results = [AvatarFrameCompositor(background, CROP, placement, THRESHOLD, precision=precision).compose(frame).copy()
+               for precision in ('float', 'fixed')]
+    # 定點運算只有四捨五入誤差
+    assert psnr(results[0], results[1]) > 40
+
+
+def test_fixed_point_avatar_blend_is_checked_against_float(tmp_path):
+    clip = str(tmp_path / 'avatar.mp4')
+    with FFmpegPipeWriter(clip, (120, 90), 25, preset='ultrafast', crf=0) as writer:
+        writer.write(_avatar_frame())
+    placement = ((45, 15), (110, 25), (105, 112), (38, 100))
+    passed, value = validate_avatar_precision(clip, _background(), CROP, placement, THRESHOLD)
+    assert passed and value > 40
+    assert checked_avatar_precision('fixed', clip, _background(), CROP, placement, THRESHOLD) == 'fixed'
+    # 達不到 PSNR 下限時改用 float
+    assert checked_avatar_precision('fixed', clip, _background(), CROP, placement, THRESHOLD,
+                                    min_psnr=float('inf')) == 'float'
+    assert checked_avatar_precision('float', clip, _background(), CROP, placement, THRESHOLD) == 'float'
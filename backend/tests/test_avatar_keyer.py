@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+from storyboard.services.avatar_keyer import AvatarKeyer
+from storyboard.services.create_scene import avatar_2_background
+from storyboard.services.encoder_profiles import EncoderProfile
+from storyboard.services.ffmpeg_reader import FFmpegPipeReader
+from storyboard.services.ffmpeg_writer import FFmpegPipeWriter
+
+# 無損編碼，兩種模式的輸出差異只來自去背遮罩
+LOSSLESS = EncoderProfile('lossless', 1.0, 'ultrafast', 0)
+
+
+def _avatar_frame():
+    # 黑色背景上的人偶輪廓
+    frame = np.zeros((480, 400, 3), dtype=np.uint8)
+    cv2.circle(frame, (200, 120), 80, (120, 150, 200), -1)
+    cv2.rectangle(frame, (110, 200), (290, 480), (200, 90, 60), -1)
+    return frame
+
+
+def test_fast_keyer_matches_reference_within_tolerance():
+    frame = _avatar_frame()
+    reference = AvatarKeyer(10, mode='reference').key(frame).astype(np.int16)
+    fast = AvatarKeyer(10, mode='fast').key(frame).astype(np.int16)
+    diff = np.abs(reference - fast)
+    # 只有柔化的邊緣會有些微差異
+    assert diff.mean() < 1.0
+    assert np.percentile(diff, 99.9) <= 16
+
+
+def test_temporal_keyer_reuses_mask_for_static_frames():
+    frame = _avatar_frame()
+    keyer = AvatarKeyer(10, mode='fast', temporal_tolerance=0.5)
+    first = keyer.key(frame).copy()
+    second = keyer.key(frame)
+    assert keyer.reused_frames == 1
+    assert np.array_equal(first, second)
+
+
+def _render(tmp_path, avatar_clip, background, placement, mode):
+    output = str(tmp_path / f'avatar_{mode}.mp4')
+    avatar_2_background(avatar_clip, output, 10, background, (0, 0, 400, 480), placement,
+                        keyer=AvatarKeyer(10, mode=mode), encoder_profile=LOSSLESS, with_audio=False,
+                        precision='float')
+    with FFmpegPipeReader(output, (background.shape[1], background.shape[0])) as reader:
+        return np.stack([frame.copy() for frame in reader]).astype(np.int16)
+
+
+def test_fast_keyer_output_matches_reference_within_tolerance(tmp_path):
+    avatar_clip = str(tmp_path / 'avatar.mp4')
+    with FFmpegPipeWriter(avatar_clip, (400, 480), 25, preset='ultrafast', crf=0) as writer:
+        for shift in range(0, 20, 2):
+            writer.write(np.roll(_avatar_frame(), shift, axis=1))
+    background = np.zeros((360, 640, 3), dtype=np.uint8)
+    background[..., 0] = np.linspace(0, 255, 640, dtype=np.uint8)[np.newaxis, :]
+    background[..., 2] = 180
+
+    # 直接縮放與透視變換兩種放置方式
+    for placement in ([[300, 40], [500, 40], [500, 280], [300, 280]],
+                      [[310, 30], [520, 50], [500, 300], [290, 280]]):
+        reference = _render(tmp_path, avatar_clip, background, placement, 'reference')
+        fast = _render(tmp_path, avatar_clip, background, placement, 'fast')
+        assert reference.shape == fast.shape == (10, 360, 640, 3)
+        diff = np.abs(reference - fast)
+        # 與單獨比較遮罩相同：只有人偶的柔化邊緣略有差異
+        assert diff.mean() < 0.2
+        assert np.percentile(diff, 99.9) <= 8 and diff.max() <= 16
@@ -0,0 +1,27 @@
+import pytest
+from storyboard.services.avatar_sharding import plan_shards
+
+
+@pytest.mark.parametrize('frame_count, keyframe_times, workers, expected', [
+    # 沒有 keyframe 可對齊：整段一個 shard
+    (100, [], 4, [(0, 100)]),
+    (100, [0.0], 4, [(0, 100)]),
+    # 每秒一個 keyframe，剛好切成四等分
+    (100, [0.0, 1.0, 2.0, 3.0], 4, [(0, 25), (25, 50), (50, 75), (75, 100)]),
+    # 邊界對齊到最接近的 keyframe，重複的 keyframe 不會產生空的 shard
+    (100, [0.0, 2.0, 5.0, 9.0], 4, [(0, 50), (50, 100)]),
+    (100, [0.0, 0.92, 1.0], 4, [(0, 25), (25, 100)]),
+    # 超出影片長度的 keyframe 不採用
+    (100, [0.0, 2.0, 4.0, 6.0], 4, [(0, 50), (50, 100)]),
+    # worker 比畫格多
+    (3, [0.0, 0.04, 0.08], 8, [(0, 1), (1, 2), (2, 3)]),
+    # 只要一個 shard
+    (100, [0.0, 1.0, 2.0, 3.0], 1, [(0, 100)]),
+    (0, [0.0], 4, []),
+])
+def test_plan_shards(frame_count, keyframe_times, workers, expected):
+    shards = plan_shards(frame_count, 25, keyframe_times, workers)
+    assert shards == expected
+    # 每一幀剛好屬於一個 shard：不重複也不遺漏
+    frames = [frame for start, end in shards for frame in range(start, end)]
+    assert frames == list(range(frame_count))
@@ -0,0 +1,73 @@
+import numpy as np
+from PIL import ImageFont
+from storyboard.services.captions import (
+    CaptionCue,
+    CaptionOverlay,
+    build_caption_cues,
+    wrap_caption,
+    write_webvtt,
+)
+
+CANVAS = (320, 180)
+
+
+def _font():
+    return ImageFont.load_default(size=16)
+
+
+def test_wrap_breaks_after_punctuation_and_by_width():
+    font = _font()
+    assert wrap_caption('Hello there, world.', font, 1000) == ['Hello there,', 'world.']
+    lines = wrap_caption('x' * 200, font, 100)
+    assert len(lines) > 1
+    assert all(font.getlength(line) <= 100 for line in lines)
+
+
+def test_cues_cover_the_paragraph_in_proportion_to_length():
+    cues = build_caption_cues(['aaaa', 'bb', 'cccccc'], 120)
+    assert [(cue.start_frame, cue.end_frame) for cue in cues] == [(0, 40), (40, 60), (60, 120)]
+
+
+def test_overlay_only_redraws_when_the_cue_changes():
+    frame = np.full((CANVAS[1], CANVAS[0], 3), 90, dtype=np.uint8)
+    clean = frame.copy()
+    overlay = CaptionOverlay([CaptionCue(0, 10, 'first'), CaptionCue(20, 30, 'second')], CANVAS, _font())
+    overlay.attach(frame)
+    touched = [overlay.update(i) for i in range(35)]
+    assert [i for i, changed in enumerate(touched) if changed] == [0, 10, 20, 30]
+    # 字幕消失後畫面還原成原本的背景
+    assert np.array_equal(frame, clean)
+
+
+def test_overlay_redraws_over_the_dynamic_rect_every_frame():
+    frame = np.full((CANVAS[1], CANVAS[0], 3), 90, dtype=np.uint8)
+    overlay = CaptionOverlay([CaptionCue(0, 10, 'caption text')], CANVAS, _font())
+    x0, y0, x1, y1 = overlay.rect
+    dynamic = (0, 0, (x0 + x1) // 2, CANVAS[1])
+    overlay.attach(frame, dynamic_rect=dynamic)
+    overlay.update(0)
+    first = frame.copy()
+    for i in range(1, 5):
+        # 模擬人偶合成每幀重寫 dynamic_rect
+        frame[:, :dynamic[2]] = 90
+        assert overlay.update(i)
+        assert np.array_equal(frame, first)
+
+
+def test_stills_split_on_cue_boundaries():
+    frame = np.zeros((CANVAS[1], CANVAS[0], 3), dtype=np.uint8)
+    overlay = CaptionOverlay([CaptionCue(5, 10, 'a'), CaptionCue(10, 20, 'b')], CANVAS, _font())
+    runs = overlay.stills(frame, 25)
+    assert [count for _, count in runs] == [5, 5, 10, 5]
+    assert not runs[0][0].any() and not runs[3][0].any()
+    assert runs[1][0].any()
+
+
+def test_webvtt_timestamps(tmp_path):
+    path = tmp_path / "captions.vtt"
+    write_webvtt([CaptionCue(0, 30, 'first'), CaptionCue(30, 95, 'second')], str(path), 25)
+    assert path.read_text(encoding='utf-8') == (
+        'WEBVTT\n\n'
+        '00:00:00.000 --> 00:00:01.200\nfirst\n\n'
+        '00:00:01.200 --> 00:00:03.800\nsecond\n\n'
+    )
@@ -0,0 +1,79 @@
+import multiprocessing
+import os
+import socket
+
+import cv2
+from storyboard.services.cpu_budget import CpuBudget, budgeted_workers, ffmpeg_thread_args, split_threads
+
+
+def test_jobs_share_the_cores_and_release_them():
+    previous = cv2.getNumThreads()
+    budget = CpuBudget(8)
+    try:
+        with budget.job() as first:
+            assert first == 8
+            with budget.job() as second:
+                # 兩個工作同時執行時各分一半，並套用到 OpenCV / ffmpeg
+                assert second == 4 and budget.share() == 4
+                assert cv2.getNumThreads() == 4
+                assert ffmpeg_thread_args() == ['-threads', '4']
+            assert budget.share() == 8 and budget.running_jobs == 1
+        assert budget.running_jobs == 0
+    finally:
+        cv2.setNumThreads(previous)
+
+
+def _job_in_other_process(slot_dir, started, finish, shares):
+    with CpuBudget(8, slot_dir).job() as cores:
+        shares.put(cores)
+        started.set()
+        finish.wait(10)
+
+
+def test_jobs_in_different_processes_share_the_cores(tmp_path):
+    previous = cv2.getNumThreads()
+    slot_dir = str(tmp_path / 'slots')
+    budget = CpuBudget(8, slot_dir)
+    context = multiprocessing.get_context('fork')
+    started, finish, shares = context.Event(), context.Event(), context.Queue()
+    try:
+        with budget.job() as first:
+            assert first == 8
+            # 另一個 worker 行程 (prefork) 的工作也算進同一份預算
+            other = context.Process(target=_job_in_other_process, args=(slot_dir, started, finish, shares))
+            other.start()
+            assert started.wait(10)
+            assert shares.get(timeout=10) == 4
+            assert budget.running_jobs == 2 and budget.share() == 4
+            finish.set()
+            other.join(10)
+            assert budget.share() == 8
+        assert budget.running_jobs == 0
+    finally:
+        cv2.setNumThreads(previous)
+
+
+def test_slots_of_dead_processes_stop_counting(tmp_path):
+    slot_dir = tmp_path / 'slots'
+    slot_dir.mkdir()
+    process = multiprocessing.get_context('fork').Process(target=os.getpid)
+    process.start()
+    process.join()
+    (slot_dir / f'{socket.gethostname()}-{process.pid}-dead').touch()
+    # 其他主機的工作使用自己的核心，不計入本節點
+    (slot_dir / f'other-host-{os.getpid()}-remote').touch()
+    budget = CpuBudget(8, str(slot_dir))
+    assert budget.running_jobs == 0 and budget.share() == 8
+    assert not (slot_dir / f'{socket.gethostname()}-{process.pid}-dead').exists()
+
+
+def test_split_threads_never_drops_below_one():
+    assert split_threads(8, 3) == 2
+    assert split_threads(2, 4) == 1
+    assert split_threads(4, 0) == 4
+
+
+def test_media_pools_stay_within_the_budget():
+    assert budgeted_workers(10, 4) == 4
+    assert budgeted_workers(5, 8) == 5
+    assert budgeted_workers(10, 0) == 1
@@ -0,0 +1,20 @@
+import pytest
+from storyboard.services.config import HALF_CONFIG
+from storyboard.services.encoder_profiles import get_encoder_profile, scale_layout_config
+
+
+def test_draft_profile_scales_layout():
+    profile = get_encoder_profile('draft')
+    config = scale_layout_config(HALF_CONFIG, profile.scale)
+    assert config['canvas_size'] == (960, 540)
+    assert config['avatar_place_coordinates']['bottom_right'] == [368, 434]
+    # 裁切座標是原始人偶影片的像素，不跟著縮放
+    assert config['crop_coords'] == HALF_CONFIG['crop_coords']
+    # 原本的設定不能被改到
+    assert HALF_CONFIG['canvas_size'] == (1920, 1080)
+
+
+def test_unknown_profile_is_rejected():
+    assert get_encoder_profile(None).name == 'final'
+    with pytest.raises(ValueError):
+        get_encoder_profile('lossless')
@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+import pytest
+from storyboard.services.ffmpeg_reader import FFmpegPipeReader
+from storyboard.services.ffmpeg_writer import run_ffmpeg
+
+
+@pytest.fixture(scope='module')
+def clip(tmp_path_factory):
+    # 2 秒 25 fps 的測試畫面，每幀內容不同；無損編碼、每 5 幀一個 keyframe
+    path = str(tmp_path_factory.mktemp('reader') / 'testsrc.mp4')
+    run_ffmpeg(['-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc=size=320x240:rate=25:duration=2',
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '0', '-g', '5', '-pix_fmt', 'yuv420p', path])
+    return path
+
+
+@pytest.fixture(scope='module')
+def full_frames(clip):
+    with FFmpegPipeReader(clip, (320, 240)) as reader:
+        return np.stack([frame.copy() for frame in reader])
+
+
+def test_decodes_every_frame_into_one_buffer(clip, full_frames):
+    assert full_frames.shape == (50, 240, 320, 3)
+    with FFmpegPipeReader(clip, (320, 240)) as reader:
+        first = reader.read()
+        second = reader.read()
+        assert first is second
+        assert reader.frame_count == 2
+    assert not np.array_equal(full_frames[0], full_frames[1])
+
+
+def test_crop_and_scale_run_in_the_decoder(clip, full_frames):
+    with FFmpegPipeReader(clip, (100, 80), crop=(40, 20, 100, 80)) as reader:
+        cropped = np.stack([frame.copy() for frame in reader])
+    assert np.array_equal(cropped, full_frames[:, 20:100, 40:140])
+
+    with FFmpegPipeReader(clip, (160, 120), crop=(0, 0, 320, 240), frame_count=1) as reader:
+        scaled = reader.read().astype(np.int16)
+    expected = cv2.resize(full_frames[0], (160, 120), interpolation=cv2.INTER_AREA).astype(np.int16)
+    assert scaled.shape == (120, 160, 3)
+    # ffmpeg 在 YUV 上縮放，只有文字等細節的邊緣與 OpenCV 不同
+    diff = np.abs(scaled - expected)
+    assert np.median(diff) <= 2 and diff.mean() < 8
+
+
+def test_seek_and_frame_count(clip, full_frames):
+    with FFmpegPipeReader(clip, (320, 240), start_time=0.4, frame_count=3) as reader:
+        frames = [frame.copy() for frame in reader]
+    assert len(frames) == 3
+    assert all(np.array_equal(frame, full_frames[10 + i]) for i, frame in enumerate(frames))
+
+
+def test_fps_filter_and_pixel_format(clip, full_frames):
+    with FFmpegPipeReader(clip, (320, 240), fps=10) as reader:
+        assert sum(1 for _ in reader) == 20
+    with FFmpegPipeReader(clip, (320, 240), pix_fmt='rgb24', frame_count=1) as reader:
+        assert np.array_equal(reader.read(), full_frames[0][:, :, ::-1])
+
+
+def test_closing_early_kills_the_decoder_quietly(clip):
+    reader = FFmpegPipeReader(clip, (320, 240))
+    reader.read()
+    reader.close()
+    assert reader.read() is None
+
+
+def test_decoder_failure_is_raised(tmp_path):
+    reader = FFmpegPipeReader(str(tmp_path / 'missing.mp4'), (320, 240))
+    with pytest.raises(RuntimeError, match='ffmpeg failed'):
+        reader.read()
@@ -0,0 +1,61 @@
+import imageio_ffmpeg
+import numpy as np
+import pytest
+from storyboard.services.ffmpeg_writer import FFmpegPipeWriter, probe_media_format
+
+SIZE = (64, 48)
+
+
+def _frame(value):
+    return np.full((SIZE[1], SIZE[0], 3), value, dtype=np.uint8)
+
+
+def test_round_trip_keeps_frame_count_and_size(tmp_path):
+    output = str(tmp_path / 'out.mp4')
+    with FFmpegPipeWriter(output, SIZE, 25) as writer:
+        for i in range(12):
+            writer.write(_frame(i * 20))
+        # 不連續的畫面 (例如切片) 也能寫入
+        writer.write(np.zeros((SIZE[1], SIZE[0] * 2, 3), dtype=np.uint8)[:, ::2])
+    assert writer.frame_count == 13
+    assert imageio_ffmpeg.count_frames_and_secs(output) == (13, 0.52)
+    info = probe_media_format(output)
+    assert (info['width'], info['height'], info['pix_fmt']) == (64, 48, 'yuv420p')
+
+
+def test_frame_of_wrong_shape_is_rejected(tmp_path):
+    with FFmpegPipeWriter(str(tmp_path / 'out.mp4'), SIZE, 25) as writer:
+        with pytest.raises(ValueError):
+            writer.write(np.zeros((SIZE[0], SIZE[1], 3), dtype=np.uint8))
+        with pytest.raises(ValueError):
+            writer.write(np.zeros((SIZE[1], SIZE[0], 3), dtype=np.float32))
+        writer.write(_frame(0))
+    assert writer.frame_count == 1
+
+
+def test_ffmpeg_exiting_early_raises_with_its_log(tmp_path):
+    # 輸出目錄不存在：ffmpeg 讀到第一幀後就結束，之後的寫入碰到斷掉的管線
+    output = str(tmp_path / 'missing' / 'out.mp4')
+    writer = FFmpegPipeWriter(output, SIZE, 25)
+    with pytest.raises(RuntimeError, match='No such file or directory'):
+        for _ in range(500):
+            writer.write(_frame(0))
+        writer.close()
+    assert writer._proc is None
+
+
+def test_close_reports_failure_without_broken_pipe(tmp_path):
+    writer = FFmpegPipeWriter(str(tmp_path / 'missing' / 'out.mp4'), SIZE, 25)
+    writer.write(_frame(0))
+    with pytest.raises(RuntimeError, match='ffmpeg failed'):
+        writer.close()
+
+
+def test_exception_inside_block_aborts_the_encode(tmp_path):
+    output = tmp_path / 'out.mp4'
+    with pytest.raises(KeyError):
+        with FFmpegPipeWriter(str(output), SIZE, 25) as writer:
+            writer.write(_frame(0))
+            raise KeyError('render failed')
+    # 例外照原樣拋出，ffmpeg 被直接結束而不是等它寫完
+    assert writer._proc is None
@@ -0,0 +1,60 @@
+import os
+
+from storyboard.services.janitor import enforce_cache_quota, enforce_generated_quota
+from storyboard.services.job_workspace import JobWorkspace, mark_access
+
+
+def _workspace(root, age, leased=False):
+    lease = JobWorkspace.create(root=str(root))
+    path = lease.workspace.path
+    files = {'news_1.mp3': 400, 'final_output_paragraph_1.mp4': 600, 'news_final_video.mp4': 1000}
+    for name, size in files.items():
+        with open(os.path.join(path, name), 'wb') as f:
+            f.write(b'\0' * size)
+        os.utime(os.path.join(path, name), (age, age))
+    os.utime(path, (age, age))
+    if not leased:
+        lease.release()
+    return path
+
+
+def test_intermediates_go_before_finals_and_leased_jobs_stay(tmp_path):
+    oldest = _workspace(tmp_path, 1000)
+    older = _workspace(tmp_path, 2000)
+    busy = _workspace(tmp_path, 500, leased=True)
+    # 共 6000 bytes；上限 4000 只需刪掉兩個閒置工作的中間檔
+    report = enforce_generated_quota(4000, root=str(tmp_path))
+    assert report['freed_bytes'] == 2000 and report['removed'] == []
+    assert sorted(os.listdir(oldest)) == sorted(os.listdir(older)) == ['news_final_video.mp4']
+    assert len(os.listdir(busy)) == 4
+
+    # 仍超量時才移除最久沒用的工作 (含成品)，進行中的工作永遠不動
+    report = enforce_generated_quota(3000, root=str(tmp_path))
+    assert report['removed'] == [os.path.basename(oldest)]
+    assert not os.path.exists(oldest) and os.path.exists(older) and os.path.exists(busy)
+
+
+def test_recently_served_workspaces_are_not_removed(tmp_path):
+    oldest = _workspace(tmp_path, 1000)
+    served = _workspace(tmp_path, 500)
+    # web server (x-accel / x-sendfile) 可能還在讀取剛交出的成品
+    mark_access(served)
+    report = enforce_generated_quota(0, root=str(tmp_path), grace=3600)
+    assert report['removed'] == [os.path.basename(oldest)]
+    assert sorted(os.listdir(served)) == ['.last_access', 'news_final_video.mp4']
+
+    # 寬限期過後照常移除
+    assert enforce_generated_quota(0, root=str(tmp_path))['removed'] == [os.path.basename(served)]
+
+
+def test_cache_quota_evicts_least_recently_used(tmp_path):
+    plates = tmp_path / 'plates'
+    plates.mkdir()
+    (plates / 'plate.npy').write_bytes(b'\0' * 100)
+    for i, name in enumerate(['old', 'recent', 'newest']):
+        entry = tmp_path / f'{name}.mp4'
+        entry.write_bytes(b'\0' * 100)
+        os.utime(entry, (1000 + i, 1000 + i))
+    report = enforce_cache_quota(200, str(tmp_path), exclude=[str(plates)])
+    assert report['removed'] == 1
+    assert sorted(os.listdir(tmp_path)) == ['newest.mp4', 'plates', 'recent.mp4']
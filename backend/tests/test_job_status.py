@@ -0,0 +1,81 @@
+import json
+
+import pytest
+from django.test import RequestFactory, override_settings
+from projectNews.celery import app as celery_app
+from storyboard import tasks
+from storyboard.views import NewsGenVideoStatusView, NewsGenVideoView
+
+
+class FakePipeline:
+    # 代替 MainPipeline：回報一次進度後依 outcome 成功或失敗
+    outcome = 'success'
+    seen_status = None
+
+    def initialize(self, storyboard):
+        return True
+
+    def execute(self, progress_callback=None):
+        progress_callback({'current_stage': 'render', 'progress': 50})
+        # 工作執行中查詢狀態
+        FakePipeline.seen_status = _status(tasks.task_run_news_gen_video.request.id)
+        if self.outcome == 'success':
+            return {'status': 'success', 'video_url': 'final.mp4'}
+        return {'status': 'error', 'error_message': 'render failed'}
+
+    def get_status(self):
+        return {'current_stage': 'done', 'progress': 100}
+
+
+@pytest.fixture
+def eager(monkeypatch):
+    # eager 模式預設不保存結果；狀態查詢需要讀到 PROGRESS / SUCCESS / FAILURE
+    monkeypatch.setitem(celery_app.conf, 'task_store_eager_result', True)
+    monkeypatch.setitem(celery_app.conf, 'task_eager_propagates', False)
+    monkeypatch.setattr(tasks, '_main_pipeline', FakePipeline)
+    FakePipeline.outcome, FakePipeline.seen_status = 'success', None
+    # 只載入 storyboard 的路由 (與 projectNews.urls 中的路徑相同)
+    with override_settings(ROOT_URLCONF='storyboard.urls'):
+        yield
+
+
+def _post(storyboard):
+    request = RequestFactory().post('/storyboard/gen-video', json.dumps(storyboard), content_type='application/json')
+    return NewsGenVideoView.as_view()(request)
+
+
+def _status(job_id):
+    response = NewsGenVideoStatusView.as_view()(RequestFactory().get(f'/storyboard/gen-video/{job_id}'), job_id=job_id)
+    return response.status_code, json.loads(response.content)
+
+
+def test_enqueue_returns_202_with_status_url(eager):
+    response = _post({'title': 'news'})
+    assert response.status_code == 202
+    body = json.loads(response.content)
+    assert body['message'] == 'accepted'
+    assert body['status_url'].endswith(f"/storyboard/gen-video/{body['job_id']}")
+
+
+def test_progress_then_success(eager):
+    job_id = json.loads(_post({'title': 'news'}).content)['job_id']
+    assert FakePipeline.seen_status == (200, {'job_id': job_id, 'state': 'progress', 'current_stage': 'render',
+                                              'progress': 50})
+    assert _status(job_id) == (200, {'job_id': job_id, 'state': 'success', 'status': 'success',
+                                     'video_url': 'final.mp4', 'current_stage': 'done', 'progress': 100})
+
+
+def test_failure_reports_the_error(eager):
+    FakePipeline.outcome = 'error'
+    job_id = json.loads(_post({'title': 'news'}).content)['job_id']
+    status, body = _status(job_id)
+    assert status == 200 and body['state'] == 'failure' and body['error'] == 'render failed'
+
+
+def test_queued_job_is_pending_and_unknown_job_is_404(eager):
+    # 送出時先記錄為 QUEUED：worker 還沒接手時回報 pending
+    job_id = 'queued-job'
+    tasks.task_run_news_gen_video.backend.store_result(job_id, None, tasks.QUEUED)
+    assert _status(job_id) == (200, {'job_id': job_id, 'state': 'pending'})
+    status, body = _status('never-queued')
+    assert status == 404 and body['error'] == 'Unknown job_id'
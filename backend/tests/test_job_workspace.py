@@ -0,0 +1,37 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from storyboard.services.job_workspace import JobWorkspace, is_leased, remove_workspace
+
+
+def test_new_workspaces_are_unique_and_leased(tmp_path):
+    first = JobWorkspace.create(root=str(tmp_path))
+    second = JobWorkspace.create(root=str(tmp_path))
+    assert first.job_id != second.job_id
+    # 建立當下就持有租約，清理不會刪掉還沒開始用的目錄
+    assert not remove_workspace(first.workspace.path)
+    first.release()
+    assert remove_workspace(first.workspace.path)
+    assert is_leased(second.workspace.path)
+
+
+def test_leases_are_reference_counted(tmp_path):
+    with JobWorkspace.create(root=str(tmp_path)) as lease:
+        reader = lease.workspace.acquire()
+    # 建立者已釋放，但下載中的讀取者仍持有租約
+    assert not remove_workspace(lease.workspace.path)
+    reader.release()
+    assert remove_workspace(lease.workspace.path)
+    assert not (tmp_path / lease.job_id).exists()
+
+
+def test_lease_of_a_dead_process_does_not_count(tmp_path):
+    lease = JobWorkspace.create(root=str(tmp_path))
+    # 模擬持有租約的行程已結束
+    dead_pid = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                              capture_output=True, text=True).stdout.strip()
+    lease_path = Path(lease.path)
+    host, _, token = lease_path.name.rsplit('-', 2)
+    lease_path.rename(lease_path.with_name(f"{host}-{dead_pid}-{token}"))
+    assert remove_workspace(lease.workspace.path)
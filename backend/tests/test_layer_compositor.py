@@ -0,0 +1,117 @@
+import numpy as np
+from PIL import Image
+from storyboard.services.layer_compositor import (
+    LayerCache,
+    axis_aligned_rect,
+    blend_layer,
+    canvas_to_rgb,
+    new_canvas,
+    psnr,
+    shared_layer_paths,
+    warp_layer,
+)
+
+
+def _save_png(path, rgba):
+    Image.fromarray(rgba, 'RGBA').save(path)
+
+
+def test_layer_cache_reuses_plate_for_same_content(tmp_path):
+    # 準備測試資料
+    rgba = np.full((20, 40, 4), 255, dtype=np.uint8)
+    _save_png(tmp_path / "background.png", rgba)
+    quad = [[0, 0], [39, 0], [39, 19], [0, 19]]
+    cache = LayerCache(max_entries=2)
+    # 同一個檔案、同樣位置只變換一次
+    first = cache.get_or_build(str(tmp_path / "background.png"), quad, (40, 20))
+    second = cache.get_or_build(str(tmp_path / "background.png"), quad, (40, 20))
+    assert first is second
+    assert len(cache) == 1
+    # 位置改變就是不同的快取項目
+    cache.get_or_build(str(tmp_path / "background.png"), [[1, 0], [39, 0], [39, 19], [1, 19]], (40, 20))
+    assert len(cache) == 2
+
+
+def test_shared_layer_paths_only_returns_repeated_layers():
+    paragraphs = [
+        {"images": [{"img_path": "background_half.jpg"}, {"img_path": "title.png"}, {"img_path": "news_1.png"}]},
+        {"images": [{"img_path": "background_half.jpg"}, {"img_path": "title.png"}, {"img_path": "news_2.png"}]},
+    ]
+    assert shared_layer_paths(paragraphs) == {"background_half.jpg", "title.png"}
+
+
+def test_warp_layer_only_covers_quad_roi():
+    img = np.ones((10, 20, 4), dtype=np.float32)
+    quad = [[100, 50], [139, 50], [139, 69], [100, 69]]
+    plate = warp_layer(img, quad, (1920, 1080))
+    # 只渲染目的四邊形的外接矩形，而不是整張畫布
+    assert (plate.x, plate.y) == (100, 50)
+    assert plate.pixels.shape[:2] == (20, 40)
+    canvas = np.zeros((1080, 1920, 4), dtype=np.float32)
+    blend_layer(canvas, plate)
+    assert np.allclose(canvas[50:70, 100:140], 1.0)
+    assert canvas[:50].sum() == 0 and canvas[:, :100].sum() == 0
+
+
+def test_fixed_point_composite_matches_float_path():
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 256, (90, 160, 4), dtype=np.uint8)
+    background[:, :, 3] = 255
+    overlay = rng.integers(0, 256, (40, 60, 4), dtype=np.uint8)
+    layers = [
+        (background, [[0, 0], [160, 0], [160, 90], [0, 90]]),
+        (overlay, [[20, 10], [110, 15], [105, 70], [25, 65]]),
+    ]
+    results = []
+    for precision in ("float", "fixed"):
+        canvas = new_canvas((160, 90), precision)
+        for rgba, quad in layers:
+            img = rgba if precision == "fixed" else rgba.astype(np.float32) / 255.0
+            blend_layer(canvas, warp_layer(img, quad, (160, 90)))
+        results.append(canvas_to_rgb(canvas))
+    # 定點運算只有四捨五入誤差
+    assert results[1].dtype == np.uint8
+    assert psnr(results[0], results[1]) > 40
+
+
+def test_axis_aligned_quads_skip_perspective_warp():
+    # config.py 裡的矩形與 FULL_CONFIG 的斜四邊形
+    assert axis_aligned_rect([[146, 890], [1049, 890], [1049, 1002], [146, 1002]]) == (146, 890, 1050, 1003)
+    assert axis_aligned_rect([[111, 97], [1324, 183], [1324, 818], [111, 932]]) is None
+    img = np.ones((10, 20, 4), dtype=np.float32)
+    plate = warp_layer(img, [[0, 0], [1920, 0], [1920, 1080], [0, 1080]], (1920, 1080))
+    # 超出畫布的最後一列/行被裁掉
+    assert plate.pixels.shape[:2] == (1080, 1920)
+    assert np.allclose(plate.pixels, 1.0)
+
+
+def test_pinned_plates_are_not_evicted(tmp_path):
+    rgba = np.full((20, 40, 4), 255, dtype=np.uint8)
+    _save_png(tmp_path / "background.png", rgba)
+    quad = [[0, 0], [39, 0], [39, 19], [0, 19]]
+    cache = LayerCache(max_entries=1)
+    key = cache.make_key(str(tmp_path / "background.png"), quad, (40, 20))
+    pinned = warp_layer(rgba.astype(np.float32) / 255.0, quad, (40, 20))
+    cache.pin(key, pinned)
+    # 共用底圖不會被 LRU 擠掉，也不會重新變換
+    cache.get_or_build(str(tmp_path / "background.png"), [[1, 0], [39, 0], [39, 19], [1, 19]], (40, 20))
+    assert cache.get_or_build(str(tmp_path / "background.png"), quad, (40, 20)) is pinned
+
+
+def test_validate_composite_precision_compares_both_paths(tmp_path):
+    from storyboard.services.create_scene import validate_composite_precision
+
+    rng = np.random.default_rng(1)
+    background = rng.integers(0, 256, (90, 160, 4), dtype=np.uint8)
+    background[:, :, 3] = 255
+    _save_png(tmp_path / "background.png", background)
+    _save_png(tmp_path / "news_1.png", rng.integers(0, 256, (40, 60, 4), dtype=np.uint8))
+    images = [
+        {"img_path": "background.png", "top_left": [0, 0], "top_right": [160, 0],
+         "bottom_right": [160, 90], "bottom_left": [0, 90], "z_index": 0},
+        {"img_path": "news_1.png", "top_left": [20, 10], "top_right": [110, 15],
+         "bottom_right": [105, 70], "bottom_left": [25, 65], "z_index": 1},
+    ]
+    passed, value = validate_composite_precision(str(tmp_path), images, (160, 90))
+    assert passed and value > 40
+    assert not validate_composite_precision(str(tmp_path), images, (160, 90), min_psnr=float("inf"))[0]
@@ -0,0 +1,65 @@
+import os
+import wave
+
+import pytest
+from storyboard.services.ffmpeg_writer import run_ffmpeg
+from storyboard.services.media_probe import probe_duration, probe_media
+
+
+def _write_wav(path, seconds, sample_rate=16000):
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(b'\x00\x00' * int(seconds * sample_rate))
+
+
+def test_wav_duration_and_cache_invalidation(tmp_path):
+    path = tmp_path / "voice.wav"
+    _write_wav(path, 2.5)
+    info = probe_media(str(path))
+    assert info['duration'] == pytest.approx(2.5)
+    assert (info['sample_rate'], info['channels']) == (16000, 1)
+    # 檔案改變 (mtime / 大小) 後要重新讀取檔頭
+    _write_wav(path, 1.0)
+    os.utime(path, ns=(1, 1))
+    assert probe_duration(str(path)) == pytest.approx(1.0)
+
+
+def test_cbr_mp3_duration_from_frame_header(tmp_path):
+    # MPEG-1 Layer III, 128 kbps, 44100 Hz，每幀 417 bytes / 1152 samples
+    frame = b'\xff\xfb\x90\x00' + b'\x00' * 413
+    path = tmp_path / "voice.mp3"
+    path.write_bytes(frame * 200)
+    info = probe_media(str(path))
+    assert info['sample_rate'] == 44100
+    assert info['duration'] == pytest.approx(200 * 1152 / 44100, rel=0.01)
+
+
+def test_probe_cache_is_bounded(tmp_path):
+    from storyboard.services.media_probe import PROBE_CACHE_SIZE, _probe_media_cached
+
+    path = tmp_path / "voice.wav"
+    _write_wav(path, 0.1)
+    _probe_media_cached.cache_clear()
+    for i in range(PROBE_CACHE_SIZE + 10):
+        # 每次改變 mtime 都是新的快取鍵
+        os.utime(path, ns=(i + 1, i + 1))
+        probe_media(str(path))
+    assert _probe_media_cached.cache_info().currsize == PROBE_CACHE_SIZE
+    # 每次回傳副本，呼叫端修改結果不會污染快取
+    info = probe_media(str(path))
+    info['duration'] = None
+    assert probe_media(str(path)) is not info and probe_media(str(path))['duration'] == pytest.approx(0.1)
+
+
+@pytest.mark.parametrize('name, args, channels', [
+    ('mono.m4a', ['-ac', '1', '-c:a', 'aac'], 1),
+    ('stereo.mp4', ['-ac', '2', '-c:a', 'aac'], 2),
+])
+def test_mp4_channels_from_sample_entry(tmp_path, name, args, channels):
+    path = str(tmp_path / name)
+    run_ffmpeg(['-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=0.5', '-ar', '22050']
+               + args + [path])
+    info = probe_media(path)
+    assert (info['format'], info['sample_rate'], info['channels']) == ('mp4', 22050, channels)
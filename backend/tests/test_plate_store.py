@@ -0,0 +1,39 @@
+import numpy as np
+from django.test import override_settings
+from PIL import Image
+from storyboard.services.layer_compositor import LayerCache
+from storyboard.services.plate_store import warm_plate_store
+from storyboard.services.render_cache import _file_digest_cached
+
+
+def _background(path, value):
+    Image.fromarray(np.full((54, 96, 3), value, dtype=np.uint8)).save(path)
+
+
+def test_warm_plate_store_reuses_digests_and_prunes_stale_plates(tmp_path):
+    (tmp_path / 'background').mkdir()
+    background = tmp_path / 'background' / 'background_half.jpg'
+    _background(background, 120)
+    plates = tmp_path / 'plates'
+    plates.mkdir()
+    (plates / 'stale.npy').write_bytes(b'')
+
+    with override_settings(BASE_DIR=str(tmp_path), PLATE_STORE_DIR=str(plates)):
+        registered = warm_plate_store(LayerCache(), 'fixed')
+        assert registered > 0
+        stored = sorted(path.name for path in plates.iterdir())
+        assert 'stale.npy' not in stored and len(stored) == registered
+
+        # 之後每次呼叫只映射已存的底圖，不再讀取並雜湊背景圖
+        misses = _file_digest_cached.cache_info().misses
+        assert warm_plate_store(LayerCache(), 'fixed') == registered
+        assert _file_digest_cached.cache_info().misses == misses
+        # 另一種精度的底圖不會被當成過期刪除
+        warm_plate_store(LayerCache(), 'float')
+        assert set(stored) < {path.name for path in plates.iterdir()}
+
+        # 背景圖換了：舊的底圖被刪除，只留下新內容的底圖
+        _background(background, 30)
+        assert warm_plate_store(LayerCache(), 'fixed') == registered
+        assert len(list(plates.iterdir())) == registered
+        assert not set(stored) & {path.name for path in plates.iterdir()}
@@ -0,0 +1,92 @@
+import os
+
+from storyboard.services.encoder_profiles import get_encoder_profile
+from storyboard.services.janitor import enforce_cache_quota
+from storyboard.services.render_cache import (
+    DIGEST_CACHE_SIZE,
+    RenderCache,
+    _file_digest_cached,
+    file_digest,
+    segment_cache_key,
+)
+
+
+def _paragraph(tmp_path, voice=b"voice-1"):
+    (tmp_path / "background.jpg").write_bytes(b"background")
+    (tmp_path / "news_1.png").write_bytes(b"image-1")
+    (tmp_path / "news_1.mp3").write_bytes(voice)
+    quad = {"top_left": [0, 0], "top_right": [10, 0], "bottom_right": [10, 10], "bottom_left": [0, 10]}
+    return {
+        "needAvatar": False,
+        "audio_path": "news_1.mp3",
+        "images": [dict(quad, img_path="background.jpg", z_index=-1), dict(quad, img_path="news_1.png", z_index=0)],
+    }
+
+
+def test_segment_key_follows_inputs(tmp_path):
+    final = get_encoder_profile('final')
+    key = segment_cache_key(str(tmp_path), _paragraph(tmp_path), (1920, 1080), (0, 0, 1, 1), final)
+    # 內容沒變，key 就不變
+    assert key == segment_cache_key(str(tmp_path), _paragraph(tmp_path), (1920, 1080), (0, 0, 1, 1), final)
+    # 換了配音或編碼設定檔就要重新渲染
+    assert key != segment_cache_key(str(tmp_path), _paragraph(tmp_path, b"voice-2"), (1920, 1080), (0, 0, 1, 1), final)
+    assert key != segment_cache_key(str(tmp_path), _paragraph(tmp_path), (1920, 1080), (0, 0, 1, 1),
+                                    get_encoder_profile('draft'))
+
+
+def test_render_cache_round_trip(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"))
+    source = tmp_path / "segment.mp4"
+    source.write_bytes(b"segment")
+    assert not cache.fetch('segments', 'ab' * 32, str(tmp_path / "out.mp4"), '.mp4')
+    cache.store('segments', 'ab' * 32, str(source), '.mp4')
+    # 之後覆寫原檔也不會影響快取內容
+    source.write_bytes(b"changed")
+    assert cache.fetch('segments', 'ab' * 32, str(tmp_path / "out.mp4"), '.mp4')
+    assert (tmp_path / "out.mp4").read_bytes() == b"segment"
+
+
+def test_writing_a_fetched_file_leaves_the_cache_intact(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"))
+    source = tmp_path / "segment.mp4"
+    source.write_bytes(b"segment")
+    cached = cache.store('segments', 'cd' * 32, str(source), '.mp4')
+    out = tmp_path / "out.mp4"
+    assert cache.fetch('segments', 'cd' * 32, str(out), '.mp4')
+    # 覆寫取出的檔案 (open 'wb'、PIL save、ffmpeg -y) 不會改到快取
+    with open(out, 'wb') as f:
+        f.write(b'CORRUPT')
+    assert open(cached, 'rb').read() == b"segment"
+    assert os.stat(cached).st_nlink == 1
+    # 目的地原本是指向快取的硬連結 (舊版取出方式) 時，只解除連結
+    os.remove(out)
+    os.link(cached, out)
+    assert cache.fetch('segments', 'cd' * 32, str(out), '.mp4')
+    out.write_bytes(b'CORRUPT')
+    assert open(cached, 'rb').read() == b"segment"
+
+
+def test_linked_cache_entries_are_not_counted_twice(tmp_path):
+    cache_root = tmp_path / "cache"
+    cache_root.mkdir()
+    (cache_root / "old.mp4").write_bytes(b'\0' * 100)
+    (cache_root / "linked.mp4").write_bytes(b'\0' * 100)
+    os.utime(cache_root / "old.mp4", (1000, 1000))
+    os.utime(cache_root / "linked.mp4", (900, 900))
+    os.link(cache_root / "linked.mp4", tmp_path / "workspace_copy.mp4")
+    # 仍被工作目錄連結的項目已計入 generated/，刪除也釋放不了空間
+    report = enforce_cache_quota(0, str(cache_root))
+    assert report == {'total_bytes': 100, 'freed_bytes': 100, 'removed': 1}
+    assert os.listdir(cache_root) == ['linked.mp4']
+
+
+def test_file_digest_memo_is_bounded(tmp_path):
+    path = tmp_path / "image.png"
+    path.write_bytes(b"image")
+    _file_digest_cached.cache_clear()
+    first = file_digest(str(path))
+    for i in range(DIGEST_CACHE_SIZE + 10):
+        # 每次改變 mtime 都是新的快取鍵
+        os.utime(path, ns=(i + 1, i + 1))
+        assert file_digest(str(path)) == first
+    assert _file_digest_cached.cache_info().currsize == DIGEST_CACHE_SIZE
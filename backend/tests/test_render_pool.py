@@ -0,0 +1,57 @@
+import pytest
+from django.test import override_settings
+from storyboard.services.create_scene import _estimate_render_bytes, _paragraph_cost, _render_pool_size
+from storyboard.services.ffmpeg_writer import run_ffmpeg
+
+FULL_HD = (1920, 1080)
+
+
+def test_estimate_render_bytes():
+    # float32 畫布與人偶緩衝每像素約 32 bytes，定點路徑約三分之一
+    assert _estimate_render_bytes(FULL_HD) == 1920 * 1080 * 32
+    assert _estimate_render_bytes(FULL_HD, 'fixed') == 1920 * 1080 * 12
+    assert _estimate_render_bytes((960, 540)) * 4 == _estimate_render_bytes(FULL_HD)
+
+
+@pytest.mark.parametrize('budget_mb, workers, cpu_slots, precision, expected', [
+    # 記憶體足夠：由 worker 數與 CPU 配額決定
+    (2048, 8, 8, 'float', (8, 1, 1)),
+    (2048, 8, 2, 'float', (2, 1, 1)),
+    (2048, 1, 8, 'float', (1, 8, 4)),
+    # 記憶體預算限制同時渲染的段落數 (1080p float 每段約 63 MB)
+    (128, 8, 8, 'float', (2, 4, 4)),
+    (128, 8, 8, 'fixed', (5, 1, 1)),
+    # 預算連一段都不夠時仍保留一段
+    (10, 8, 8, 'float', (1, 8, 4)),
+    (0, 8, 8, 'float', (1, 8, 4)),
+])
+def test_render_pool_size(budget_mb, workers, cpu_slots, precision, expected):
+    with override_settings(RENDER_MEMORY_BUDGET_MB=budget_mb, AVATAR_RENDER_WORKERS=4):
+        max_in_flight, threads, avatar_workers = _render_pool_size(FULL_HD, workers, cpu_slots, precision)
+    assert (max_in_flight, threads, avatar_workers) == expected
+    # 各段落行程的執行緒加總不超過配額
+    assert max_in_flight * threads <= max(cpu_slots, max_in_flight)
+
+
+@pytest.fixture(scope='module')
+def media(tmp_path_factory):
+    output_dir = tmp_path_factory.mktemp('cost')
+    for name, duration in (('short.wav', 0.5), ('long.wav', 2.0), ('avatar.wav', 0.3)):
+        run_ffmpeg(['-loglevel', 'error', '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+                    '-ar', '16000', str(output_dir / name)])
+    return str(output_dir)
+
+
+def test_avatar_paragraphs_are_rendered_first(media):
+    paragraphs = [
+        {"needAvatar": False, "audio_path": 'short.wav'},
+        {"needAvatar": False, "audio_path": 'long.wav'},
+        {"needAvatar": True, "video": {"avatar_path": 'avatar.wav'}},
+        {"needAvatar": False, "audio_path": 'missing.wav'},
+        {"needAvatar": False},
+    ]
+    order = sorted(range(len(paragraphs)), key=lambda i: _paragraph_cost(media, paragraphs[i]), reverse=True)
+    # 人偶段落即使最短也先渲染，其餘依長度；讀不到長度的段落排最後
+    assert order[:3] == [2, 1, 0]
+    assert _paragraph_cost(media, paragraphs[1]) == (False, pytest.approx(2.0, abs=0.05))
+    assert _paragraph_cost(media, paragraphs[3]) == _paragraph_cost(media, paragraphs[4]) == (False, 0.0)
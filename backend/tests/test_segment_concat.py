@@ -0,0 +1,81 @@
+import imageio_ffmpeg
+import numpy as np
+import pytest
+from storyboard.services.create_scene import _find_mismatched_segments
+from storyboard.services.ffmpeg_writer import (
+    SEGMENT_FPS,
+    FFmpegPipeWriter,
+    concat_copy,
+    encode_still_segment,
+    encode_still_sequence,
+    probe_media_format,
+    run_ffmpeg,
+)
+
+SIZE = (64, 48)
+
+
+def _image(value):
+    return np.full((SIZE[1], SIZE[0], 3), value, dtype=np.uint8)
+
+
+def _frames_and_seconds(path):
+    return imageio_ffmpeg.count_frames_and_secs(str(path))
+
+
+@pytest.fixture
+def segments(tmp_path):
+    # 三種段落影片：單張靜態圖、換字幕的靜態圖、逐幀合成的人偶影片
+    still = str(tmp_path / 'final_output_paragraph_1.mp4')
+    encode_still_segment(_image(40), still, 1.0, preset='ultrafast')
+    sequence = str(tmp_path / 'final_output_paragraph_2.mp4')
+    encode_still_sequence([(_image(80), 10), (_image(120), 0), (_image(160), 15)], sequence, preset='ultrafast')
+    avatar = str(tmp_path / 'final_output_paragraph_3.mp4')
+    # 與 avatar_2_background 相同：依來源長度截斷，轉幀率時不會多出重複的畫格
+    with FFmpegPipeWriter(avatar, SIZE, 30, output_fps=SEGMENT_FPS, duration=24 / 30, preset='ultrafast') as writer:
+        for i in range(24):
+            writer.write(_image(i * 10))
+    return [still, sequence, avatar]
+
+
+def test_still_encoders_hold_frames_for_the_requested_time(segments):
+    still, sequence, avatar = segments
+    assert _frames_and_seconds(still) == (25, 1.0)
+    assert _frames_and_seconds(sequence) == (25, 1.0)
+    # 30 fps 的 24 幀 (0.8 秒) 轉成 25 fps
+    assert _frames_and_seconds(avatar) == (20, 0.8)
+
+
+def test_segments_share_codec_parameters(segments):
+    formats = [probe_media_format(path) for path in segments]
+    for info in formats:
+        assert (info['video_codec'], info['width'], info['height'], info['pix_fmt']) == ('h264', 64, 48, 'yuv420p')
+        assert info['fps'] == SEGMENT_FPS and info['timescale'] == formats[0]['timescale']
+    assert _find_mismatched_segments(segments) == []
+
+
+def test_concat_copy_keeps_every_frame(segments, tmp_path):
+    output = str(tmp_path / 'final_video.mp4')
+    concat_copy(segments, output)
+    assert _frames_and_seconds(output) == (70, 2.8)
+
+
+def test_concat_copy_muxes_and_trims_audio(segments, tmp_path):
+    audio = str(tmp_path / 'voice.m4a')
+    run_ffmpeg(['-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=5', '-c:a', 'aac', audio])
+    output = str(tmp_path / 'final_video.mp4')
+    concat_copy(segments, output, audio_source=audio, duration=2.8, audio_args=['-c:a', 'aac'])
+    info = probe_media_format(output)
+    assert info['audio_codec'] == 'aac'
+    assert info['duration'] == pytest.approx(2.8, abs=0.05)
+    assert _frames_and_seconds(output)[0] == 70
+
+
+def test_mismatched_segments_are_reported(segments, tmp_path):
+    # 沒有轉成段落幀率的影片不能直接串接
+    other = str(tmp_path / 'final_output_paragraph_4.mp4')
+    with FFmpegPipeWriter(other, SIZE, 30, preset='ultrafast') as writer:
+        for i in range(6):
+            writer.write(_image(i))
+    assert _find_mismatched_segments(segments + [other]) == ['final_output_paragraph_4.mp4']
+    assert len(_find_mismatched_segments([other] + segments)) == 4
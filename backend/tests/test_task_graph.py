@@ -0,0 +1,35 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from storyboard.services.task_graph import TaskGraph, TaskSkipped
+
+
+def test_task_starts_before_unrelated_tasks_finish():
+    release = threading.Event()
+    graph = TaskGraph()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        # slow 要等 next 執行後才會結束；若依階段等待，next 永遠不會在 slow 之前開始
+        graph.add('slow', partial(pool.submit, release.wait, 5))
+        graph.add('fast', partial(pool.submit, lambda: 2))
+        graph.add('next', lambda value: pool.submit(lambda: (release.set(), value * 3)[1]), deps=['fast'])
+        results = graph.run()
+    assert results == {'slow': True, 'fast': 2, 'next': 6}
+
+
+def test_failure_skips_only_dependents():
+    def fail():
+        raise RuntimeError('tts down')
+
+    graph = TaskGraph()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        graph.add(('voice', 0), partial(pool.submit, fail), group=0)
+        graph.add(('avatar', 0), lambda audio: pool.submit(str, audio), deps=[('voice', 0)], group=0)
+        graph.add(('render', 0), lambda *media: pool.submit(len, media), deps=graph.group(0))
+        graph.add(('voice', 1), partial(pool.submit, lambda: 'p2.mp3'), group=1)
+        graph.add(('render', 1), lambda *media: pool.submit(lambda: media), deps=graph.group(1))
+        results = graph.run()
+    assert results == {('voice', 1): 'p2.mp3', ('render', 1): ('p2.mp3',)}
+    assert isinstance(graph.errors[('voice', 0)], RuntimeError)
+    assert isinstance(graph.errors[('avatar', 0)], TaskSkipped)
+    assert isinstance(graph.errors[('render', 0)], TaskSkipped)
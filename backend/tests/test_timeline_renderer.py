@@ -0,0 +1,107 @@
+import imageio_ffmpeg
+import numpy as np
+import pytest
+from storyboard.services.avatar_keyer import AvatarKeyer
+from storyboard.services.create_scene import avatar_2_background, create_video_from_image_and_audio
+from storyboard.services.encoder_profiles import EncoderProfile
+from storyboard.services.ffmpeg_writer import probe_media_format, run_ffmpeg
+from storyboard.services.timeline_renderer import TimelineEntry, build_timeline, render_timeline
+
+CANVAS = (160, 120)
+CROP = (0, 0, 320, 240)
+PROFILE = EncoderProfile('test', 1.0, 'ultrafast', 30)
+AVATAR_VIDEO = {"top_left": [80, 20], "top_right": [150, 20], "bottom_right": [150, 110], "bottom_left": [80, 110]}
+
+
+@pytest.fixture(scope='module')
+def job(tmp_path_factory):
+    # 一段 1 秒的人偶影片 (含音軌) 與兩段長度不是整數幀的旁白
+    output_dir = tmp_path_factory.mktemp('timeline')
+    run_ffmpeg(['-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc=size=320x240:rate=25:duration=1',
+                '-f', 'lavfi', '-i', 'sine=frequency=440:duration=1', '-c:v', 'libx264', '-preset', 'ultrafast',
+                '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', str(output_dir / 'avatar.mp4')])
+    for name, duration in (('voice_2.wav', 0.53), ('voice_3.wav', 0.47)):
+        run_ffmpeg(['-loglevel', 'error', '-f', 'lavfi', '-i', f'sine=frequency=330:duration={duration}',
+                    '-ar', '44100', str(output_dir / name)])
+    paragraphs = [
+        {"needAvatar": True, "images": [], "video": dict(AVATAR_VIDEO, avatar_path='avatar.mp4')},
+        {"needAvatar": False, "images": [], "audio_path": 'voice_2.wav'},
+        {"needAvatar": False, "images": [], "audio_path": 'missing.wav'},
+        {"needAvatar": False, "images": [], "audio_path": 'voice_3.wav'},
+    ]
+    return str(output_dir), paragraphs
+
+
+def _compose(output_dir, images, canvas_size, cacheable_paths=None, precision=None):
+    background = np.zeros((canvas_size[1], canvas_size[0], 3), dtype=np.uint8)
+    background[..., 0] = 200
+    return background
+
+
+def _frame_count(path):
+    return imageio_ffmpeg.count_frames_and_secs(path)[0]
+
+
+def test_build_timeline_rounds_boundaries_once(job):
+    output_dir, paragraphs = job
+    timeline = build_timeline(output_dir, paragraphs)
+    # 13.25 + 11.75 幀：邊界依累計時間取整，總長不會因逐段捨入而漂移；缺少素材的段落跳過
+    assert [(entry.index, entry.start_frame, entry.end_frame) for entry in timeline] == [(0, 0, 25), (1, 25, 38),
+                                                                                       (3, 38, 50)]
+    assert [entry.frame_count for entry in timeline] == [25, 13, 12]
+    assert timeline[0].media_path.endswith('avatar.mp4') and timeline[2].media_path.endswith('voice_3.wav')
+
+
+def test_build_timeline_drops_empty_spans(job):
+    output_dir, paragraphs = job
+    assert build_timeline(output_dir, paragraphs[2:3]) == []
+    # 以 1 fps 排列時最後一段取整後沒有任何畫格，不會產生空的片段
+    timeline = build_timeline(output_dir, paragraphs, fps=1)
+    assert timeline == [TimelineEntry(0, 0, 1, timeline[0].media_path, paragraphs[0]),
+                        TimelineEntry(1, 1, 2, timeline[1].media_path, paragraphs[1])]
+
+
+def test_render_timeline_matches_segments_path(job, tmp_path):
+    output_dir, paragraphs = job
+    output = str(tmp_path / 'timeline.mp4')
+    assert render_timeline(output_dir, paragraphs, CANVAS, CROP, output, 10, _compose, AvatarKeyer,
+                           encoder_profile=PROFILE) == output
+
+    # segments 模式：每段各自輸出後串接，總幀數應與時間軸相同
+    segment_frames = 0
+    background = _compose(output_dir, [], CANVAS)
+    for idx, paragraph in enumerate(paragraphs):
+        segment = str(tmp_path / f'segment_{idx}.mp4')
+        if paragraph["needAvatar"]:
+            video = paragraph["video"]
+            avatar_2_background(f'{output_dir}/{video["avatar_path"]}', segment, 10, background, CROP,
+                                (video["top_left"], video["top_right"], video["bottom_right"], video["bottom_left"]),
+                                keyer=AvatarKeyer(10), encoder_profile=PROFILE, with_audio=False, precision='float')
+        elif paragraph["audio_path"] != 'missing.wav':
+            create_video_from_image_and_audio(background, f'{output_dir}/{paragraph["audio_path"]}', segment,
+                                              encoder_profile=PROFILE, with_audio=False)
+        else:
+            continue
+        segment_frames += _frame_count(segment)
+
+    assert _frame_count(output) == segment_frames == 50
+    info = probe_media_format(output)
+    assert (info['width'], info['height'], info['audio_codec']) == (160, 120, 'aac')
+    assert info['duration'] == pytest.approx(2.0, abs=0.05)
+
+
+def test_failed_background_renders_black_and_keeps_the_timeline(job, tmp_path):
+    output_dir, paragraphs = job
+
+    def compose(output_dir, images, canvas_size, cacheable_paths=None, precision=None):
+        # 第二段的背景合成失敗
+        return None if images is paragraphs[1]["images"] else _compose(output_dir, images, canvas_size)
+
+    output = str(tmp_path / 'timeline.mp4')
+    assert render_timeline(output_dir, paragraphs, CANVAS, CROP, output, 10, compose, AvatarKeyer,
+                           encoder_profile=PROFILE) == output
+    # 其他段落照常輸出，失敗的段落以黑畫面補滿原本的長度
+    assert _frame_count(output) == 50
+    frames = list(imageio_ffmpeg.read_frames(output))[1:]
+    black, blue = np.frombuffer(frames[30], dtype=np.uint8), np.frombuffer(frames[45], dtype=np.uint8)
+    assert black.max() < 20 and blue.mean() > 20
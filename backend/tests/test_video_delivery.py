@@ -0,0 +1,88 @@
+import os
+
+import pytest
+from django.test import RequestFactory, override_settings
+from storyboard import views
+from storyboard.services.artifact_index import (
+    ARTIFACT_INDEX_FILE,
+    read_artifact_index,
+    write_artifact_index,
+)
+from storyboard.services.job_workspace import ACCESS_FILE, JobWorkspace, is_leased, live_leases
+from storyboard.services.video_delivery import RangeNotSatisfiable, parse_range, serve_artifact
+
+
+def test_parse_range():
+    assert parse_range(None, 1000) is None
+    assert parse_range('bytes=0-99', 1000) == (0, 99)
+    # 開放結尾與超出檔案的結尾都截到最後一個位元組
+    assert parse_range('bytes=900-', 1000) == (900, 999)
+    assert parse_range('bytes=900-5000', 1000) == (900, 999)
+    assert parse_range('bytes=-100', 1000) == (900, 999)
+    # 多段或格式錯誤時回傳整個檔案
+    assert parse_range('bytes=0-1,5-6', 1000) is None
+    assert parse_range('bytes=5-1', 1000) is None
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range('bytes=1000-', 1000)
+
+
+def test_artifact_index_round_trip(tmp_path):
+    video = tmp_path / 'news_final_video.mp4'
+    video.write_bytes(b'video-1')
+    (tmp_path / 'final_output_paragraph_1.mp4').write_bytes(b'segment')
+    entry = write_artifact_index(str(video))
+    assert read_artifact_index(str(tmp_path))['etag'] == entry['etag']
+
+    # 成品被覆寫後索引跟著更新，ETag 也會改變
+    video.write_bytes(b'video-2!')
+    refreshed = read_artifact_index(str(tmp_path))
+    assert refreshed['size'] == 8 and refreshed['etag'] != entry['etag']
+
+
+def test_legacy_job_is_indexed_on_first_read(tmp_path):
+    (tmp_path / 'news_final_video.vtt').write_bytes(b'WEBVTT')
+    (tmp_path / 'news_final_video.mp4').write_bytes(b'video')
+    entry = read_artifact_index(str(tmp_path))
+    assert entry['file'] == 'news_final_video.mp4' and entry['subtitles'] == 'news_final_video.vtt'
+    assert os.path.exists(tmp_path / ARTIFACT_INDEX_FILE)
+    assert read_artifact_index(str(tmp_path / 'missing')) is None
+
+
+@pytest.mark.parametrize('header, status, expected', [(None, 200, b'0123456789'), ('bytes=2-5', 206, b'2345')])
+def test_artifact_is_opened_before_the_response_returns(tmp_path, header, status, expected):
+    video = tmp_path / 'news_final_video.mp4'
+    video.write_bytes(b'0123456789')
+    write_artifact_index(str(video))
+    request = RequestFactory().get('/', HTTP_RANGE=header) if header else RequestFactory().get('/')
+    response = serve_artifact(request, read_artifact_index(str(tmp_path)), mode='django')
+    # 回應送出前成品被清理：已開啟的檔案仍能完整讀出
+    video.unlink()
+    assert response.status_code == status
+    assert b''.join(response.streaming_content) == expected
+    response.close()
+
+
+def test_view_serves_under_a_lease(tmp_path, monkeypatch):
+    with override_settings(BASE_DIR=str(tmp_path)):
+        lease = JobWorkspace.create()
+        job_dir = lease.workspace.path
+        lease.release()
+        with open(os.path.join(job_dir, 'news_final_video.mp4'), 'wb') as f:
+            f.write(b'video')
+        write_artifact_index(os.path.join(job_dir, 'news_final_video.mp4'))
+
+        leased = []
+
+        def serve(request, artifact):
+            leased.append(is_leased(job_dir))
+            return serve_artifact(request, artifact, mode='django')
+
+        monkeypatch.setattr(views, 'serve_artifact', serve)
+        view = views.GetGeneratedVideoView.as_view()
+        response = view(RequestFactory().get('/', {'id': lease.job_id}))
+        assert response.status_code == 200 and b''.join(response.streaming_content) == b'video'
+        response.close()
+        # 開啟成品時持有租約，回傳後立即釋放；讀取時間留給清理判斷
+        assert leased == [True] and live_leases(job_dir) == []
+        assert os.path.exists(os.path.join(job_dir, ACCESS_FILE))
+        assert view(RequestFactory().get('/', {'id': 'missingjob'})).status_code == 404